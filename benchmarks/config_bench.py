@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import copy
+import os
+import shutil
+import time
+
+from mb.config import config as mb_config
+
+
+def _clear_caches(project_dir):
+    mb_config._load_yaml.cache_clear()
+    shutil.rmtree(os.path.join(project_dir, '.build', 'cache'), ignore_errors=True)
+
+
+def bench_load_cold(fixtures):
+    """
+    Find and parse a large .mb.yml without any cache
+    """
+    project_dir, _, _ = fixtures.get('config_project')
+    _clear_caches(project_dir)
+
+    start = time.time()
+    mb_config.get_default_config_file(project_dir, os.environ)
+    return time.time() - start
+
+
+def bench_load_disk_cached(fixtures):
+    """
+    Load a large .mb.yml in a new process, with the parsed file cached on disk
+    """
+    project_dir, _, _ = fixtures.get('config_project')
+    mb_config.get_default_config_file(project_dir, os.environ)
+    mb_config._load_yaml.cache_clear()
+
+    start = time.time()
+    mb_config.get_default_config_file(project_dir, os.environ)
+    return time.time() - start
+
+
+def bench_resolve_chain(fixtures):
+    """
+    Resolve the end of a 100 deep chain of @{{...}} references
+    """
+    project_dir, _, chain_end = fixtures.get('config_project')
+    config = copy.deepcopy(mb_config.get_default_config_file(project_dir, os.environ).config)
+
+    start = time.time()
+    mb_config._get_value(config, chain_end)
+    return time.time() - start
+
+
+def bench_resolve_all(fixtures):
+    """
+    Expand every reference of a config with hundreds of commands
+    """
+    project_dir, _, _ = fixtures.get('config_project')
+    config_file = mb_config.get_default_config_file(project_dir, os.environ)
+    config = mb_config.ConfigFile(config_file.filename, copy.deepcopy(config_file.config))
+
+    start = time.time()
+    config.resolved
+    return time.time() - start
@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import shutil
+import time
+
+from mb.lib import fingerprint
+
+
+def _fingerprinter(fixtures):
+    config = fixtures.get('file_tree')
+    return (config, fingerprint.for_config(config))
+
+
+def bench_scan_cold(fixtures):
+    """
+    Hash a project of 100000 files without a stat cache
+    """
+    config, fingerprints = _fingerprinter(fixtures)
+    shutil.rmtree(fingerprints.cache_dir, ignore_errors=True)
+
+    start = time.time()
+    fingerprints.scan()
+    return time.time() - start
+
+
+def bench_scan_warm(fixtures):
+    """
+    Hash a project of 100000 unchanged files in a new process, with the stat cache of a previous one
+    """
+    config, fingerprints = _fingerprinter(fixtures)
+    fingerprints.scan()
+    fingerprints = fingerprint.for_config(config)
+
+    start = time.time()
+    fingerprints.scan()
+    return time.time() - start
+
+
+def bench_changes_in_subtree(fixtures):
+    """
+    Find what changed under one directory of 1000 files of a project of 100000 files
+    """
+    config, fingerprints = _fingerprinter(fixtures)
+    fingerprints.changes('bench', ['src/d7/**/*.py'])
+
+    start = time.time()
+    fingerprints.changes('bench', ['src/d7/**/*.py'])
+    return time.time() - start
@@ -0,0 +1,192 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from mb.config.config import ConfigFile
+
+
+class StaticBuildContext(object):
+    """
+    A build context keeping its variables in memory, the benchmarks don't depend on the tests being importable
+    """
+
+    def __init__(self, variables):
+        self.variables = variables
+
+    def add_variables(self, variables):
+        self.variables.update(variables)
+
+    def flush(self):
+        pass
+
+
+def template_project(project_dir, count=1000, variable_count=50):
+    """
+    Create a project with a template dir of `count` templates spread over 10 destination directories
+
+    Returns:
+        a tuple of the ConfigFile of the project and the variables the templates use
+    """
+    template_dir = os.path.join(project_dir, 'build_templates')
+    os.makedirs(template_dir)
+    variables = {'var{0}'.format(index): 'value{0}'.format(index) for index in range(variable_count)}
+
+    for index in range(count):
+        body = '\n'.join('line {0} ${{var{1}}} $var{2}'.format(line, (index + line) % variable_count, line % variable_count)
+                         for line in range(20))
+        with open(os.path.join(template_dir, 'template{0}.txt'.format(index)), 'w') as template:
+            template.write('# build-template|generated/{0}/template{1}.txt\n{2}\n'.format(index % 10, index, body))
+
+    return (ConfigFile(os.path.join(project_dir, '.mb.yml'), {'name': 'benchmark'}), variables)
+
+
+def config_project(project_dir, chain_depth=100, command_count=500):
+    """
+    Create a project with a large .mb.yml, `command_count` commands referencing variables
+    and a chain of `chain_depth` variables each referencing the previous one
+
+    Returns:
+        the path of the config file and the reference path of the end of the chain
+    """
+    lines = ['name: benchmark', 'variables:', '    link0: "start"']
+    for index in range(1, chain_depth):
+        lines.append('    link{0}: "@{{{{variables.link{1}}}}}-{0}"'.format(index, index - 1))
+    lines += ['config:', '    commands:']
+    for index in range(command_count):
+        lines += [
+            '        command{0}:'.format(index),
+            '            name: ShellCommand',
+            '            config:',
+            '                command: "echo @{{{{variables.link{0}}}}} {0}"'.format(index % chain_depth),
+            '                dependencies: [command{0}]'.format(max(index - 1, 0)),
+        ]
+
+    config_file = os.path.join(project_dir, '.mb.yml')
+    with open(config_file, 'w') as config:
+        config.write('\n'.join(lines) + '\n')
+    return (config_file, 'variables.link{0}'.format(chain_depth - 1))
+
+
+def plugin_project(project_dir, count=300):
+    """
+    Create a project whose plugin dir has `count` modules, each defining one command
+    """
+    plugin_dir = os.path.join(project_dir, '.build', 'plugins')
+    os.makedirs(plugin_dir)
+    commands = []
+    for index in range(count):
+        with open(os.path.join(plugin_dir, 'plugin{0}.py'.format(index)), 'w') as plugin:
+            plugin.write('from mb.command import Command\n\n\n'
+                         'class BenchCommand{0}(Command):\n'
+                         '    def _run(self, parsed_args, unknown_args, original_arguments):\n'
+                         '        pass\n'.format(index))
+        commands += ['        command{0}:'.format(index), '            name: BenchCommand{0}'.format(index)]
+
+    with open(os.path.join(project_dir, '.mb.yml'), 'w') as config:
+        config.write('\n'.join(['name: benchmark', 'config:', '    commands:'] + commands) + '\n')
+    return plugin_dir
+
+
+def tagged_repo(repo_dir, tag_count=20000, commit_count=2000):
+    """
+    Create a git repository of `commit_count` commits with `tag_count` annotated tags spread over them,
+    HEAD is a few commits past the last tag. git fast-import writes it all in one go.
+
+    Returns:
+        the ConfigFile of the repository
+    """
+    subprocess.check_call(['git', 'init', '-q', repo_dir])
+    stream = []
+    for index in range(1, commit_count + 6):
+        stream += ['commit refs/heads/bench', 'mark :{0}'.format(index),
+                   'committer mb <mb@example.com> {0} +0000'.format(1500000000 + index * 60),
+                   'data <<EOF', 'commit {0}'.format(index), 'EOF']
+        if index > 1:
+            stream.append('from :{0}'.format(index - 1))
+        stream.append('')
+
+    for index in range(tag_count):
+        stream += ['tag {0}.{1}.{2}'.format(index // 10000, (index // 100) % 100, index % 100),
+                   'from :{0}'.format(1 + index * commit_count // tag_count),
+                   'tagger mb <mb@example.com> {0} +0000'.format(1500000000 + index),
+                   'data <<EOF', 'release', 'EOF', '']
+
+    fast_import = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=repo_dir, stdin=subprocess.PIPE)
+    fast_import.communicate('\n'.join(stream).encode('utf-8'))
+    if fast_import.returncode != 0:
+        raise RuntimeError('git fast-import failed')
+    subprocess.check_call(['git', 'symbolic-ref', 'HEAD', 'refs/heads/bench'], cwd=repo_dir)
+
+    return ConfigFile(os.path.join(repo_dir, '.mb.yml'), {'name': 'benchmark'})
+
+
+def file_tree(project_dir, file_count=100000, files_per_dir=100):
+    """
+    A project of file_count small files in a two level tree, with a .gitignore ignoring a tenth of them
+    """
+    for index in range(file_count):
+        directory = os.path.join(project_dir, 'src', 'd{0}'.format(index // (files_per_dir * 10)),
+                                 'd{0}'.format(index // files_per_dir))
+        if index % files_per_dir == 0:
+            os.makedirs(directory)
+        extension = '.log' if index % 10 == 0 else '.py'
+        with open(os.path.join(directory, 'f{0}{1}'.format(index, extension)), 'w') as output:
+            output.write('value = {0}\n'.format(index))
+
+    with open(os.path.join(project_dir, '.gitignore'), 'w') as gitignore:
+        gitignore.write('*.log\n')
+    with open(os.path.join(project_dir, '.mb.yml'), 'w') as config_file:
+        config_file.write('name: benchmark\n')
+
+    # the stat cache doesn't trust files modified in the last seconds
+    past = time.time() - 60
+    for (root, _, files) in os.walk(project_dir):
+        for name in files:
+            os.utime(os.path.join(root, name), (past, past))
+    return ConfigFile(os.path.join(project_dir, '.mb.yml'), {'name': 'benchmark'})
+
+
+class Fixtures(object):
+    """
+    The fixtures of a benchmark run, each one is created the first time a benchmark asks for it
+    """
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='mb-benchmarks-')
+        self._created = {}
+
+    def _directory(self, name):
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory)
+        return directory
+
+    def get(self, name):
+        if name not in self._created:
+            self._created[name] = getattr(self, '_create_' + name)(self._directory(name))
+        return self._created[name]
+
+    def _create_config_project(self, directory):
+        return (directory,) + config_project(directory)
+
+    def _create_plugin_project(self, directory):
+        return (directory, plugin_project(directory))
+
+    def _create_tagged_repo(self, directory):
+        return tagged_repo(directory)
+
+    def _create_file_tree(self, directory):
+        return file_tree(directory)
+
+    def directory(self, name):
+        """
+        A fresh directory for benchmarks creating their own fixture
+        """
+        return self._directory('{0}-{1}'.format(name, len(os.listdir(self.root))))
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
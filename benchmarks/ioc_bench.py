@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from mb.lib.plugin_index import PluginIndex
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _plugin_types():
+    from mb import artifact_cache
+    from mb import build_context
+    from mb import command
+    from mb import template_engine
+    from mb import version_scheme
+    return [artifact_cache.ArtifactCache, build_context.BuildContext, command.Command, template_engine.TemplateEngine,
+            version_scheme.VersionScheme]
+
+
+def bench_plugin_index_cold(fixtures):
+    """
+    Index a plugin dir of 300 modules without an index file, every module is imported
+    """
+    project_dir, plugin_dir = fixtures.get('plugin_project')
+    index_file = os.path.join(fixtures.directory('plugin_index'), 'plugin_index.json')
+
+    start = time.time()
+    PluginIndex(plugin_dir, index_file, _plugin_types()).refresh()
+    return time.time() - start
+
+
+def bench_plugin_index_warm(fixtures):
+    """
+    Revalidate the index of a plugin dir of 300 unchanged modules
+    """
+    project_dir, plugin_dir = fixtures.get('plugin_project')
+    index_file = os.path.join(project_dir, '.build', 'cache', 'bench_plugin_index.json')
+    PluginIndex(plugin_dir, index_file, _plugin_types()).refresh()
+
+    start = time.time()
+    PluginIndex(plugin_dir, index_file, _plugin_types()).refresh()
+    return time.time() - start
+
+
+def bench_ioc_startup(fixtures):
+    """
+    Start a process that loads the config and the plugins of a project with 300 plugin modules,
+    the way every mb run starts. The caches are warm from a previous run.
+    """
+    project_dir, _ = fixtures.get('plugin_project')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([_ROOT, os.environ.get('PYTHONPATH', '')]))
+    command = [sys.executable, '-c', 'from mb.lib import ioc; ioc.get_commands()']
+    subprocess.check_call(command, cwd=project_dir, env=env)
+
+    start = time.time()
+    subprocess.check_call(command, cwd=project_dir, env=env)
+    return time.time() - start
+
+
+def bench_ioc_startup_cold(fixtures):
+    """
+    Same as ioc_startup without any cache in the artifact dir
+    """
+    project_dir, _ = fixtures.get('plugin_project')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([_ROOT, os.environ.get('PYTHONPATH', '')]))
+    shutil.rmtree(os.path.join(project_dir, '.build', 'cache'), ignore_errors=True)
+
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', 'from mb.lib import ioc; ioc.get_commands()'], cwd=project_dir, env=env)
+    return time.time() - start
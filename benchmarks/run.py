@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import traceback
+
+from benchmarks.fixtures import Fixtures
+from mb.lib import logger
+
+# Runs every bench_* function of the benchmark modules taking a Fixtures argument and compares the timings to a
+# baseline recorded on the same machine. Timings from another machine aren't comparable, update the baseline first:
+#
+#     python -m benchmarks.run --update-baseline
+#     (change things)
+#     python -m benchmarks.run --output results.json
+
+BENCHMARK_MODULES = [
+    'benchmarks.config_bench',
+    'benchmarks.fingerprint_bench',
+    'benchmarks.ioc_bench',
+    'benchmarks.template_engine_bench',
+    'benchmarks.version_scheme_bench',
+]
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def find_benchmarks(modules=BENCHMARK_MODULES, selected=None):
+    """
+    Returns:
+        list of (name, function), name is <module>.<function> without the bench prefixes
+    """
+    benchmarks = []
+    for module_name in modules:
+        module = importlib.import_module(module_name)
+        short_name = module_name.split('.')[-1][:-len('_bench')]
+        for attr in sorted(dir(module)):
+            function = getattr(module, attr)
+            if not attr.startswith('bench_') or not callable(function):
+                continue
+            # bench_ functions with a fixture argument are the ones of the suite
+            if getattr(function, '__code__', None) is None or function.__code__.co_varnames[:1] != ('fixtures',):
+                continue
+            name = '{0}.{1}'.format(short_name, attr[len('bench_'):])
+            if not selected or any(pattern in name for pattern in selected):
+                benchmarks.append((name, function))
+    return benchmarks
+
+
+def run_benchmark(function, fixtures, repeat):
+    """
+    Returns:
+        dict with the min, median and every timing in seconds, or the error
+    """
+    timings = []
+    try:
+        for _ in range(repeat):
+            timings.append(function(fixtures))
+    except Exception:
+        return {'error': traceback.format_exc().strip().splitlines()[-1]}
+
+    return {'min': min(timings), 'median': statistics.median(timings), 'timings': timings}
+
+
+def compare(results, baseline, tolerance, noise_floor):
+    """
+    A benchmark regressed when its min timing is slower than the baseline by more than the tolerance (a ratio)
+    and by more than the noise floor (seconds), the min being the timing least affected by other processes.
+
+    Returns:
+        list of (name, baseline seconds, seconds, ratio, regressed)
+    """
+    comparison = []
+    for (name, result) in sorted(results.items()):
+        previous = baseline.get(name)
+        if 'min' not in result or not previous or 'min' not in previous:
+            continue
+        ratio = result['min'] / previous['min'] if previous['min'] else float('inf')
+        regressed = ratio > 1 + tolerance and result['min'] - previous['min'] > noise_floor
+        comparison.append((name, previous['min'], result['min'], ratio, regressed))
+    return comparison
+
+
+def _read_baseline(file):
+    if not os.path.exists(file):
+        return {}
+    with open(file) as fh:
+        return json.load(fh)['results']
+
+
+def _write_results(file, results):
+    document = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    with open(file, 'w') as fh:
+        json.dump(document, fh, indent=2, sort_keys=True)
+        fh.write('\n')
+
+
+def _parse_arguments(args):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='Run the mb benchmark suite')
+    parser.add_argument('benchmarks', nargs='*', help='only run the benchmarks whose name contains one of these')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timings per benchmark')
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='results to compare with')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results to the baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown ratio over the baseline reported as a regression')
+    parser.add_argument('--noise-floor', type=float, default=0.005,
+                        help='slowdowns shorter than this many seconds are never regressions')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    arguments = _parse_arguments(sys.argv[1:] if args is None else args)
+    logger.set_log_level('WARNING')
+    baseline = _read_baseline(arguments.baseline)
+    fixtures = Fixtures()
+    results = {}
+    try:
+        for (name, function) in find_benchmarks(selected=arguments.benchmarks):
+            result = run_benchmark(function, fixtures, arguments.repeat)
+            results[name] = result
+            if 'error' in result:
+                print('{0:<40} failed: {1}'.format(name, result['error']))
+            else:
+                print('{0:<40} min {1:>9.4f}s  median {2:>9.4f}s'.format(name, result['min'], result['median']))
+            sys.stdout.flush()
+    finally:
+        fixtures.close()
+
+    if arguments.output:
+        _write_results(arguments.output, results)
+
+    if arguments.update_baseline:
+        results = dict(baseline, **results)
+        _write_results(arguments.baseline, results)
+        print('Baseline written to {0}'.format(arguments.baseline))
+        return 0
+
+    comparison = compare(results, baseline, arguments.tolerance, arguments.noise_floor)
+    if comparison:
+        print('')
+        print('{0:<40} {1:>10} {2:>10} {3:>7}'.format('compared to baseline', 'baseline', 'now', 'ratio'))
+        for (name, previous, current, ratio, regressed) in comparison:
+            print('{0:<40} {1:>9.4f}s {2:>9.4f}s {3:>6.2f}x{4}'.format(
+                name, previous, current, ratio, '  REGRESSION' if regressed else ''))
+
+    failed = [name for (name, result) in results.items() if 'error' in result]
+    regressions = [item[0] for item in comparison if item[4]]
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
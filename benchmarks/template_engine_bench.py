@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+import time
+
+from benchmarks.fixtures import StaticBuildContext
+from benchmarks.fixtures import template_project
+from mb.template_engine import DefaultTemplateEngine
+
+
+def bench_generate_files(count=1000, workers=1, incremental=False):
+    project_dir = tempfile.mkdtemp()
+    try:
+        config, variables = template_project(project_dir, count)
+        engine = DefaultTemplateEngine(StaticBuildContext(variables), config)
+        engine.workers = workers
+        engine.incremental = incremental
+
+        start = time.time()
+        engine.generate_files()
+        return time.time() - start
+    finally:
+        shutil.rmtree(project_dir)
+
+
+def bench_generate_cold(fixtures):
+    """
+    Render 1000 templates
+    """
+    return bench_generate_files()
+
+
+def bench_generate_incremental(fixtures):
+    """
+    Render 1000 templates again when nothing changed
+    """
+    project_dir = fixtures.directory('templates')
+    config, variables = template_project(project_dir)
+    engine = DefaultTemplateEngine(StaticBuildContext(variables), config)
+    engine.incremental = True
+    engine.generate_files()
+
+    start = time.time()
+    engine.generate_files()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    for workers in (1, 4, 16):
+        print('1000 templates, {0} worker(s): {1:.3f}s'.format(workers, bench_generate_files(workers=workers)))
@@ -0,0 +1,42 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import time
+
+from mb.version_scheme import DefaultVersionScheme
+from mb.version_scheme import GitReaderVersionScheme
+
+
+def _generate(config, scheme_class, cached):
+    if not cached and os.path.exists(os.path.join(config.artifact_dir, 'cache', 'version.json')):
+        os.remove(os.path.join(config.artifact_dir, 'cache', 'version.json'))
+
+    start = time.time()
+    version_scheme = scheme_class(config)
+    version_scheme.increment = 'patch'
+    version_scheme.generate()
+    return time.time() - start
+
+
+def bench_default_cold(fixtures):
+    """
+    Generate the version of a repository with 20000 tags, without the version cache
+    """
+    return _generate(fixtures.get('tagged_repo'), DefaultVersionScheme, False)
+
+
+def bench_default_cached(fixtures):
+    """
+    Generate the version of a repository with 20000 tags on a commit generated before
+    """
+    config = fixtures.get('tagged_repo')
+    _generate(config, DefaultVersionScheme, True)
+    return _generate(config, DefaultVersionScheme, True)
+
+
+def bench_git_reader_cold(fixtures):
+    """
+    Generate the version of a repository with 20000 tags reading the repository directly, without the version cache
+    """
+    return _generate(fixtures.get('tagged_repo'), GitReaderVersionScheme, False)
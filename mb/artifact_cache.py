@@ -0,0 +1,325 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import abc
+import glob
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import time
+from urllib import error as url_error
+from urllib import request as url_request
+
+from mb.lib import logger
+from mb.lib import trace
+
+# An artifact is a gzipped tar holding record.json (the captured output, exit code and return value of a command)
+# and the files matched by the output globs of the command under outputs/, relative to the project directory.
+_RECORD = 'record.json'
+_OUTPUTS = 'outputs/'
+
+_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+class ArtifactError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return 'Invalid artifact: {0}'.format(self.message)
+
+
+def parse_size(value):
+    """
+    Returns:
+        the number of bytes of a size like 1048576, '512MB' or '10G', None for no size
+    """
+    if value is None or isinstance(value, int):
+        return value
+    match = _SIZE.match(str(value))
+    if not match:
+        raise ValueError('Invalid size: {0}'.format(value))
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+
+def output_files(project_dir, patterns):
+    """
+    Returns:
+        the sorted paths relative to project_dir of the files matching the output globs
+    """
+    files = set()
+    for pattern in patterns or []:
+        for file in glob.glob(os.path.join(project_dir, pattern), recursive=True):
+            if os.path.isfile(file):
+                files.add(os.path.relpath(file, project_dir).replace(os.sep, '/'))
+    return sorted(files)
+
+
+def pack(archive_file, project_dir, record, outputs=()):
+    """
+    Write an artifact
+
+    Args:
+        archive_file: path of the archive to write
+        project_dir: the directory the outputs are relative to
+        record: json serializable result of the command
+        outputs: paths of the output files relative to project_dir
+    """
+    with tarfile.open(archive_file, 'w:gz', compresslevel=6) as archive:
+        data = json.dumps(dict(record, outputs=list(outputs))).encode('utf-8')
+        info = tarfile.TarInfo(_RECORD)
+        info.size = len(data)
+        info.mtime = time.time()
+        archive.addfile(info, io.BytesIO(data))
+        for output in outputs:
+            archive.add(os.path.join(project_dir, output), _OUTPUTS + output, recursive=False)
+
+
+def _output_path(project_dir, name):
+    relative = name[len(_OUTPUTS):]
+    path = os.path.normpath(os.path.join(project_dir, relative))
+    if os.path.isabs(relative) or not path.startswith(os.path.join(os.path.normpath(project_dir), '')):
+        raise ArtifactError('{0} is outside of the project directory'.format(relative))
+    return path
+
+
+def unpack(archive, project_dir):
+    """
+    Restore the outputs of an artifact to the project directory
+
+    Args:
+        archive: a binary file object reading the artifact, it's read once from start to end
+        project_dir: the directory the outputs are restored to
+
+    Returns:
+        the record of the artifact
+    """
+    record = None
+    try:
+        with tarfile.open(fileobj=archive, mode='r|gz') as tar:
+            for member in tar:
+                if member.name == _RECORD:
+                    record = json.loads(tar.extractfile(member).read().decode('utf-8'))
+                elif member.name.startswith(_OUTPUTS) and member.isfile():
+                    path = _output_path(project_dir, member.name)
+                    if not os.path.isdir(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                    temp_file = '{0}.{1}.tmp'.format(path, os.getpid())
+                    with open(temp_file, 'wb') as output:
+                        shutil.copyfileobj(tar.extractfile(member), output)
+                    os.chmod(temp_file, member.mode)
+                    os.replace(temp_file, path)
+                    os.utime(path, (member.mtime, member.mtime))
+    except (tarfile.TarError, EOFError, OSError, ValueError) as err:
+        raise ArtifactError(str(err))
+
+    if record is None:
+        raise ArtifactError('{0} is missing'.format(_RECORD))
+    return record
+
+
+class ArtifactCache(object):
+    """
+    Stores the artifacts of cached commands under their content key, so a command can be restored
+    instead of being run again, by this checkout or any other one sharing the same cache.
+    """
+
+    def __init__(self):
+        self.log = logger.get_logger('[ArtifactCache]')
+        self.log.debug('Initializing {0}'.format(self.__class__.__name__))
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        Returns:
+            a binary file object reading the artifact, to close by the caller, or None when it isn't cached
+        """
+        raise NotImplementedError("'get' must be reimplemented by %s" % self)
+
+    @abc.abstractmethod
+    def put(self, key, archive_file):
+        """
+        Store the artifact written to the archive_file path under key
+        """
+        raise NotImplementedError("'put' must be reimplemented by %s" % self)
+
+
+class FileSystemArtifactCache(ArtifactCache):
+    """
+    Keeps the artifacts in a directory, <artifact_dir>/cache/artifacts unless configured otherwise.
+    Point it to a shared mount to share the artifacts between machines: artifacts are written to a temporary
+    file and renamed, so readers never see a partial one, and reading an artifact marks it as recently used.
+    Once the artifacts take more than max_size, the least recently used ones are removed.
+    """
+
+    def __init__(self, config):
+        super(FileSystemArtifactCache, self).__init__()
+        self.config = config
+        self._directory = None
+        self._max_size = None
+
+    @property
+    def directory(self):
+        return self._directory or os.path.join(self.config.artifact_dir, 'cache', 'artifacts')
+
+    @directory.setter
+    def directory(self, value):
+        self._directory = os.path.join(self.config.project_dir, os.path.expanduser(value))
+
+    @property
+    def max_size(self):
+        """
+        Size the cache is kept under, in bytes or with a unit like '10G', no limit by default
+        """
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value):
+        self._max_size = parse_size(value)
+
+    def _artifact_file(self, key):
+        return os.path.join(self.directory, key[:2], key + '.tar.gz')
+
+    def get(self, key):
+        artifact_file = self._artifact_file(key)
+        try:
+            artifact = open(artifact_file, 'rb')
+        except (IOError, OSError):
+            return None
+
+        try:
+            # the mtime is the last use, atime isn't updated on most mounts
+            os.utime(artifact_file, None)
+        except OSError:
+            pass
+        return artifact
+
+    def put(self, key, archive_file):
+        artifact_file = self._artifact_file(key)
+        if not os.path.isdir(os.path.dirname(artifact_file)):
+            os.makedirs(os.path.dirname(artifact_file), exist_ok=True)
+
+        temp_file = '{0}.{1}.tmp'.format(artifact_file, os.getpid())
+        shutil.copyfile(archive_file, temp_file)
+        os.replace(temp_file, artifact_file)
+
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def _artifacts(self):
+        artifacts = []
+        for (root, _, names) in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.tar.gz'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                artifacts.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return artifacts
+
+    def evict(self, max_size):
+        """
+        Remove the least recently used artifacts until the cache takes at most max_size bytes
+        """
+        with trace.span('evict artifacts', 'cache'):
+            artifacts = sorted(self._artifacts())
+            total = sum(size for (_, size, _) in artifacts)
+            for (_, size, artifact_file) in artifacts:
+                if total <= max_size:
+                    break
+                try:
+                    os.remove(artifact_file)
+                except OSError:
+                    # another process evicted it first
+                    pass
+                total -= size
+
+
+class HttpArtifactCache(ArtifactCache):
+    """
+    Keeps the artifacts on an HTTP server, with GET and PUT of <url>/<key>.tar.gz, which most
+    build cache servers and object stores with a proxy in front of them support.
+    The server is in charge of eviction. A cache without a valid url or that can't be reached only means commands run.
+    """
+
+    def __init__(self):
+        super(HttpArtifactCache, self).__init__()
+        self._url = None
+        self._headers = {}
+        self._timeout = 30
+        self._read_only = False
+
+    @property
+    def url(self):
+        return self._url
+
+    @url.setter
+    def url(self, value):
+        self._url = value.rstrip('/')
+
+    @property
+    def headers(self):
+        """
+        Headers sent with every request, like Authorization
+        """
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        self._headers = value
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+
+    @property
+    def read_only(self):
+        """
+        Only download artifacts, for machines that shouldn't publish theirs
+        """
+        return self._read_only
+
+    @read_only.setter
+    def read_only(self, value):
+        self._read_only = value
+
+    def _artifact_url(self, key):
+        if not self.url:
+            raise ValueError('no url is configured')
+        return '{0}/{1}.tar.gz'.format(self.url, key)
+
+    def get(self, key):
+        try:
+            request = url_request.Request(self._artifact_url(key), headers=self.headers)
+            return url_request.urlopen(request, timeout=self.timeout)
+        except url_error.HTTPError as err:
+            if err.code != 404:
+                self.log.warn('Unable to download artifact {0}: {1}'.format(key, err))
+        except (url_error.URLError, OSError, ValueError) as err:
+            # ValueError is a missing or malformed url
+            self.log.warn('Unable to download artifact {0}: {1}'.format(key, err))
+        return None
+
+    def put(self, key, archive_file):
+        if self.read_only:
+            return
+
+        headers = dict(self.headers)
+        headers.update({'Content-Type': 'application/gzip',
+                        'Content-Length': str(os.path.getsize(archive_file))})
+        try:
+            with open(archive_file, 'rb') as data:
+                request = url_request.Request(self._artifact_url(key), data=data, headers=headers, method='PUT')
+                url_request.urlopen(request, timeout=self.timeout).close()
+        except (url_error.URLError, OSError, ValueError) as err:
+            self.log.warn('Unable to upload artifact {0}: {1}'.format(key, err))
@@ -2,11 +2,25 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import abc
+import atexit
 import json
 import os
 import os.path
+import sqlite3
+import threading
+import weakref
 
 from mb.lib import logger
+from mb.lib.file_lock import FileLock
+
+# the build contexts still in use, whatever they buffered is written when the process exits
+_live_contexts = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_live_contexts():
+    for build_context in list(_live_contexts):
+        build_context.flush()
 
 
 class BuildContext(object):
@@ -23,29 +37,141 @@ class BuildContext(object):
     def add_variables(self, variables):
         raise NotImplementedError("'add_variables' must be reimplemented by %s" % self)
 
+    def variables_with_prefix(self, prefix):
+        return dict((key, value) for (key, value) in self.variables.items() if key.startswith(prefix))
+
+    def flush(self):
+        """
+        Persist the variables added so far, called after every command
+        """
+        pass
+
 
 class DefaultBuildContext(BuildContext):
+    """
+    Keeps the variables in build_context.json in the artifact directory.
+    The file is read once and changes are kept in memory until flush, which merges them into the file
+    under a lock and replaces it atomically, so parallel commands and mb processes don't lose each other's variables.
+    """
+
     def __init__(self, config):
         BuildContext.__init__(self)
         self.config = config
         self.build_context_file = os.path.join(config.artifact_dir, 'build_context.json')
+        self._file_lock = FileLock(self.build_context_file + '.lock')
+        self._lock = threading.RLock()
+        self._data = None
+        self._stat = None
+        self._pending = {}
+        _live_contexts.add(self)
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.build_context_file)
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            return None
+
+    def _read(self):
+        self._stat = self._file_stat()
+        if self._stat is None:
+            return {}
+
+        with open(self.build_context_file, 'r') as buildvarfile:
+            return json.load(buildvarfile)
+
+    def _load(self):
+        # another process may have flushed since the file was read, reading again is only a stat when it didn't
+        if self._data is None or self._file_stat() != self._stat:
+            self._data = self._read()
+            self._data.update(self._pending)
+        return self._data
 
     @property
     def variables(self):
-        if os.path.isfile(self.build_context_file):
-            with open(self.build_context_file, 'r') as buildvarfile:
-                return json.load(buildvarfile)
-
-        return {}
+        with self._lock:
+            return dict(self._load())
 
     def add_variables(self, variables):
-        data = {}
-        if os.path.isfile(self.build_context_file):
-            with open(self.build_context_file, 'r') as buildvarfile:
-                data = json.load(buildvarfile)
+        with self._lock:
+            self._load().update(variables)
+            self._pending.update(variables)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+
+            with self._file_lock:
+                data = self._read()
+                data.update(self._pending)
+                temp_file = '{0}.{1}.tmp'.format(self.build_context_file, os.getpid())
+                with open(temp_file, 'w') as jsonFile:
+                    jsonFile.write(json.dumps(data))
+                os.replace(temp_file, self.build_context_file)
+                self._stat = self._file_stat()
+
+            self._data = data
+            self._pending = {}
+
 
-        for key, value in variables.items():
-            data[key] = value
+class SqliteBuildContext(BuildContext):
+    """
+    Keeps the variables in an sqlite database in the artifact directory, one row per variable,
+    so adding variables only writes those variables however many there are.
+    Several processes can add variables at the same time, sqlite serializes their transactions.
+    Select it with config.build_context: SqliteBuildContext
+    """
 
-        with open(self.build_context_file, 'w+') as jsonFile:
-            jsonFile.write(json.dumps(data))
+    def __init__(self, config):
+        BuildContext.__init__(self)
+        self.config = config
+        self.database_file = os.path.join(config.artifact_dir, 'build_context.db')
+        self._local = threading.local()
+        self._timeout = 30
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads, or with a forked process
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.database_file, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS variables (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def _rows(self, query, parameters=()):
+        return dict((name, json.loads(value)) for (name, value) in self._connection().execute(query, parameters))
+
+    @property
+    def variables(self):
+        return self._rows('SELECT name, value FROM variables')
+
+    def variables_with_prefix(self, prefix):
+        # a range on the primary key uses its index, unlike LIKE or GLOB
+        return self._rows('SELECT name, value FROM variables WHERE name >= ? AND name < ?',
+                          (prefix, prefix + '\U0010ffff'))
+
+    def variable(self, name, default=None):
+        row = self._connection().execute('SELECT value FROM variables WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def add_variables(self, variables):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO variables (name, value) VALUES (?, ?)',
+                                   [(key, json.dumps(value)) for (key, value) in variables.items()])
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
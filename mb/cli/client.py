@@ -0,0 +1,117 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import array
+import json
+import os
+import signal
+import socket
+import sys
+
+from mb.config.discovery import find_candidates_in_parent_dirs
+from mb.config.discovery import SUPPORTED_FILENAMES
+
+# The thin client only uses the standard library so that forwarding a command to a running daemon
+# doesn't pay for importing GitPython, yaml, jsonpath or the plugins.
+
+SOCKET_NAME = 'mb.sock'
+
+
+def socket_path(cwd):
+    """
+    Get the path of the daemon socket of the project the directory belongs to
+
+    Returns:
+        the socket path, or None when the directory isn't part of a project
+    """
+    (candidates, path) = find_candidates_in_parent_dirs(SUPPORTED_FILENAMES, cwd)
+    if not candidates:
+        return None
+
+    return os.path.join(os.path.abspath(path), '.build', SOCKET_NAME)
+
+
+def daemon_supported():
+    return hasattr(socket, 'AF_UNIX') and hasattr(os, 'fork')
+
+
+def send_message(conn, message, fds=None):
+    data = (json.dumps(message) + '\n').encode('utf-8')
+    if fds:
+        # the descriptors go along with the first chunk, sendmsg doesn't have to send everything at once
+        data = data[conn.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))]):]
+    conn.sendall(data)
+
+
+def connect(path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except (IOError, OSError):
+        conn.close()
+        return None
+
+    return conn
+
+
+def run_in_daemon(arguments):
+    """
+    Forward a command to the daemon of the current project, the daemon runs it with this process's
+    stdin, stdout and stderr, arguments, environment and working directory.
+
+    Returns:
+        the exit code of the command, or None when it has to run locally
+    """
+    if not daemon_supported() or os.environ.get('MB_NO_DAEMON'):
+        return None
+
+    cwd = os.getcwd()
+    path = socket_path(cwd)
+    conn = connect(path) if path and os.path.exists(path) else None
+    if conn is None:
+        return None
+
+    pid = None
+    try:
+        send_message(conn, {'argv': arguments, 'env': dict(os.environ), 'cwd': cwd},
+                     [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+        responses = conn.makefile('r')
+        for line in responses:
+            response = json.loads(line)
+            if 'fallback' in response:
+                return None
+            if 'started' in response:
+                pid = response['started']
+            if 'exit' in response:
+                return response['exit']
+    except KeyboardInterrupt:
+        if pid:
+            os.killpg(pid, signal.SIGINT)
+        return 130
+    finally:
+        conn.close()
+
+    # the daemon went away before it started the command, it is safe to run it here
+    if pid is None:
+        return None
+
+    sys.stderr.write('mb: the daemon exited before the command finished\n')
+    return 1
+
+
+def main():
+    arguments = sys.argv[1:]
+    if arguments[:1] == ['daemon']:
+        from mb.cli import daemon
+        sys.exit(daemon.main(arguments[1:]))
+
+    exit_code = run_in_daemon(arguments)
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+    from mb.cli.main import main as run_locally
+    run_locally()
+
+
+if __name__ == '__main__':
+    main()
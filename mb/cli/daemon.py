@@ -0,0 +1,305 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import argparse
+import array
+import glob
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import time
+import traceback
+
+from mb.cli.client import connect
+from mb.cli.client import daemon_supported
+from mb.cli.client import send_message
+from mb.cli.client import socket_path
+from mb.lib import logger
+
+_log = logger.get_logger('[Daemon]')
+
+_MAX_FDS = 3
+
+
+def _receive(conn):
+    """
+    Read one request line and the file descriptors sent along with it
+    """
+    fds = array.array('i')
+    data, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_LEN(_MAX_FDS * fds.itemsize))
+    for (level, kind, cmsg_data) in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+
+    while data and not data.endswith(b'\n'):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+
+    return (json.loads(data.decode('utf-8')) if data else {}, list(fds))
+
+
+def _same_user(conn):
+    """
+    Returns:
+        whether the process connected to the socket runs as the same user as the daemon,
+        always True where the peer credentials can't be read, the socket permissions protect it there
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+
+    credentials = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    (_, uid, _) = struct.unpack('3i', credentials)
+    return uid == os.getuid()
+
+
+def _close_fds(fds):
+    for fd in fds:
+        os.close(fd)
+
+
+class Daemon(object):
+    """
+    Keeps the config, plugins, compiled templates and the git repository of a project loaded.
+    Every forwarded command runs in a process forked from this warm one, so commands can't leak state
+    into each other, and the daemon restarts itself when the config file or a plugin changes.
+    """
+
+    def __init__(self):
+        # importing the cli loads the config and the plugin index
+        from mb.cli import main as cli_main
+        from mb.config.cache import referenced_names
+        from mb.lib import ioc
+
+        self._cli_main = cli_main
+        self.config = ioc.load_dependency('config')
+        ioc.preload_plugins()
+        for dependency in ('build_context', 'version_scheme', 'template_engine'):
+            plugin = ioc.load_dependency(dependency)
+            if hasattr(plugin, 'compiled_templates'):
+                plugin.compiled_templates.preload()
+
+        with open(self.config.filename, 'r') as config_file:
+            self.environment = {name: os.environ.get(name) for name in referenced_names(config_file.read())}
+
+        self.socket_path = socket_path(self.config.project_dir)
+        self.started = time.time()
+        self.requests = 0
+        self.children = set()
+        self._signature = self._watched_signature()
+        self._listener = None
+
+    def _watched_signature(self):
+        files = [self.config.filename] + sorted(glob.glob(os.path.join(self.config.plugin_dir, '*.py')))
+        signature = []
+        for file in files:
+            try:
+                stat = os.stat(file)
+                signature.append((file, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((file, None, None))
+        return signature
+
+    def _bind(self):
+        if os.path.exists(self.socket_path):
+            conn = connect(self.socket_path)
+            if conn is not None:
+                conn.close()
+                raise RuntimeError('A daemon is already running for this project: {0}'.format(self.socket_path))
+            os.remove(self.socket_path)
+
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the user running the daemon can connect, the socket is never accessible to others
+        umask = os.umask(0o177)
+        try:
+            self._listener.bind(self.socket_path)
+            os.chmod(self.socket_path, 0o600)
+            self._listener.listen(16)
+        except OSError as err:
+            self._listener.close()
+            self._listener = None
+            raise RuntimeError('Unable to listen on {0}: {1}'.format(self.socket_path, err))
+        finally:
+            os.umask(umask)
+
+    def _shutdown(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def _reap(self):
+        for pid in list(self.children):
+            finished, _ = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                self.children.discard(pid)
+
+    def _reload(self):
+        _log.info('The config or a plugin changed, reloading...')
+        self._shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.chdir(self.config.project_dir)
+        os.execv(sys.executable, [sys.executable, '-m', 'mb.cli.daemon', 'start'])
+
+    def serve(self):
+        self._bind()
+        _log.info('Listening on {0}'.format(self.socket_path))
+        try:
+            while True:
+                self._reap()
+                readable, _, _ = select.select([self._listener], [], [], 1.0)
+                if self._watched_signature() != self._signature:
+                    self._reload()
+
+                if readable and not self._handle(self._listener.accept()[0]):
+                    return
+        finally:
+            self._shutdown()
+
+    def _handle(self, conn):
+        """
+        Returns:
+            False when the daemon was asked to stop
+        """
+        fds = []
+        try:
+            if not _same_user(conn):
+                _log.warn('Refused a request from another user')
+                return True
+
+            request, fds = _receive(conn)
+            control = request.get('control')
+            if control == 'stop':
+                send_message(conn, {'exit': 0})
+                return False
+
+            if control == 'status':
+                send_message(conn, {'status': {'pid': os.getpid(), 'project_dir': self.config.project_dir,
+                                               'uptime': time.time() - self.started, 'requests': self.requests}})
+                return True
+
+            env = request.get('env', {})
+            changed = [name for (name, value) in self.environment.items() if env.get(name) != value]
+            if len(fds) != _MAX_FDS or changed:
+                send_message(conn, {'fallback': 'environment changed: {0}'.format(', '.join(changed))})
+                return True
+
+            self.requests += 1
+            self._fork(conn, request, fds)
+        except Exception as err:
+            _log.warn('Failed to handle a request: {0}'.format(err))
+        finally:
+            _close_fds(fds)
+            conn.close()
+
+        return True
+
+    def _fork(self, conn, request, fds):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_write)
+            # wait for the parent to tell the client which process runs its command
+            os.read(ready_read, 1)
+            os.close(ready_read)
+            self._run_request(conn, request, fds)
+
+        os.close(ready_read)
+        self.children.add(pid)
+        send_message(conn, {'started': pid})
+        os.write(ready_write, b'1')
+        os.close(ready_write)
+
+    def _run_request(self, conn, request, fds):
+        exit_code = 1
+        try:
+            # a process group of its own lets the client interrupt the command and its subprocesses
+            os.setsid()
+            self._listener.close()
+            for (target, fd) in enumerate(fds):
+                os.dup2(fd, target)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            sys.argv = ['mb'] + request['argv']
+            if '--verbose' in request['argv']:
+                logger.set_log_level('DEBUG')
+
+            self._cli_main.main()
+            exit_code = 0
+        except SystemExit as err:
+            if err.code is None or isinstance(err.code, int):
+                exit_code = err.code or 0
+            else:
+                sys.stderr.write('{0}\n'.format(err.code))
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                send_message(conn, {'exit': exit_code})
+            finally:
+                os._exit(exit_code)
+
+
+def _control(command):
+    path = socket_path(os.getcwd())
+    conn = connect(path) if path and os.path.exists(path) else None
+    if conn is None:
+        sys.stderr.write('mb: no daemon is running for this project\n')
+        return 1
+
+    try:
+        send_message(conn, {'control': command})
+        for line in conn.makefile('r'):
+            response = json.loads(line)
+            if 'status' in response:
+                sys.stdout.write('{0}\n'.format(json.dumps(response['status'], indent=2, sort_keys=True)))
+            return response.get('exit', 0)
+    finally:
+        conn.close()
+
+    return 0
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(prog='mb daemon',
+                                     description='Keep Master Builder loaded in the background to run commands faster')
+    parser.add_argument('action', nargs='?', default='start', choices=['start', 'stop', 'status'])
+    parser.add_argument('--verbose', action='store_true', help='Enables Verbose output')
+    args = parser.parse_args(arguments)
+
+    if not daemon_supported():
+        sys.stderr.write('mb: the daemon needs unix sockets and fork\n')
+        return 1
+
+    if args.action != 'start':
+        return _control(args.action)
+
+    if args.verbose:
+        logger.set_log_level('DEBUG')
+
+    try:
+        Daemon().serve()
+    except RuntimeError as err:
+        sys.stderr.write('mb: {0}\n'.format(err))
+        return 1
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
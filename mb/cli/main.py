@@ -2,35 +2,137 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import argparse
+import os
 import sys
 
 from mb.lib import logger
+from mb.lib import trace
+
+
+def _split_global_arguments(arguments):
+    """
+    Returns:
+        a tuple of the options given before the subcommand and the remaining arguments,
+        options after the subcommand belong to the subcommand
+    """
+    index = 0
+    while index < len(arguments) and arguments[index].startswith('-'):
+        # --jobs N is the only global option taking a separate value
+        index += 2 if arguments[index] == '--jobs' else 1
+    return arguments[:index], arguments[index:]
+
 
 if '--verbose' in sys.argv[1:]:
     logger.set_log_level('DEBUG')
 
+# tracing starts before the config and the plugins are loaded so they show up in it too
+if '--profile' in _split_global_arguments(sys.argv[1:])[0]:
+    trace.start_profile()
+elif '--trace' in _split_global_arguments(sys.argv[1:])[0]:
+    trace.enable()
+
+from mb.config.errors import MasterBuilderFileNotFoundError # NOQA
 from mb.lib import ioc # NOQA
-already_ran = []
+from mb.lib import scheduler # NOQA
+from mb.lib.result_cache import ResultCache # NOQA
+
+
+def _execute_command(name, arguments, project=None):
+    project = project or ioc.project()
+    loaded_command = project.load_command(name)
+    build_context = project.load_dependency('build_context')
+    try:
+        if not loaded_command.cache:
+            return loaded_command.run(arguments)
+
+        result_cache = ResultCache(project.config, build_context, project.load_dependency('artifact_cache'),
+                                   project.load_dependency('fingerprints'))
+        return result_cache.run(name, loaded_command, project.get_command_config(name), arguments)
+    finally:
+        # the variables a command added are visible to other processes once it finished
+        build_context.flush()
+
+
+def run_command(command, arguments=[], jobs=1, project=None):
+    project = project or ioc.project()
+    graph = scheduler.build_graph(command, lambda name: project.load_command(name).dependencies)
+    scheduler.Scheduler(graph, command, lambda name: _execute_command(name, arguments, project), jobs).run()
+
+
+def _parse_global_arguments(arguments):
+    # global options given before the subcommand are removed before the arguments are handed to the command
+    global_parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    global_parser.add_argument('--jobs', type=int, default=1)
+    global_parser.add_argument('--trace', action='store_true')
+    global_parser.add_argument('--profile', action='store_true')
+    (options, arguments) = _split_global_arguments(arguments)
+    (global_args, unknown) = global_parser.parse_known_args(options)
+    return (global_args, unknown + arguments)
+
 
+def _watch(arguments, commands, jobs):
+    from mb.cli import watch
 
-def run_command(command, arguments=[]):
-    if command in already_ran:
-        return
+    parser = argparse.ArgumentParser(prog='mb watch',
+                                     description='Run a command, then run it again when its inputs change')
+    parser.add_argument('subcommand', choices=commands, help='The build subcommand you want to run')
+    parser.add_argument('--poll', action='store_true', help='Poll for changes instead of using inotify')
+    args, arguments = parser.parse_known_args(arguments)
+    watch.watch(args.subcommand, arguments, jobs, args.poll)
+
+
+def _workspace(arguments, jobs):
+    from mb.cli import workspace
+
+    parser = argparse.ArgumentParser(prog='mb workspace',
+                                     description='Run a command in every project under the working directory')
+    parser.add_argument('subcommand', help='The build subcommand to run in the projects that have it')
+    parser.add_argument('--projects', help='Comma separated names of the projects to run it in, with their dependencies')
+    args, arguments = parser.parse_known_args(arguments)
+    workspace.run(args.subcommand, arguments, jobs, args.projects.split(',') if args.projects else None)
+
+
+def _commands():
+    try:
+        return ioc.get_commands()
+    except MasterBuilderFileNotFoundError:
+        # the root of a workspace doesn't have to be a project
+        return []
 
-    already_ran.append(command)
-    loaded_command = ioc.load_command(command)
-    for dep_command in loaded_command.dependencies:
-        run_command(dep_command, arguments)
 
-    loaded_command.run(arguments)
+def _trace_dir():
+    try:
+        return os.path.join(ioc.load_dependency('config').artifact_dir, 'trace')
+    except MasterBuilderFileNotFoundError:
+        return os.path.join(os.getcwd(), '.build', 'trace')
 
 
 def main():
+    global_args, arguments = _parse_global_arguments(sys.argv[1:])
+    # a daemon imported this module long before the arguments of this run were known
+    if global_args.profile and not trace.is_enabled():
+        trace.start_profile()
+    elif global_args.trace and not trace.is_enabled():
+        trace.enable()
+
+    try:
+        _main(global_args, arguments)
+    finally:
+        if trace.is_enabled():
+            trace.write(_trace_dir())
+
+
+def _main(global_args, arguments):
     parser = argparse.ArgumentParser(prog='mb',
                                      description='Master Builder: Build Ochestration')
-    arguments = sys.argv[1:]
+    if arguments[:1] == ['workspace'] and 'workspace' not in _commands():
+        return _workspace(arguments[1:], global_args.jobs)
+
     commands = ioc.get_commands()
 
+    if arguments[:1] == ['watch'] and 'watch' not in commands:
+        return _watch(arguments[1:], commands, global_args.jobs)
+
     # handle potential default command allowing you to do build without a subcommand.
     subcommand = ''
 
@@ -47,8 +149,14 @@ def main():
         arguments = arguments[1:]
 
     # get subcommands dynamically and fill out choices
-    parser.add_argument('subcommand', choices=commands, help='The build subcommand you want to run')
+    parser.add_argument('subcommand', choices=commands,
+                        help='The build subcommand you want to run, `mb watch <subcommand>` runs it on every change, '
+                             '`mb workspace <subcommand>` runs it in every project under the working directory')
     parser.add_argument('--verbose', action='store_true', help='Enables Verbose output for build commands')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N', help='Run up to N independent commands at the same time')
+    parser.add_argument('--trace', action='store_true',
+                        help='Write a Chrome trace and a summary of where the time went to <artifact_dir>/trace')
+    parser.add_argument('--profile', action='store_true', help='Like --trace, and profile the run with cProfile')
 
     args = parser.parse_args([subcommand])
-    run_command(args.subcommand, arguments)
+    run_command(args.subcommand, arguments, global_args.jobs)
@@ -0,0 +1,133 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import sys
+
+from mb.cli import main as cli_main
+from mb.lib import ioc
+from mb.lib import logger
+from mb.lib import scheduler
+from mb.lib.fingerprint import compile_glob
+from mb.lib.fingerprint import input_root
+from mb.lib.watcher import create_watcher
+
+_log = logger.get_logger('[Watch]')
+
+# the command generating the templates
+_PRERUN = '_prerun'
+
+
+def matches_input(pattern, path):
+    """
+    Check whether a path relative to the project directory matches an input glob,
+    the same way the result cache finds the files of its inputs
+    """
+    return compile_glob(pattern).match(path.replace(os.sep, '/')) is not None
+
+
+class WatchSession(object):
+    """
+    Runs a command, then re-runs the commands whose inputs changed and everything that depends on them.
+    The config and the plugins stay loaded between runs, the process restarts itself when they change.
+    """
+
+    def __init__(self, command, arguments=[], jobs=1, polling=False, project=None):
+        self.command = command
+        self.arguments = arguments
+        self.jobs = jobs
+        self.project = project or ioc.project()
+        self.config = self.project.config
+        self.graph = scheduler.build_graph(command, lambda name: self.project.load_command(name).dependencies)
+        self.inputs = {name: list(self.project.load_command(name).inputs or []) for name in self.graph.nodes}
+        self.outputs = [pattern for name in self.graph.nodes for pattern in self.project.load_command(name).outputs or []]
+        self.watcher = create_watcher(self.watched_paths(), [self.config.artifact_dir], polling=polling)
+
+    def watched_paths(self):
+        paths = [self.config.filename, self.config.plugin_dir, self.config.template_dir]
+        for patterns in self.inputs.values():
+            for pattern in patterns:
+                paths.append(os.path.join(self.config.project_dir, input_root(pattern)))
+        return [path for path in paths if os.path.exists(path)]
+
+    def _is_reload_needed(self, changed):
+        config_file = os.path.abspath(self.config.filename)
+        plugin_dir = os.path.abspath(self.config.plugin_dir) + os.sep
+        return any(path == config_file or (path.startswith(plugin_dir) and path.endswith('.py')) for path in changed)
+
+    def affected_commands(self, changed):
+        """
+        Returns:
+            the commands with a changed input, and every command depending on them
+        """
+        template_dir = os.path.abspath(self.config.template_dir) + os.sep
+        affected = set()
+        for path in changed:
+            if path.startswith(template_dir) and _PRERUN in self.graph.nodes:
+                affected.add(_PRERUN)
+
+            relative = os.path.relpath(path, self.config.project_dir)
+            for (name, patterns) in self.inputs.items():
+                if any(matches_input(pattern, relative) for pattern in patterns):
+                    affected.add(name)
+
+        return self.graph.all_dependents(affected)
+
+    def user_changes(self, changed):
+        """
+        Returns:
+            the changed paths that aren't outputs of the commands or in the artifact dir, the commands wrote those
+        """
+        artifact_dir = os.path.abspath(self.config.artifact_dir) + os.sep
+        return set(path for path in changed if not path.startswith(artifact_dir) and
+                   not any(matches_input(pattern, os.path.relpath(path, self.config.project_dir))
+                           for pattern in self.outputs))
+
+    def run(self, names=None):
+        graph = self.graph if names is None else self.graph.subgraph(names)
+        root = self.command if names is None else None
+        try:
+            scheduler.Scheduler(graph, root, lambda name: cli_main._execute_command(name, self.arguments, self.project),
+                                self.jobs).run()
+        except Exception as err:
+            # keep watching, the next change may fix it
+            _log.error('Run failed: {0}'.format(err))
+
+    def _reload(self):
+        _log.info('The config or a plugin changed, restarting...')
+        self.watcher.close()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execv(sys.executable, [sys.executable, '-m', 'mb.cli.client'] + sys.argv[1:])
+
+    def loop(self):
+        self.run()
+        _log.info('Watching for changes...')
+        changed = set()
+        try:
+            while True:
+                # changes made during the previous run are handled right away
+                changed |= self.watcher.changes(0 if changed else None)
+                if self._is_reload_needed(changed):
+                    self._reload()
+
+                names = self.affected_commands(changed)
+                if not names:
+                    changed = set()
+                    continue
+
+                relative_paths = sorted(os.path.relpath(path, self.config.project_dir) for path in changed)
+                _log.info('Changed: {0}'.format(', '.join(relative_paths)))
+                self.run(names)
+                # the outputs the commands wrote aren't edits to react to, the edits made meanwhile are
+                changed = self.user_changes(self.watcher.changes(0))
+                _log.info('Watching for changes...')
+        finally:
+            self.watcher.close()
+
+
+def watch(command, arguments=[], jobs=1, polling=False):
+    try:
+        WatchSession(command, arguments, jobs, polling).loop()
+    except KeyboardInterrupt:
+        pass
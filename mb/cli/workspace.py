@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+from collections import OrderedDict
+
+from mb.cli import main as cli_main
+from mb.config.config import get_default_config_file
+from mb.config.discovery import find_projects
+from mb.config.errors import ConfigurationError
+from mb.lib import ioc
+from mb.lib import logger
+from mb.lib import scheduler
+
+_log = logger.get_logger('[Workspace]')
+
+
+class Workspace(object):
+    """
+    Every project under a root directory, like the subprojects of a monorepo.
+    A command runs across the projects in a single process: the projects run in the order of their
+    config.project_dependencies, independent projects at the same time, and plugin dirs shared by
+    projects are only loaded once.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.configs = OrderedDict()
+        for config_file in find_projects(self.root):
+            config = get_default_config_file(os.path.dirname(config_file))
+            if config.name in self.configs:
+                raise ConfigurationError('Two projects are named {0}: {1} and {2}'.format(
+                    config.name, self.configs[config.name].project_dir, config.project_dir))
+            self.configs[config.name] = config
+
+        self.graph = scheduler.Graph()
+        for (name, config) in self.configs.items():
+            for dependency in config.project_dependencies:
+                if dependency not in self.configs:
+                    raise ConfigurationError('The project {0} depends on {1}, which isn\'t part of the workspace'
+                                             .format(name, dependency))
+            self.graph.add(name, config.project_dependencies)
+
+        cycle = self.graph.find_cycle()
+        if cycle:
+            raise scheduler.CycleError(cycle)
+        self._projects = {}
+
+    def project(self, name):
+        if name not in self._projects:
+            self._projects[name] = ioc.Project(self.configs[name])
+        return self._projects[name]
+
+    def selection(self, names=None):
+        """
+        Returns:
+            the projects to run a command in for the selected projects, they need their dependencies to run first
+        """
+        if not names:
+            return self.graph
+
+        unknown = [name for name in names if name not in self.configs]
+        if unknown:
+            raise ConfigurationError('Unknown project(s): {0}'.format(', '.join(unknown)))
+
+        selected = set()
+        queue = list(names)
+        while queue:
+            name = queue.pop()
+            if name not in selected:
+                selected.add(name)
+                queue.extend(self.graph.dependencies(name))
+        return self.graph.subgraph(selected)
+
+    def _run_project(self, name, command, arguments):
+        project = self.project(name)
+        if command not in project.get_commands():
+            _log.debug('{0} has no {1} command'.format(name, command))
+            return
+
+        _log.info('Running {0} in {1}'.format(command, name))
+        cli_main.run_command(command, arguments, 1, project)
+
+    def run(self, command, arguments=[], jobs=1, names=None):
+        graph = self.selection(names)
+        scheduler.Scheduler(graph, None, lambda name: self._run_project(name, command, arguments), jobs).run()
+
+
+def run(command, arguments=[], jobs=1, names=None, root='./'):
+    workspace = Workspace(root)
+    _log.info('Found {0} project(s) in {1}'.format(len(workspace.configs), workspace.root))
+    workspace.run(command, arguments, jobs, names)
@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 
 import abc
 import argparse
+import os
+import sys
 import time
 
 from mb.lib import logger
@@ -19,7 +21,57 @@ class Command(object):
         self.log = logger.get_logger('[{0}]'.format(self.__class__.__name__))
         self.log.debug('Initializing {0}'.format(self.__class__.__name__))
         self.allow_unknown_args = allow_unknown_args
-        self.dependencies = ['_prerun']
+        self._dependencies = ['_prerun']
+        self._cache = False
+        self._inputs = []
+        self._outputs = []
+        self.capture_output = False
+        self.output = None
+        self.exit_code = None
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        self._cache = value
+
+    @property
+    def inputs(self):
+        return self._inputs
+
+    @inputs.setter
+    def inputs(self, value):
+        self._inputs = value
+
+    @property
+    def outputs(self):
+        """
+        Globs of the files the command produces, relative to the project directory.
+        They're stored with the cached result of the command and restored when it's replayed.
+        """
+        return self._outputs
+
+    @outputs.setter
+    def outputs(self, value):
+        self._outputs = value
+
+    @property
+    def cache_state(self):
+        """
+        What the result of the command depends on besides its inputs, arguments and variables, it's part of its
+        cache key. None when it can't be determined, the result of the command isn't cached then.
+        """
+        return ''
+
+    @property
+    def dependencies(self):
+        return self._dependencies
+
+    @dependencies.setter
+    def dependencies(self, value):
+        self._dependencies = ['_prerun'] + [dep for dep in value if dep != '_prerun']
 
     def run(self, arguments):
         unknown_args = None
@@ -35,6 +87,21 @@ class Command(object):
 
         return return_value
 
+    def replay(self, record):
+        """
+        Replay a cached result instead of running the command
+
+        Args:
+            record: the result recorded by the ResultCache the last time this command ran
+        """
+        self.output = record['output']
+        self.exit_code = record['exit_code']
+        if self.output:
+            sys.stdout.write(self.output)
+            sys.stdout.flush()
+
+        return record['return_value']
+
     @abc.abstractmethod
     def _run(self, parsed_args, unknown_args, original_arguments):
         raise NotImplementedError("'_run' must be reimplemented by %s" % self)
@@ -43,7 +110,7 @@ class Command(object):
 class MBPreRunCommand(Command):
     def __init__(self, template_engine, version_scheme, build_context):
         super(MBPreRunCommand, self).__init__(add_arg_help=False)
-        # self.dependencies = []
+        self._dependencies = []
         self._template_engine = template_engine
         self._version_scheme = version_scheme
         self._build_context = build_context
@@ -52,6 +119,17 @@ class MBPreRunCommand(Command):
         version = self._version_scheme.generate()
         self._build_context.add_variables(version)
         self._template_engine.generate_files()
+        return version
+
+    @property
+    def cache_state(self):
+        # the version comes from HEAD and the tags, which aren't files the command lists as inputs
+        return self._version_scheme.cache_key()
+
+    def replay(self, record):
+        version = super(MBPreRunCommand, self).replay(record)
+        self._build_context.add_variables(version)
+        return version
 
 
 class DemoCommand(Command):
@@ -76,7 +154,11 @@ class ShellCommand(Command):
     def __init__(self, process, config):
         super(ShellCommand, self).__init__()
         self.process = process
+        self._config = config
         self._cwd = config.project_dir
+        self._timeout = None
+        self._log_file = None
+        self._log = None
         self._throw_on_failure = True
         self._expected_exit_code = 0
         self._command = "echo ShellCommand"
@@ -89,6 +171,25 @@ class ShellCommand(Command):
     def cwd(self, value):
         self._cwd = value
 
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+
+    @property
+    def log_file(self):
+        """
+        File the output of the command is streamed to, relative to the artifact directory
+        """
+        return self._log_file
+
+    @log_file.setter
+    def log_file(self, value):
+        self._log_file = value
+
     @property
     def throw_on_failure(self):
         return self._throw_on_failure
@@ -107,14 +208,77 @@ class ShellCommand(Command):
 
     @property
     def command(self):
+        """
+        The shell command to run, or a list (or mapping of prefix to command) of commands to run at the same time
+        """
         return self._command
 
     @command.setter
     def command(self, value):
         self._command = value
 
+    def _write_output(self, piece):
+        if self.capture_output:
+            self._captured.append(piece)
+        if self._log is not None:
+            self._log.write(piece)
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        stdout.write(piece)
+        stdout.flush()
+
+    def _open_log(self):
+        if not self.log_file:
+            return None
+
+        log_file = os.path.join(self._config.artifact_dir, self.log_file)
+        if not os.path.isdir(os.path.dirname(log_file)):
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        return open(log_file, 'wb')
+
+    def replay(self, record):
+        return_value = super(ShellCommand, self).replay(record)
+        # the log file of the run that was recorded is gone if the result came from another machine
+        log = self._open_log()
+        if log is not None:
+            with log:
+                log.write((record['output'] or '').encode('utf-8'))
+        return return_value
+
+    def _labelled_commands(self):
+        # several commands run at the same time, their output lines are prefixed with their key or position
+        if isinstance(self.command, dict):
+            return list(self.command.items())
+        return [(str(index + 1), command) for (index, command) in enumerate(self.command)]
+
     def _run(self, parsed_args, unknown_args, original_arguments):
-        self.process.execute(self.command, self.cwd, False, self.throw_on_failure, self.expected_exit_code)
+        concurrent = isinstance(self.command, (list, tuple, dict))
+        if not concurrent and not self.capture_output and not self.log_file:
+            return self.process.execute(self.command, self.cwd, False, self.throw_on_failure, self.expected_exit_code,
+                                        self.timeout)
+
+        # the output is shown while the command runs, and only kept in memory when it has to be captured
+        self._captured = []
+        self._log = self._open_log()
+        try:
+            if concurrent:
+                exit_codes = self.process.execute_all(self._labelled_commands(), self.cwd,
+                                                      on_output=self._write_output,
+                                                      throw_on_failure=self.throw_on_failure,
+                                                      expected_exit_code=self.expected_exit_code,
+                                                      timeout=self.timeout)
+                self.exit_code = next((code for code in exit_codes if code != self.expected_exit_code),
+                                      self.expected_exit_code)
+            else:
+                self.exit_code = self.process.stream(self.command, self.cwd, self._write_output, None, self.timeout,
+                                                     self.throw_on_failure, self.expected_exit_code)
+            self.output = b''.join(self._captured).decode('utf-8', 'replace') if self.capture_output else None
+        finally:
+            self._captured = []
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+        return self.exit_code
 
 
 class DockerCommand(Command):
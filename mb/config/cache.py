@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+from string import Template
+
+from mb.config.interpolation import interpolate_value
+from mb.lib import logger
+
+_log = logger.get_logger('[ConfigCache]')
+
+_CACHE_VERSION = 2
+
+
+def referenced_names(text):
+    return sorted(set(match.group('named') or match.group('braced')
+                      for match in Template.pattern.finditer(text)
+                      if match.group('named') or match.group('braced')))
+
+
+class ParsedFileCache(object):
+    """
+    On disk cache of parsed (and environment interpolated) config files.
+    An entry is valid while the file keeps its mtime and size, or its content hash when only those changed,
+    and while the environment variables the file references keep their values.
+    Entries are stored as json, content json can't represent exactly, like dates, isn't cached.
+    """
+
+    def __init__(self, cache_dir=None, cacheable=None):
+        # cacheable tells from the parsed content whether it can be stored in cache_dir
+        self.cache_dir = cache_dir
+        self.cacheable = cacheable
+
+    def _entry_file(self, path, interpolated):
+        key = hashlib.sha1('{0}|{1}'.format(path, interpolated).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _read(self, entry_file):
+        if not os.path.isfile(entry_file):
+            return None
+
+        try:
+            with open(entry_file, 'r') as cache:
+                entry = json.load(cache)
+        except Exception as err:
+            _log.debug('Ignoring unreadable config cache entry {0}: {1}'.format(entry_file, err))
+            return None
+
+        return entry if isinstance(entry, dict) and entry.get('version') == _CACHE_VERSION else None
+
+    def _write(self, entry_file, entry):
+        try:
+            encoded = json.dumps(entry)
+            if json.loads(encoded) != entry:
+                _log.debug('Not caching {0}, it can\'t be stored as json'.format(entry_file))
+                return
+        except (TypeError, ValueError) as err:
+            _log.debug('Not caching {0}, it can\'t be stored as json: {1}'.format(entry_file, err))
+            return
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_file = '{0}.{1}.tmp'.format(entry_file, os.getpid())
+            with open(temp_file, 'w') as cache:
+                cache.write(encoded)
+            os.replace(temp_file, entry_file)
+        except (IOError, OSError) as err:
+            _log.debug('Unable to write config cache entry {0}: {1}'.format(entry_file, err))
+
+    def load(self, filename, parse, mappings=None):
+        """
+        Load a config file, parsing it only when the cached entry is stale
+
+        Args:
+            filename: the yaml or json file to load
+            parse: callable that parses the text of the file
+            mappings: environment used to interpolate ${VAR} references in the file, or None
+
+        Returns:
+            the parsed and interpolated content of the file
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        entry_file = self._entry_file(path, bool(mappings)) if self.cache_dir else None
+        entry = self._read(entry_file) if entry_file else None
+
+        if entry and any(mappings.get(name) != value for (name, value) in entry['env'].items()):
+            entry = None
+
+        if entry and (entry['mtime'], entry['size']) == (stat.st_mtime_ns, stat.st_size):
+            return entry['data']
+
+        with open(path, 'rb') as fh:
+            raw = fh.read()
+        content_hash = hashlib.sha1(raw).hexdigest()
+
+        if entry and entry['hash'] == content_hash:
+            data = entry['data']
+        else:
+            text = raw.decode('utf-8')
+            data = parse(text)
+            env = {}
+            if mappings:
+                env = {name: mappings.get(name) for name in referenced_names(text)}
+                data = interpolate_value(data, mappings)
+            entry = {'version': _CACHE_VERSION, 'hash': content_hash, 'env': env, 'data': data}
+
+        if entry_file and (self.cacheable is None or self.cacheable(data)):
+            entry.update({'mtime': stat.st_mtime_ns, 'size': stat.st_size})
+            self._write(entry_file, entry)
+
+        return data
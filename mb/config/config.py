@@ -1,29 +1,44 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import functools
 import json
 import os
 import re
+import threading
 from collections import namedtuple
 
 import six
 import yaml
 from jsonpath_rw import parse
 
+from mb.config.cache import ParsedFileCache
+from mb.config.discovery import find_candidates_in_parent_dirs as _find_candidates_in_parent_dirs
+from mb.config.discovery import SUPPORTED_FILENAMES
 from mb.config.errors import ConfigurationError
 from mb.config.errors import MasterBuilderFileNotFoundError
-from mb.config.interpolation import interpolate_value
 from mb.lib import logger
+from mb.lib import trace
 from mb.lib.memoize import memoize
 
-SUPPORTED_FILENAMES = [
-    '.mb.yml',
-    '.mb.yaml',
-    '.mb.json'
-]
-
 _log = logger.get_logger('[Config]')
 
+# plain dotted paths like config.artifact_dir don't need the JSONPath engine
+_DOTTED_PATH = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_\-]*(\.[a-zA-Z_][a-zA-Z0-9_\-]*)*$')
+
+# parsing a JSONPath expression builds a PLY parser, compiled expressions are shared by the whole process
+_parse_jsonpath = functools.lru_cache(maxsize=512)(parse)
+
+_REFERENCE = re.compile(r"\@\{\{.+?\}\}")
+_MISSING = object()
+_resolvers_lock = threading.Lock()
+
+# use libyaml when PyYAML was built with it
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# cache of the files referenced with file://, it lives in the artifact dir of the loaded config file
+_reference_cache = ParsedFileCache()
+
 
 class PluginConfig(namedtuple('_PluginConfig', 'name plugin_config master_config')):
     """
@@ -39,8 +54,7 @@ class PluginConfig(namedtuple('_PluginConfig', 'name plugin_config master_config
         Returns:
             a dictionary of plugin config keys and values
         """
-        return {_expand_value(self.master_config, key): _expand_value(self.master_config, value)
-                for key, value in self.plugin_config.items()}
+        return _expand_value(self.master_config, self.plugin_config or {})
 
 
 class ConfigFile(namedtuple('_ConfigFile', 'filename config')):
@@ -48,6 +62,32 @@ class ConfigFile(namedtuple('_ConfigFile', 'filename config')):
     Represents the Master Builder Config File
     """
 
+    def __new__(cls, filename, config):
+        if type(config) is dict:
+            config = _Config(config)
+        return super(ConfigFile, cls).__new__(cls, filename, config)
+
+    @property
+    def resolved(self):
+        """
+        Get the config with every @{{...}} and file:// reference expanded, useful to dump for debugging
+
+        Returns:
+            an immutable dictionary of the fully resolved config
+        """
+        return _resolver(self.config).snapshot
+
+    @property
+    def name(self):
+        return _get_value(self.config, 'name') or os.path.basename(self.project_dir)
+
+    @property
+    def project_dependencies(self):
+        """
+        Names of the projects of a workspace this project depends on, they run a command before this one does
+        """
+        return _get_value(self.config, 'config.project_dependencies') or []
+
     @property
     def project_dir(self):
         """
@@ -73,7 +113,7 @@ class ConfigFile(namedtuple('_ConfigFile', 'filename config')):
         dir = os.path.join(self.project_dir, _get_value(self.config, 'config.artifact_dir', '.build'))
         if not os.path.exists(dir):
             _log.debug('artifact directory does not exist, creating it...')
-            os.makedirs(dir)
+            os.makedirs(dir, exist_ok=True)
         return dir
 
     @property
@@ -109,13 +149,16 @@ class ConfigFile(namedtuple('_ConfigFile', 'filename config')):
         return self._load_plugin_config(plugin, default)
 
     @property
-    def variables(self):
-        variables = _get_values(self.config, "variables")
-        if not variables:
-            return {}
+    def artifact_cache(self):
+        default = "FileSystemArtifactCache"
+        plugin = _get_value(self.config, "config.artifact_cache")
+        if not plugin:
+            return self._load_plugin_config(default)
+        return self._load_plugin_config(plugin, default)
 
-        variables = variables[0]
-        return {_expand_value(self.config, key): _expand_value(self.config, value) for key, value in variables.items()}
+    @property
+    def variables(self):
+        return _get_value(self.config, "variables") or {}
 
     @property
     def commands(self):
@@ -151,6 +194,7 @@ class ConfigFile(namedtuple('_ConfigFile', 'filename config')):
         return PluginConfig(name, config, self.config)
 
 
+@trace.traced('load config', 'config')
 def get_default_config_file(base_dir="./", mappings=os.environ):
     (candidates, path) = _find_candidates_in_parent_dirs(SUPPORTED_FILENAMES, base_dir)
 
@@ -164,35 +208,200 @@ def get_default_config_file(base_dir="./", mappings=os.environ):
         _log.warn("Using %s\n", winner)
 
     file = os.path.join(path, winner)
+
+    # the artifact dir is set in the config file itself, so its cache is only known once it's parsed:
+    # the config file is looked up in the default artifact dir, and only cached there when it keeps that one
+    default_artifact_dir = os.path.join(path, '.build')
+    cache = ParsedFileCache(os.path.join(default_artifact_dir, 'cache', 'config'),
+                            lambda data: _uses_artifact_dir(path, data, default_artifact_dir))
     if (winner.endswith('json')):
-        return ConfigFile(file, _load_json(file, mappings))
+        config = ConfigFile(file, _load_json(file, mappings, cache))
+    else:
+        config = ConfigFile(file, _load_yaml(file, mappings, cache))
 
-    return ConfigFile(file, _load_yaml(file, mappings))
+    global _reference_cache
+    _reference_cache = ParsedFileCache(os.path.join(config.artifact_dir, 'cache', 'config'))
+    return config
 
 
-def _get_value(config, value, default_value=None):
-    jsonpath_expr = parse(value)
-    for match in jsonpath_expr.find(config):
-        return _expand_value(config, match.value)
+def _uses_artifact_dir(project_dir, data, artifact_dir):
+    if not isinstance(data, dict):
+        return False
+    try:
+        configured = _get_value(data, 'config.artifact_dir', '.build')
+    except ConfigurationError:
+        return False
+    return os.path.normpath(os.path.join(project_dir, configured)) == os.path.normpath(artifact_dir)
+
+
+def jsonpath_cache_info():
+    """
+    Returns:
+        the hits, misses, maxsize and currsize of the compiled JSONPath expression cache
+    """
+    return _parse_jsonpath.cache_info()
 
-    return default_value
 
+def _find(config, path):
+    if _DOTTED_PATH.match(path):
+        value = config
+        for field in path.split('.'):
+            if not isinstance(value, dict) or field not in value:
+                return []
+            value = value[field]
+        return [value]
 
-def _get_values(config, value):
-    jsonpath_expr = parse(value)
-    return [_expand_value(config, match.value) for match in jsonpath_expr.find(config)]
+    return [match.value for match in _parse_jsonpath(path).find(config)]
 
 
-def _expand_value(config, value):
-    if not isinstance(value, six.string_types):
+class _Config(dict):
+    """
+    A loaded config, it carries the resolver of its references so they're resolved once for as long as it's used
+    """
+
+    def __init__(self, *args, **kw):
+        dict.__init__(self, *args, **kw)
+        self.resolver = None
+
+    def __reduce__(self):
+        # a copy of the config resolves its references again
+        return (_Config, (dict(self),))
+
+
+class FrozenDict(dict):
+    """
+    A dictionary of resolved config that can't be modified, copying it gives a regular dictionary
+    """
+
+    def _immutable(self, *args, **kw):
+        raise TypeError('The resolved config can not be modified')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class FrozenList(list):
+    """
+    A list of resolved config that can't be modified, copying it gives a regular list
+    """
+
+    def _immutable(self, *args, **kw):
+        raise TypeError('The resolved config can not be modified')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = clear = sort = reverse = _immutable
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+class _Resolver(object):
+    """
+    Expands the references of one config, every reference is resolved once in dependency order
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._references = {}
+        self._all_references = {}
+        self._resolving = []
+        self._snapshot = None
+        self._lock = threading.RLock()
+
+    @property
+    def snapshot(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self.expand(self.config)
+            return self._snapshot
+
+    def _enter(self, path):
+        if path in self._resolving:
+            cycle = self._resolving[self._resolving.index(path):] + [path]
+            raise ConfigurationError('Reference cycle in config: {0}'.format(' -> '.join('@{{' + ref + '}}' for ref in cycle)))
+        self._resolving.append(path)
+
+    def resolve(self, path):
+        """
+        Returns:
+            the expanded value of the first match of the path, or _MISSING
+        """
+        with self._lock:
+            if path not in self._references:
+                self._enter(path)
+                try:
+                    with trace.span('resolve reference', 'config', path=path):
+                        matches = _find(self.config, path)
+                    self._references[path] = self.expand(matches[0]) if matches else _MISSING
+                finally:
+                    self._resolving.pop()
+            return self._references[path]
+
+    def resolve_all(self, path):
+        with self._lock:
+            if path not in self._all_references:
+                self._enter(path)
+                try:
+                    with trace.span('resolve reference', 'config', path=path):
+                        matches = _find(self.config, path)
+                    self._all_references[path] = tuple(self.expand(match) for match in matches)
+                finally:
+                    self._resolving.pop()
+            return self._all_references[path]
+
+    def _reference(self, match):
+        path = match.group()[3:-2]
+        value = self.resolve(path)
+        if value is _MISSING:
+            raise ConfigurationError('The config reference {0} does not match anything'.format(match.group()))
+        return '{0}'.format(value)
+
+    def expand(self, value):
+        if isinstance(value, (FrozenDict, FrozenList)):
+            return value
+
+        if isinstance(value, dict):
+            return FrozenDict((self.expand(key), self.expand(item)) for key, item in value.items())
+
+        if isinstance(value, list):
+            return FrozenList(self.expand(item) for item in value)
+
+        if not isinstance(value, six.string_types):
+            return value
+
+        with self._lock:
+            value = _REFERENCE.sub(self._reference, value)
+
+        if (value.startswith('file://')):
+            return _expand_file(value[7:])
+
         return value
 
-    value = re.sub(r"\@\{\{.+?\}\}", lambda m: _get_value(config, m.group()[3:-2]), value)
 
-    if (value.startswith('file://')):
-        return _expand_file(value[7:])
+def _resolver(config):
+    if not isinstance(config, _Config):
+        # only loaded configs keep their resolver, other dictionaries are resolved again on every call
+        return _Resolver(config)
+
+    with _resolvers_lock:
+        if config.resolver is None:
+            config.resolver = _Resolver(config)
+        return config.resolver
+
+
+def _get_value(config, value, default_value=None):
+    resolved = _resolver(config).resolve(value)
+    return default_value if resolved is _MISSING else resolved
 
-    return value
+
+def _get_values(config, value):
+    return list(_resolver(config).resolve_all(value))
+
+
+def _expand_value(config, value):
+    return _resolver(config).expand(value)
 
 
 def _expand_file(file):
@@ -208,10 +417,10 @@ def _expand_file(file):
 
     loaded_file = None
     if file_name.endswith('yaml') or file_name.endswith('yml'):
-        loaded_file = _load_yaml(file_name)
+        loaded_file = _load_yaml(file_name, None, _reference_cache)
 
     if file_name.endswith('json'):
-        loaded_file = _load_json(file_name)
+        loaded_file = _load_json(file_name, None, _reference_cache)
 
     if loaded_file:
         return _get_value(loaded_file, json_path)
@@ -220,39 +429,25 @@ def _expand_file(file):
                              .format({file: file}))
 
 
-@memoize("filename")
-def _load_yaml(filename, mappings=None):
+def _loaded(value):
+    return _Config(value) if isinstance(value, dict) else value
+
+
+@memoize("filename", maxsize=64, file_args=("filename",))
+def _load_yaml(filename, mappings=None, cache=None):
     try:
-        with open(filename, 'r') as fh:
-            return_yaml = yaml.safe_load(fh)
-            if mappings:
-                return interpolate_value(return_yaml, mappings)
-            return return_yaml
-    except (IOError, yaml.YAMLError) as e:
+        return _loaded((cache or ParsedFileCache()).load(filename, lambda text: yaml.load(text, Loader=_YamlLoader), mappings))
+    except (IOError, OSError, yaml.YAMLError) as e:
         error_name = getattr(e, '__module__', '') + '.' + e.__class__.__name__
         raise ConfigurationError("{}: {}".format(error_name, e))
 
 
-@memoize("filename")
-def _load_json(filename, mappings=None):
+@memoize("filename", maxsize=64, file_args=("filename",))
+def _load_json(filename, mappings=None, cache=None):
     try:
-        with open(filename, 'r') as fh:
-            return_json = json.load(fh)
-            if mappings:
-                return interpolate_value(return_json, mappings)
-            return return_json
+        return _loaded((cache or ParsedFileCache()).load(filename, json.loads, mappings))
+    except ConfigurationError:
+        raise
     except Exception as e:
         error_name = getattr(e, '__module__', '') + '.' + e.__class__.__name__
         raise ConfigurationError("{}: {}".format(error_name, e))
-
-
-def _find_candidates_in_parent_dirs(filenames, path):
-    candidates = [filename for filename in filenames
-                  if os.path.exists(os.path.join(path, filename))]
-
-    if not candidates:
-        parent_dir = os.path.join(path, '..')
-        if os.path.abspath(parent_dir) != os.path.abspath(path):
-            return _find_candidates_in_parent_dirs(filenames, parent_dir)
-
-    return (candidates, path)
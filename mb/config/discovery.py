@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+
+# this module is imported by the thin daemon client, keep it free of heavy imports
+
+SUPPORTED_FILENAMES = [
+    '.mb.yml',
+    '.mb.yaml',
+    '.mb.json'
+]
+
+
+def find_candidates_in_parent_dirs(filenames, path):
+    candidates = [filename for filename in filenames
+                  if os.path.exists(os.path.join(path, filename))]
+
+    if not candidates:
+        parent_dir = os.path.join(path, '..')
+        if os.path.abspath(parent_dir) != os.path.abspath(path):
+            return find_candidates_in_parent_dirs(filenames, parent_dir)
+
+    return (candidates, path)
+
+
+def _list_projects(directory, filenames):
+    configs = []
+    dirs = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return (configs, dirs)
+
+    names = set(entry.name for entry in entries)
+    configs.extend(os.path.join(directory, filename) for filename in filenames if filename in names)
+    for entry in entries:
+        # hidden directories hold artifacts and vcs data, like .build and .git
+        if entry.name.startswith('.') or entry.name == 'node_modules':
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+        except OSError:
+            continue
+    return (configs[:1], dirs)
+
+
+def find_projects(root, filenames=SUPPORTED_FILENAMES, workers=None):
+    """
+    Find the config files of every project under root, in a single walk listing directories in parallel
+
+    Returns:
+        the sorted paths of the config files, the first supported filename of each directory
+    """
+    from concurrent import futures
+
+    configs = []
+    with futures.ThreadPoolExecutor(workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        pending = set([pool.submit(_list_projects, os.path.abspath(root), filenames)])
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                (found, dirs) = future.result()
+                configs.extend(found)
+                pending.update(pool.submit(_list_projects, directory, filenames) for directory in dirs)
+    return sorted(configs)
@@ -0,0 +1,211 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import inspect
+import threading
+
+from mb.config.config import PluginConfig
+from mb.lib import logger
+from mb.lib import trace
+
+_log = logger.get_logger('[Ioc]')
+
+# Scopes of the instances the container creates, a plugin class picks its own with a `scope` class attribute.
+# Singletons are shared by the whole run, a command scoped plugin gets an instance per command using it.
+SINGLETON = 'singleton'
+COMMAND = 'command'
+
+_MISSING = object()
+
+
+class DependencyError(Exception):
+    def __init__(self, name, reason):
+        self.name = name
+        self.reason = reason
+
+    def __str__(self):
+        return 'Unable to resolve the dependency \'{0}\': {1}'.format(self.name, self.reason)
+
+
+class DependencyCycleError(Exception):
+    def __init__(self, cycle):
+        self.cycle = cycle
+
+    def __str__(self):
+        return 'Dependency cycle: {0}'.format(' -> '.join(self.cycle))
+
+
+class WiringPlan(object):
+    """
+    How to create a plugin class, worked out once per class:
+    the dependencies its constructor takes in order, with their defaults, the properties a plugin config can set
+    and the scope of its instances.
+    """
+
+    def __init__(self, plugin_class):
+        self.plugin_class = plugin_class
+        self.arguments = []
+        self.defaults = {}
+        self.properties = set()
+        self.read_only_properties = set()
+        self.scope = getattr(plugin_class, 'scope', SINGLETON)
+
+        # classes without a constructor of their own, like subclasses of a plugin, inherit the one of their parent
+        if plugin_class.__init__ is not object.__init__:
+            for parameter in list(inspect.signature(plugin_class.__init__).parameters.values())[1:]:
+                if parameter.kind not in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD):
+                    continue
+                self.arguments.append(parameter.name)
+                if parameter.default is not parameter.empty:
+                    self.defaults[parameter.name] = parameter.default
+
+        for klass in reversed(plugin_class.__mro__):
+            for (name, value) in vars(klass).items():
+                if isinstance(value, property):
+                    self.properties.discard(name)
+                    self.read_only_properties.discard(name)
+                    (self.properties if value.fset is not None else self.read_only_properties).add(name)
+
+    def configure(self, instance, name, plugin_config):
+        for (key, value) in plugin_config.items():
+            if key in self.properties:
+                try:
+                    setattr(instance, key, value)
+                except Exception as err:
+                    _log.warn('There was a problem setting the plugin config: \'{0}\' on \'{1}\' with \'{2}\'.'.format(name, key, value))
+                    _log.debug('Exception occured while trying to set a plugin config value: {0}'.format(err))
+            elif key in self.read_only_properties:
+                _log.warn('The following plugin config: {0}, is read only on {1}'.format(key, name))
+            else:
+                _log.warn('The following plugin config: {0}, is not an option to set on {1}'.format(key, name))
+
+
+class Container(object):
+    """
+    Creates the plugins and injects their constructor arguments by name.
+
+    A dependency name resolves through its provider, a function returning either the object itself
+    or the PluginConfig of the plugin to create. Each provider is called once. Instances are cached by scope,
+    so once created resolving is a dictionary lookup without any lock. Creating instances is serialized,
+    which makes every singleton unique when commands run in parallel.
+    """
+
+    def __init__(self, get_plugin_class):
+        self._get_plugin_class = get_plugin_class
+        self._providers = {}
+        self._plugin_configs = {}
+        self._plans = {}
+        self._singletons = {}
+        self._scoped = {}
+        self._commands = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def register(self, name, provider):
+        self._providers[name] = provider
+
+    def register_instance(self, name, instance):
+        self._singletons[name] = instance
+
+    def plan(self, plugin_class):
+        plan = self._plans.get(plugin_class)
+        if plan is None:
+            plan = self._plans[plugin_class] = WiringPlan(plugin_class)
+        return plan
+
+    def _resolving(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self, key):
+        stack = self._resolving()
+        if key in stack:
+            raise DependencyCycleError(stack[stack.index(key):] + [key])
+        stack.append(key)
+
+    def _provide(self, name):
+        # the provider of a plugin looks up the config, which is only done once
+        if name not in self._plugin_configs:
+            if name not in self._providers:
+                raise DependencyError(name, 'no such dependency')
+            self._plugin_configs[name] = self._providers[name]()
+        return self._plugin_configs[name]
+
+    def resolve(self, name, scope=None):
+        """
+        Get the instance of a dependency
+
+        Args:
+            name: the name of the dependency, which is the name of a constructor argument
+            scope: the command the dependency is resolved for, if any
+        """
+        instance = self._singletons.get(name, _MISSING)
+        if instance is _MISSING:
+            instance = self._scoped.get((scope, name), _MISSING)
+        if instance is not _MISSING:
+            return instance
+
+        with self._lock:
+            self._enter(name)
+            try:
+                return self._create_dependency(name, scope)
+            finally:
+                self._resolving().pop()
+
+    def _create_dependency(self, name, scope):
+        # another thread may have created it while this one waited for the lock
+        for (instances, key) in ((self._singletons, name), (self._scoped, (scope, name))):
+            if key in instances:
+                return instances[key]
+
+        provided = self._provide(name)
+        if not isinstance(provided, PluginConfig):
+            self._singletons[name] = provided
+            return provided
+
+        plan = self.plan(self._get_plugin_class(provided.name))
+        if plan.scope == COMMAND:
+            instance = self._scoped[(scope, name)] = self.create(provided, scope)
+        else:
+            # a singleton is shared by every command, so are its dependencies
+            instance = self._singletons[name] = self.create(provided)
+        return instance
+
+    def create(self, plugin, scope=None):
+        """
+        Create a new instance of a plugin, its dependencies are resolved for the command of the scope
+        """
+        with self._lock:
+            plan = self.plan(self._get_plugin_class(plugin.name))
+            with trace.span('load plugin', 'ioc', plugin=plugin.name):
+                arguments = []
+                for argument in plan.arguments:
+                    try:
+                        arguments.append(self.resolve(argument, scope))
+                    except DependencyError as err:
+                        if err.name != argument or argument not in plan.defaults:
+                            raise
+                        arguments.append(plan.defaults[argument])
+
+                instance = plan.plugin_class(*arguments)
+                plan.configure(instance, plugin.name, plugin.config)
+            return instance
+
+    def command(self, name, plugin):
+        """
+        Get the instance of a command, there is one per command name since
+        several commands can use the same plugin with different configs
+        """
+        instance = self._commands.get(name, _MISSING)
+        if instance is not _MISSING:
+            return instance
+
+        with self._lock:
+            if name not in self._commands:
+                self._enter('command ' + name)
+                try:
+                    self._commands[name] = self.create(plugin, name)
+                finally:
+                    self._resolving().pop()
+            return self._commands[name]
@@ -0,0 +1,399 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent import futures
+
+from mb.lib import logger
+from mb.lib import trace
+
+_log = logger.get_logger('[Fingerprint]')
+
+# Content hashes of the project files. A stat cache maps every file to the (inode, size, mtime_ns) it had when it
+# was hashed, so a file is only read again once one of them changes.
+
+IGNORE_FILES = ['.gitignore', '.mbignore']
+
+_GLOB_CHARS = '*?['
+_MMAP_THRESHOLD = 1024 * 1024
+# a file written within this many ns of a scan can change again without its mtime changing,
+# coarse filesystems have a 2 second resolution, it isn't trusted from the stat cache
+_RACY_WINDOW = 2 * 10 ** 9
+_STAT_CACHE_VERSION = 1
+
+
+def input_root(pattern):
+    """
+    The directory part of an input glob before its first wildcard, changes can only happen under it
+    """
+    parts = []
+    for part in pattern.replace('\\', '/').split('/'):
+        if any(char in part for char in _GLOB_CHARS):
+            break
+        parts.append(part)
+    else:
+        # no wildcard at all, the pattern is a plain file
+        parts = parts[:-1]
+    return os.path.join(*parts) if parts else ''
+
+
+def glob_to_regex(pattern):
+    """
+    Translate a glob to a regex matching '/' separated relative paths,
+    '*' and '?' don't match '/' and '**' matches any number of directories like it does for glob and .gitignore
+    """
+    regex = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith('**/', index):
+            regex.append('(?:.*/)?')
+            index += 3
+        elif pattern.startswith('**', index):
+            regex.append('.*')
+            index += 2
+        elif char == '*':
+            regex.append('[^/]*')
+            index += 1
+        elif char == '?':
+            regex.append('[^/]')
+            index += 1
+        elif char == '[' and pattern.find(']', index + 2) > 0:
+            end = pattern.find(']', index + 2)
+            body = pattern[index + 1:end].replace('\\', '\\\\')
+            regex.append('[' + ('^' + body[1:] if body[:1] in '!^' else body) + ']')
+            index = end + 1
+        else:
+            regex.append(re.escape(char))
+            index += 1
+    return ''.join(regex)
+
+
+def compile_glob(pattern):
+    """
+    Returns:
+        a regex matching the '/' separated relative paths a glob names, a plain path only matches itself
+    """
+    pattern = pattern.replace('\\', '/')
+    if not any(char in pattern for char in _GLOB_CHARS):
+        return re.compile('^' + re.escape(os.path.normpath(pattern).replace(os.sep, '/')) + '$')
+    return re.compile('^' + glob_to_regex(pattern) + '$')
+
+
+def hash_file(path):
+    """
+    Returns:
+        the sha1 hex digest of the content of a file, large files are mapped instead of read
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as input_file:
+        size = os.fstat(input_file.fileno()).st_size
+        if size >= _MMAP_THRESHOLD:
+            with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                digest.update(content)
+        else:
+            digest.update(input_file.read())
+    return digest.hexdigest()
+
+
+class IgnoreRules(object):
+    """
+    The rules of the .gitignore and .mbignore files of a project, each file applies to its own directory.
+    Like for git, a deeper file overrides the files above it and the last matching line of a file wins.
+    """
+
+    def __init__(self):
+        self._rules = {}
+
+    @staticmethod
+    def _parse(line):
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            return None
+
+        line = line.rstrip(' ')
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        if line.startswith('\\'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        # a pattern with a slash is relative to the directory of the ignore file, otherwise it matches at any depth
+        anchored = '/' in line
+        regex = glob_to_regex(line.lstrip('/'))
+        if not anchored:
+            regex = '(?:.*/)?' + regex
+        return (re.compile('^' + regex + '$'), negate, dir_only)
+
+    def add(self, directory, lines):
+        """
+        Add the rules of an ignore file of directory, '' for the project directory
+        """
+        rules = [rule for rule in (self._parse(line) for line in lines) if rule is not None]
+        if rules:
+            self._rules[directory] = self._rules.get(directory, []) + rules
+
+    def load(self, project_dir, directory, names):
+        for name in IGNORE_FILES:
+            if name in names:
+                try:
+                    with open(os.path.join(project_dir, directory, name), 'r') as ignore_file:
+                        self.add(directory, ignore_file.readlines())
+                except (IOError, OSError, UnicodeDecodeError) as err:
+                    _log.debug('Unable to read {0}: {1}'.format(os.path.join(directory, name), err))
+
+    def is_ignored(self, path, is_dir=False):
+        """
+        Check a '/' separated path relative to the project directory, its parent directories are expected not ignored
+        """
+        ignored = False
+        parts = path.split('/')
+        for depth in range(len(parts)):
+            rules = self._rules.get('/'.join(parts[:depth]))
+            if not rules:
+                continue
+            relative = '/'.join(parts[depth:])
+            for (regex, negate, dir_only) in rules:
+                if (is_dir or not dir_only) and regex.match(relative):
+                    ignored = not negate
+        return ignored
+
+
+class Changes(namedtuple('_Changes', 'added modified removed')):
+    """
+    Sorted lists of the paths that were added, modified and removed since a previous snapshot
+    """
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.removed)
+
+    __nonzero__ = __bool__
+
+    @property
+    def paths(self):
+        return sorted(self.added + self.modified + self.removed)
+
+
+class Fingerprinter(object):
+    """
+    Hashes the files of a project directory.
+    The stat cache is kept in cache_dir, along with the snapshots `changes` compares the files to.
+    The .git directories and the excluded directories, like the artifact dir, are never walked.
+    """
+
+    def __init__(self, project_dir, cache_dir, excludes=(), workers=None):
+        self.project_dir = os.path.abspath(project_dir)
+        self.cache_dir = cache_dir
+        self.stat_cache_file = os.path.join(cache_dir, 'stat_cache.json')
+        self.excludes = set(os.path.relpath(os.path.abspath(exclude), self.project_dir).replace(os.sep, '/')
+                            for exclude in excludes)
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self._lock = threading.Lock()
+        self._stat_cache = None
+        self._dirty = False
+
+    def _load_stat_cache(self):
+        with self._lock:
+            if self._stat_cache is not None:
+                return self._stat_cache
+
+            self._stat_cache = {}
+            try:
+                with open(self.stat_cache_file, 'r') as cache_file:
+                    data = json.load(cache_file)
+                if data.get('version') == _STAT_CACHE_VERSION:
+                    self._stat_cache = data['files']
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+            return self._stat_cache
+
+    def save(self):
+        """
+        Persist the stat cache, done after every hashing that had to read files
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            temp_file = '{0}.{1}.tmp'.format(self.stat_cache_file, os.getpid())
+            with open(temp_file, 'w') as cache_file:
+                json.dump({'version': _STAT_CACHE_VERSION, 'files': self._stat_cache}, cache_file)
+            os.replace(temp_file, self.stat_cache_file)
+            self._dirty = False
+
+    def _scan_dir(self, directory, ignore_rules):
+        files = []
+        dirs = []
+        try:
+            entries = list(os.scandir(os.path.join(self.project_dir, directory)))
+        except OSError as err:
+            _log.debug('Unable to list {0}: {1}'.format(directory, err))
+            return (files, dirs)
+
+        if ignore_rules is not None:
+            ignore_rules.load(self.project_dir, directory, set(entry.name for entry in entries))
+
+        for entry in entries:
+            path = directory + '/' + entry.name if directory else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if entry.name == '.git' or path in self.excludes or (ignore_rules is not None and ignore_rules.is_ignored(path, is_dir)):
+                    continue
+                if is_dir:
+                    dirs.append(path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files.append((path, stat))
+            except OSError:
+                # removed while walking
+                continue
+        return (files, dirs)
+
+    def _walk(self, pool, root, ignore_rules):
+        """
+        Returns:
+            list of (path, stat) of the files under root, the directories are listed in parallel
+        """
+        files = []
+        pending = set([pool.submit(self._scan_dir, root, ignore_rules)])
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                (found, dirs) = future.result()
+                files.extend(found)
+                pending.update(pool.submit(self._scan_dir, directory, ignore_rules) for directory in dirs)
+        return files
+
+    def _hash(self, pool, files):
+        stat_cache = self._load_stat_cache()
+        racy = int(time.time() * 1e9) - _RACY_WINDOW
+        hashes = {}
+        to_hash = []
+        for (path, stat) in files:
+            entry = stat_cache.get(path)
+            if entry and entry[:3] == [stat.st_ino, stat.st_size, stat.st_mtime_ns]:
+                hashes[path] = entry[3]
+            else:
+                to_hash.append((path, stat))
+
+        def hash_one(path):
+            try:
+                return hash_file(os.path.join(self.project_dir, path))
+            except (IOError, OSError):
+                return None
+
+        with trace.span('hash files', 'fingerprint', files=len(to_hash)):
+            for ((path, stat), digest) in zip(to_hash, pool.map(hash_one, [path for (path, _) in to_hash])):
+                if digest is None:
+                    continue
+                hashes[path] = digest
+                if stat.st_mtime_ns < racy:
+                    with self._lock:
+                        stat_cache[path] = [stat.st_ino, stat.st_size, stat.st_mtime_ns, digest]
+                        self._dirty = True
+
+        return hashes
+
+    def scan(self):
+        """
+        Hash every file of the project that isn't ignored by a .gitignore or .mbignore file
+
+        Returns:
+            dict of '/' separated path relative to the project directory to content hash
+        """
+        with trace.span('scan project', 'fingerprint'), futures.ThreadPoolExecutor(self.workers) as pool:
+            files = self._walk(pool, '', IgnoreRules())
+            hashes = self._hash(pool, files)
+
+        with self._lock:
+            # forget the files that are gone, the ignored ones may still be inputs
+            for path in [path for path in self._stat_cache if path not in hashes]:
+                if not os.path.lexists(os.path.join(self.project_dir, path)):
+                    del self._stat_cache[path]
+                    self._dirty = True
+        self.save()
+        return hashes
+
+    def hashes(self, patterns):
+        """
+        Hash the files matching globs relative to the project directory, only the directories the globs
+        can match under are walked. Ignore files don't apply, the files are the ones the globs name.
+
+        Returns:
+            dict of '/' separated path relative to the project directory to content hash
+        """
+        files = {}
+        with trace.span('hash inputs', 'fingerprint'), futures.ThreadPoolExecutor(self.workers) as pool:
+            for pattern in patterns or []:
+                pattern = pattern.replace('\\', '/')
+                if not any(char in pattern for char in _GLOB_CHARS):
+                    try:
+                        stat = os.stat(os.path.join(self.project_dir, pattern))
+                    except OSError:
+                        continue
+                    files[os.path.normpath(pattern).replace(os.sep, '/')] = stat
+                    continue
+
+                regex = compile_glob(pattern)
+                root = input_root(pattern).replace(os.sep, '/')
+                if not os.path.isdir(os.path.join(self.project_dir, root)):
+                    continue
+                files.update((path, stat) for (path, stat) in self._walk(pool, root, None) if regex.match(path))
+
+            hashes = self._hash(pool, sorted(files.items()))
+
+        self.save()
+        return hashes
+
+    def _snapshot_file(self, name):
+        return os.path.join(self.cache_dir, 'snapshots', '{0}.json'.format(hashlib.sha1(name.encode('utf-8')).hexdigest()))
+
+    def changes(self, name, patterns=None):
+        """
+        Find what changed since the previous call with the same name, everything is added on the first one.
+
+        Args:
+            name: identifies the caller, like the name of a command
+            patterns: globs of the files to compare, every file of the project that isn't ignored by default
+
+        Returns:
+            Changes
+        """
+        current = self.scan() if patterns is None else self.hashes(patterns)
+        snapshot_file = self._snapshot_file(name)
+        try:
+            with open(snapshot_file, 'r') as previous_file:
+                previous = json.load(previous_file)
+        except (IOError, OSError, ValueError):
+            previous = {}
+
+        changes = Changes(sorted(path for path in current if path not in previous),
+                          sorted(path for path in current if path in previous and previous[path] != current[path]),
+                          sorted(path for path in previous if path not in current))
+
+        if changes or not os.path.exists(snapshot_file):
+            if not os.path.isdir(os.path.dirname(snapshot_file)):
+                os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+            temp_file = '{0}.{1}.tmp'.format(snapshot_file, os.getpid())
+            with open(temp_file, 'w') as snapshot:
+                json.dump(current, snapshot)
+            os.replace(temp_file, snapshot_file)
+        return changes
+
+
+def for_config(config):
+    """
+    Returns:
+        a Fingerprinter of the project of a ConfigFile, its caches are in the artifact dir
+    """
+    return Fingerprinter(config.project_dir, os.path.join(config.artifact_dir, 'cache', 'fingerprints'),
+                         [config.artifact_dir])
@@ -0,0 +1,348 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import binascii
+import glob
+import heapq
+import mmap
+import os
+import struct
+import zlib
+
+# Reads commits and tags straight from the object database of a repository, loose objects and packfiles,
+# so generating a version doesn't have to fork git.
+
+_OBJECT_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+_OFS_DELTA = 6
+_REF_DELTA = 7
+_IDX_MAGIC = b'\377tOc'
+_READ_SIZE = 64 * 1024
+
+
+class GitObjectError(Exception):
+    def __init__(self, sha, reason):
+        self.sha = sha
+        self.reason = reason
+
+    def __str__(self):
+        return 'Unable to read git object {0}: {1}'.format(self.sha, self.reason)
+
+
+def _map(file):
+    with open(file, 'rb') as fh:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _inflate(buffer, offset):
+    decompressor = zlib.decompressobj()
+    data = []
+    while not decompressor.eof:
+        chunk = buffer[offset:offset + _READ_SIZE]
+        if not chunk:
+            raise zlib.error('truncated object')
+        data.append(decompressor.decompress(chunk))
+        offset += _READ_SIZE
+    return b''.join(data)
+
+
+def _varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return (value, offset)
+
+
+def apply_delta(base, delta):
+    """
+    Rebuild an object from its base and a git delta
+    """
+    _, offset = _varint(delta, 0)
+    size, offset = _varint(delta, offset)
+    result = bytearray()
+    while offset < len(delta):
+        op = delta[offset]
+        offset += 1
+        if op & 0x80:
+            # copy a range of the base, the bits of op tell which offset and size bytes follow
+            copy_offset = copy_size = 0
+            for bit in range(4):
+                if op & (1 << bit):
+                    copy_offset |= delta[offset] << (8 * bit)
+                    offset += 1
+            for bit in range(3):
+                if op & (1 << (4 + bit)):
+                    copy_size |= delta[offset] << (8 * bit)
+                    offset += 1
+            result += base[copy_offset:copy_offset + (copy_size or 0x10000)]
+        elif op:
+            result += delta[offset:offset + op]
+            offset += op
+        else:
+            raise zlib.error('invalid delta opcode')
+
+    if len(result) != size:
+        raise zlib.error('delta produced {0} bytes instead of {1}'.format(len(result), size))
+    return bytes(result)
+
+
+class Pack(object):
+    """
+    A packfile and its version 2 index, both memory mapped
+    """
+
+    def __init__(self, idx_file):
+        self.idx = _map(idx_file)
+        self.pack = _map(idx_file[:-len('.idx')] + '.pack')
+        if self.idx[:4] != _IDX_MAGIC or struct.unpack('>I', self.idx[4:8])[0] != 2:
+            raise GitObjectError(idx_file, 'only version 2 pack indexes are supported')
+
+        self._fanout = struct.unpack('>256I', self.idx[8:8 + 256 * 4])
+        self.count = self._fanout[-1]
+        self._shas = 8 + 256 * 4
+        self._offsets = self._shas + self.count * 24
+        self._large_offsets = self._offsets + self.count * 4
+
+    def _sha(self, index):
+        return self.idx[self._shas + index * 20:self._shas + index * 20 + 20]
+
+    def find(self, binary_sha):
+        """
+        Returns:
+            the offset of the object in the pack, or None when the pack doesn't have it
+        """
+        first = binary_sha[0]
+        low = self._fanout[first - 1] if first else 0
+        high = self._fanout[first]
+        while low < high:
+            middle = (low + high) // 2
+            sha = self._sha(middle)
+            if sha < binary_sha:
+                low = middle + 1
+            elif sha > binary_sha:
+                high = middle
+            else:
+                offset = struct.unpack('>I', self.idx[self._offsets + middle * 4:self._offsets + middle * 4 + 4])[0]
+                if offset & 0x80000000:
+                    position = self._large_offsets + (offset & 0x7fffffff) * 8
+                    offset = struct.unpack('>Q', self.idx[position:position + 8])[0]
+                return offset
+        return None
+
+    def read(self, offset, read_object):
+        """
+        Read the object at an offset, resolving deltas
+
+        Returns:
+            tuple of the object type and its content
+        """
+        start = offset
+        byte = self.pack[offset]
+        kind = (byte >> 4) & 7
+        offset += 1
+        while byte & 0x80:
+            byte = self.pack[offset]
+            offset += 1
+
+        if kind == _OFS_DELTA:
+            byte = self.pack[offset]
+            offset += 1
+            distance = byte & 0x7f
+            while byte & 0x80:
+                byte = self.pack[offset]
+                offset += 1
+                distance = ((distance + 1) << 7) | (byte & 0x7f)
+            base_kind, base = self.read(start - distance, read_object)
+            return (base_kind, apply_delta(base, _inflate(self.pack, offset)))
+
+        if kind == _REF_DELTA:
+            base_kind, base = read_object(binascii.hexlify(self.pack[offset:offset + 20]).decode('ascii'))
+            return (base_kind, apply_delta(base, _inflate(self.pack, offset + 20)))
+
+        return (_OBJECT_TYPES[kind], _inflate(self.pack, offset))
+
+    def close(self):
+        self.idx.close()
+        self.pack.close()
+
+
+class Commit(object):
+    def __init__(self, sha, parents, time):
+        self.sha = sha
+        self.parents = parents
+        self.time = time
+
+
+class Tag(object):
+    def __init__(self, sha, target, target_type, time):
+        self.sha = sha
+        self.target = target
+        self.target_type = target_type
+        self.time = time
+
+
+def _headers(content):
+    headers = []
+    for line in content.split(b'\n'):
+        if not line:
+            break
+        if line.startswith(b' '):
+            continue
+        key, _, value = line.partition(b' ')
+        headers.append((key.decode('ascii'), value.decode('utf-8', 'replace')))
+    return headers
+
+
+def _signature_time(value):
+    # "Name <email> 1500000000 +0200"
+    try:
+        return int(value.rsplit(' ', 2)[-2])
+    except (IndexError, ValueError):
+        return 0
+
+
+class ObjectStore(object):
+    """
+    The objects of a repository: loose objects, packs and the object directories of its alternates
+    """
+
+    def __init__(self, common_dir):
+        self.object_dirs = [os.path.join(common_dir, 'objects')]
+        alternates = os.path.join(common_dir, 'objects', 'info', 'alternates')
+        if os.path.isfile(alternates):
+            with open(alternates, 'r') as fh:
+                self.object_dirs += [os.path.join(self.object_dirs[0], line.strip()) for line in fh
+                                     if line.strip() and not line.startswith('#')]
+
+        self._packs = None
+        self._commits = {}
+        self.shallow = set()
+        shallow_file = os.path.join(common_dir, 'shallow')
+        if os.path.isfile(shallow_file):
+            with open(shallow_file, 'r') as fh:
+                self.shallow = set(line.strip() for line in fh if line.strip())
+
+    @property
+    def packs(self):
+        if self._packs is None:
+            self._packs = [Pack(idx) for object_dir in self.object_dirs
+                           for idx in sorted(glob.glob(os.path.join(object_dir, 'pack', '*.idx')))]
+        return self._packs
+
+    def read(self, sha):
+        """
+        Returns:
+            tuple of the object type ('commit', 'tree', 'blob' or 'tag') and its content
+        """
+        for object_dir in self.object_dirs:
+            loose = os.path.join(object_dir, sha[:2], sha[2:])
+            if os.path.isfile(loose):
+                with open(loose, 'rb') as fh:
+                    data = zlib.decompress(fh.read())
+                header, _, content = data.partition(b'\0')
+                return (header.split(b' ')[0].decode('ascii'), content)
+
+        binary_sha = binascii.unhexlify(sha)
+        for pack in self.packs:
+            offset = pack.find(binary_sha)
+            if offset is not None:
+                return pack.read(offset, self.read)
+
+        raise GitObjectError(sha, 'object not found')
+
+    def commit(self, sha):
+        if sha not in self._commits:
+            kind, content = self.read(sha)
+            if kind != 'commit':
+                raise GitObjectError(sha, 'expected a commit, got a {0}'.format(kind))
+            headers = _headers(content)
+            parents = [] if sha in self.shallow else [value for (key, value) in headers if key == 'parent']
+            time = next((_signature_time(value) for (key, value) in headers if key == 'committer'), 0)
+            self._commits[sha] = Commit(sha, parents, time)
+        return self._commits[sha]
+
+    def tag(self, sha):
+        """
+        Returns:
+            the annotated Tag, or None when sha isn't a tag object (a lightweight tag)
+        """
+        kind, content = self.read(sha)
+        if kind != 'tag':
+            return None
+        headers = dict(_headers(content))
+        return Tag(sha, headers.get('object'), headers.get('type'), _signature_time(headers.get('tagger', '')))
+
+    def peel(self, sha):
+        """
+        Follow a chain of tag objects to the object it ends at
+        """
+        tag = self.tag(sha)
+        while tag is not None and tag.target_type == 'tag':
+            tag = self.tag(tag.target)
+        return tag.target if tag is not None else sha
+
+    def walk(self, head):
+        """
+        Yields the commits reachable from head, newest committer time first
+        """
+        seen = set([head])
+        queue = [(-self.commit(head).time, head)]
+        while queue:
+            _, sha = heapq.heappop(queue)
+            commit = self.commit(sha)
+            yield commit
+            for parent in commit.parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(queue, (-self.commit(parent).time, parent))
+
+    def count_exclusive(self, head, base):
+        """
+        Count the commits reachable from head but not from base, the distance git describe reports.
+        Both histories are walked together newest first, the walk stops once only commits of base are left.
+        """
+        from_head, from_base = 1, 2
+        flags = {head: from_head}
+        flags[base] = flags.get(base, 0) | from_base
+        queue = []
+        queued = set()
+        head_only = 0  # queued commits not known to be reachable from base yet
+        counted = set()
+
+        for sha in set([head, base]):
+            heapq.heappush(queue, (-self.commit(sha).time, sha))
+            queued.add(sha)
+            head_only += flags[sha] == from_head
+
+        while queue and head_only:
+            _, sha = heapq.heappop(queue)
+            queued.discard(sha)
+            flag = flags[sha]
+            if flag == from_head:
+                head_only -= 1
+                counted.add(sha)
+            else:
+                # reached from base after all, possible when committer times are skewed
+                counted.discard(sha)
+
+            for parent in self.commit(sha).parents:
+                previous = flags.get(parent, 0)
+                if previous | flag == previous:
+                    continue
+                flags[parent] = previous | flag
+                if parent in queued:
+                    head_only -= previous == from_head
+                else:
+                    heapq.heappush(queue, (-self.commit(parent).time, parent))
+                    queued.add(parent)
+                head_only += flags[parent] == from_head
+
+        return len(counted)
+
+    def close(self):
+        for pack in self._packs or []:
+            pack.close()
+        self._packs = None
@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import hashlib
+import os
+
+# Reads what HEAD points at and fingerprints the refs straight from the .git directory, without running git.
+
+_SYMREF_PREFIX = 'ref: '
+
+
+class GitDir(object):
+    """
+    The directories of a repository, git_dir holds HEAD and common_dir holds the refs (they differ for worktrees)
+    """
+
+    def __init__(self, git_dir, common_dir):
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+
+
+def _read_text(file):
+    try:
+        with open(file, 'rb') as fh:
+            return fh.read().decode('utf-8').strip()
+    except (IOError, OSError):
+        return None
+
+
+def _git_dir_of(work_dir):
+    git_dir = os.path.join(work_dir, '.git')
+    if os.path.isfile(git_dir):
+        # worktrees and submodules have a .git file pointing to the actual directory
+        content = _read_text(git_dir) or ''
+        if not content.startswith('gitdir: '):
+            return None
+        git_dir = os.path.normpath(os.path.join(work_dir, content[len('gitdir: '):]))
+
+    if not os.path.isfile(os.path.join(git_dir, 'HEAD')):
+        return None
+
+    common_dir = _read_text(os.path.join(git_dir, 'commondir'))
+    common_dir = os.path.normpath(os.path.join(git_dir, common_dir)) if common_dir else git_dir
+    return GitDir(git_dir, common_dir)
+
+
+def find_git_dir(work_dir):
+    """
+    Returns:
+        the GitDir of the repository work_dir is part of, like git it looks in the parent directories
+        so the subprojects of a monorepo find its repository, or None when there isn't one
+    """
+    directory = os.path.abspath(work_dir)
+    while True:
+        git_dir = _git_dir_of(directory)
+        if git_dir is not None or os.path.dirname(directory) == directory:
+            return git_dir
+        directory = os.path.dirname(directory)
+
+
+def read_packed_refs(common_dir):
+    """
+    Returns:
+        dict of ref name to (sha, peeled sha or None) for the refs in packed-refs
+    """
+    refs = {}
+    content = _read_text(os.path.join(common_dir, 'packed-refs'))
+    last = None
+    for line in (content or '').splitlines():
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('^'):
+            # the commit an annotated tag above points to
+            if last is not None:
+                refs[last] = (refs[last][0], line[1:])
+            continue
+        sha, name = line.split(' ', 1)
+        refs[name] = (sha, None)
+        last = name
+    return refs
+
+
+def resolve_ref(git_dir, name, packed_refs=None, depth=0):
+    """
+    Resolve a ref like HEAD or refs/heads/master to a sha
+
+    Returns:
+        the sha, or None for a branch without commits
+    """
+    if depth > 5:
+        return None
+
+    directory = git_dir.git_dir if name == 'HEAD' else git_dir.common_dir
+    content = _read_text(os.path.join(directory, *name.split('/')))
+    if content is not None:
+        if content.startswith(_SYMREF_PREFIX):
+            return resolve_ref(git_dir, content[len(_SYMREF_PREFIX):], packed_refs, depth + 1)
+        return content
+
+    packed_refs = packed_refs if packed_refs is not None else read_packed_refs(git_dir.common_dir)
+    return packed_refs.get(name, (None, None))[0]
+
+
+def list_refs(git_dir, prefix='refs/tags'):
+    """
+    Returns:
+        dict of ref name to sha of the refs under prefix, loose refs win over packed ones like they do for git
+    """
+    refs = dict((name, sha) for (name, (sha, _)) in read_packed_refs(git_dir.common_dir).items()
+                if name.startswith(prefix + '/'))
+    for (root, _, names) in os.walk(os.path.join(git_dir.common_dir, *prefix.split('/'))):
+        for name in names:
+            ref = os.path.relpath(os.path.join(root, name), git_dir.common_dir).replace(os.sep, '/')
+            sha = _read_text(os.path.join(root, name))
+            if sha and not sha.startswith(_SYMREF_PREFIX):
+                refs[ref] = sha
+    return refs
+
+
+def head_sha(git_dir):
+    return resolve_ref(git_dir, 'HEAD')
+
+
+def refs_signature(git_dir, prefix='refs/tags'):
+    """
+    Fingerprint packed-refs and the loose refs under prefix by their stat, it changes whenever one of them does
+
+    Returns:
+        hex digest
+    """
+    digest = hashlib.sha1()
+    files = [os.path.join(git_dir.common_dir, 'packed-refs')]
+    for (root, dirs, names) in os.walk(os.path.join(git_dir.common_dir, *prefix.split('/'))):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names))
+
+    for file in files:
+        try:
+            stat = os.stat(file)
+            digest.update('{0}|{1}|{2}\n'.format(file, stat.st_mtime_ns, stat.st_size).encode('utf-8'))
+        except OSError:
+            digest.update('{0}|missing\n'.format(file).encode('utf-8'))
+
+    return digest.hexdigest()
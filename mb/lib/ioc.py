@@ -1,19 +1,24 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import glob
-import imp
-import inspect
+import functools
 import os
-import sys
+import threading
 
 from mb.config.config import get_default_config_file
+from mb.config.errors import ConfigurationError
+from mb.lib import fingerprint
 from mb.lib import logger
 from mb.lib import process
+from mb.lib.container import Container
+from mb.lib.plugin_index import find_plugins
+from mb.lib.plugin_index import is_plugin_type
+from mb.lib.plugin_index import PluginIndex
 
 _log = logger.get_logger('[Ioc]')
 
 # plugin types
+from mb import artifact_cache # ArtifactCache # NOQA
 from mb import build_context # BuildContext # NOQA
 from mb import command # Command # NOQA
 from mb import template_engine # TemplateEngine # NOQA
@@ -27,101 +32,142 @@ def rchop(thestring, ending):
     return thestring
 
 
-def _is_plugin_type(object_attr, plugin_type):
-    try:
-        if object_attr == plugin_type:
-            return False
-
-        return issubclass(object_attr, plugin_type)
-    except:
-        return False
-
-
-_plugin_modules = [build_context, command, template_engine, version_scheme]
-_plugin_types = [build_context.BuildContext, command.Command, template_engine.TemplateEngine, version_scheme.VersionScheme]
-_loaded_plugin_definitions = {}
-_plugin_instances = {}
-_config = get_default_config_file()
-
-if os.path.isdir(_config.plugin_dir):
-    os.chdir(_config.plugin_dir)
-    for file in glob.glob("*.py"):
-        plugin_module_name_template = "silverbp_mb_plugin_" + os.path.splitext(file)[0] + "_%d"
-        for plugin_name_suffix in range(len(sys.modules)):
-            plugin_module_name = plugin_module_name_template % plugin_name_suffix
-            if plugin_module_name not in sys.modules:
-                break
-        with open(file, "r") as plugin_file:
-            _plugin_modules.append(imp.load_module(plugin_module_name, plugin_file, file, ("py", "r", imp.PY_SOURCE)))
+_plugin_modules = [artifact_cache, build_context, command, template_engine, version_scheme]
+_plugin_types = [artifact_cache.ArtifactCache, build_context.BuildContext, command.Command, template_engine.TemplateEngine,
+                 version_scheme.VersionScheme]
+_builtin_plugin_definitions = {}
+_plugin_sets = {}
+_plugin_sets_lock = threading.Lock()
+_default_project = None
+_default_project_lock = threading.Lock()
 
 for module in _plugin_modules:
-    for module_attr in (getattr(module, name) for name in dir(module)):
-        for plugin_type in _plugin_types:
-            if not _is_plugin_type(module_attr, plugin_type):
-                continue
-
-            _loaded_plugin_definitions[module_attr.__name__] = module_attr
-
-_defined_commands = _config.commands
-_defined_commands['_prerun'] = PluginConfig('MBPreRunCommand', {}, _config)
-
-command_plugins = [k for (k, v) in _loaded_plugin_definitions.items() if _is_plugin_type(v, command.Command)]
-
-for (k, v) in _config.commands.items():
-    if v.name not in command_plugins:
-        _log.warn('The following Command: {0} was not found and will not be available'.format(k))
-        del _defined_commands[k]
-
-_log.debug('The following commands will be available: {0}'.format([k for (k, v) in _defined_commands.items() if not k.startswith('_')]))
-
-
-def _load_plugin(plugin):
-    if plugin.name in _plugin_instances.keys():
-        return _plugin_instances[plugin.name]
-
-    plugin_definition = _loaded_plugin_definitions[plugin.name]
-    arguments = []
-
-    # if the plugin doesn't have a constructor, there's nothing to inject
-    if '__init__' in getattr(plugin_definition, '__dict__', None).keys():
-        for arg in inspect.getargspec(plugin_definition.__init__)[0][1:]:
-            arguments.append(load_dependency(arg))
-
-    instance = plugin_definition(*arguments)
-    available_properties = [x for x, y in inspect.getmembers(instance.__class__, lambda x: isinstance(x, property))]
-
-    for (key, value) in plugin.config.items():
-        if key in available_properties:
-            try:
-                setattr(instance, key, value)
-            except Exception as err:
-                _log.warn('There was a problem setting the plugin config: \'{0}\' on \'{1}\' with \'{2}\'.'.format(plugin.name, key, value))
-                _log.debug('Exception occured while trying to set a plugin config value: {0}'.format(err))
-        else:
-            _log.warn('The following plugin config: {0}, is not an option to set on {1}'.format(key, plugin.name))
-
-    _plugin_instances[plugin.name] = instance
-    return instance
+    _builtin_plugin_definitions.update(find_plugins(module, _plugin_types))
+
+
+class PluginSet(object):
+    """
+    The plugins of a plugin dir, indexed and imported once per process however many projects use them
+    """
+
+    def __init__(self, plugin_dir, index_file):
+        self.index = PluginIndex(plugin_dir, index_file, _plugin_types)
+        self._loaded_files = set()
+        self._definitions = {}
+        self._lock = threading.Lock()
+        if os.path.isdir(plugin_dir):
+            self.index.refresh()
+
+    def definition(self, name):
+        """
+        Returns:
+            the class of a plugin of the plugin dir, or None when it doesn't define one with that name
+        """
+        plugin_file = self.index.plugins.get(name)
+        if not plugin_file:
+            return None
+
+        # plugin files are only imported once one of their plugins is needed
+        with self._lock:
+            if plugin_file not in self._loaded_files:
+                self._definitions.update(find_plugins(self.index.load_module(plugin_file), _plugin_types))
+                self._loaded_files.add(plugin_file)
+        return self._definitions[name]
+
+
+def get_plugin_set(config):
+    plugin_dir = os.path.abspath(config.plugin_dir)
+    with _plugin_sets_lock:
+        if plugin_dir not in _plugin_sets:
+            _plugin_sets[plugin_dir] = PluginSet(plugin_dir, os.path.join(config.artifact_dir, 'cache', 'plugin_index.json'))
+        return _plugin_sets[plugin_dir]
+
+
+class Project(object):
+    """
+    The commands and plugins of a project config, each project has its own container
+    while projects with the same plugin dir share its PluginSet.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.plugins = get_plugin_set(config)
+
+        self._defined_commands = config.commands
+        if '_prerun' not in self._defined_commands:
+            self._defined_commands['_prerun'] = PluginConfig('MBPreRunCommand', {}, config.config)
+
+        command_plugins = [k for (k, v) in _builtin_plugin_definitions.items() if is_plugin_type(v, command.Command)]
+        command_plugins += self.plugins.index.plugins_of_type(command.Command)
+
+        for (k, v) in list(self._defined_commands.items()):
+            if v.name not in command_plugins:
+                _log.warn('The following Command: {0} was not found and will not be available'.format(k))
+                del self._defined_commands[k]
+
+        _log.debug('The following commands will be available: {0}'.format(self.get_commands()))
+
+        self.container = Container(self.get_plugin_definition)
+        self.container.register_instance('config', config)
+        self.container.register_instance('process', process)
+        # one stat cache for the whole run
+        self.container.register('fingerprints', lambda: fingerprint.for_config(config))
+        for name in ('artifact_cache', 'build_context', 'template_engine', 'version_scheme'):
+            self.container.register(name, functools.partial(getattr, config, name))
+
+    def get_plugin_definition(self, name):
+        return self.plugins.definition(name) or _builtin_plugin_definitions[name]
+
+    def load_dependency(self, name):
+        return self.container.resolve(name)
+
+    def preload_plugins(self):
+        """
+        Import every plugin file up front, used by long running processes like the daemon
+        """
+        for name in self.plugins.index.plugins:
+            self.get_plugin_definition(name)
+
+    def get_commands(self):
+        return [k for (k, v) in self._defined_commands.items() if not k.startswith('_')]
+
+    def get_command_config(self, name):
+        if name not in self._defined_commands.keys():
+            raise ConfigurationError('The following command: {0} is not available'.format(name))
+
+        return self._defined_commands[name]
+
+    def load_command(self, name):
+        return self.container.command(name, self.get_command_config(name))
+
+
+def project():
+    """
+    Returns:
+        the Project of the config found from the working directory, loaded on first use
+    """
+    global _default_project
+    with _default_project_lock:
+        if _default_project is None:
+            _default_project = Project(get_default_config_file())
+        return _default_project
 
 
 def load_dependency(name):
-    if name == 'config':
-        return _config
+    return project().load_dependency(name)
 
-    if name == 'process':
-        return process
 
-    return _load_plugin(getattr(_config, name))
+def preload_plugins():
+    project().preload_plugins()
 
 
 def get_commands():
-    return [k for (k, v) in _defined_commands.items() if not k.startswith('_')]
+    return project().get_commands()
 
 
-def load_command(name):
-    if name in _defined_commands.keys():
-        plugin = _defined_commands[name]
-    else:
-        raise StandardError('The following command: {0} is not available'.format(name))
+def get_command_config(name):
+    return project().get_command_config(name)
 
-    return _load_plugin(plugin)
+
+def load_command(name):
+    return project().load_command(name)
@@ -11,6 +11,9 @@ __m['log_level'] = logging.INFO
 
 def set_log_level(level):
     __m['log_level'] = getattr(logging, level, logging.INFO)
+    for (name, logger) in __m.items():
+        if name != 'log_level':
+            logger.setLevel(__m['log_level'])
 
 
 def printinfo():
@@ -1,27 +1,99 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import functools
 import inspect
+import os
+import threading
+import time
+from collections import namedtuple
+from collections import OrderedDict
 
-_cache = {}
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
 
+_getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
+
+def _file_stat(filename):
+    try:
+        stat = os.stat(filename)
+        return (stat.st_mtime_ns, stat.st_size)
+    except (OSError, TypeError):
+        return None
+
+
+def memoize(*args, **options):
+    """
+    Cache the results of a function
+
+    Can be used as @memoize, or as @memoize("arg", ...) to only use the named arguments for the cache key.
+
+    Options:
+        maxsize: the number of results to keep, the least recently used result is dropped first (unbounded by default)
+        ttl: the number of seconds a result stays valid
+        file_args: names of the arguments holding file paths, a result is dropped when one of those files changes
+
+    The decorated function gets cache_clear() and cache_info() like functools.lru_cache.
+    """
+    maxsize = options.get('maxsize')
+    ttl = options.get('ttl')
+    file_args = options.get('file_args', ())
 
-def memoize(*args, **kw):
     def _memoize(func):
+        # argument positions are resolved once, not on every call
+        arg_names = _getargspec(func)[0]
+        key_args = [(ind, arg) for ind, arg in enumerate(arg_names) if arg in restrict_args]
+        stat_args = [(arg_names.index(arg), arg) for arg in file_args]
+        cache = OrderedDict()
+        stats = {'hits': 0, 'misses': 0}
+        lock = threading.RLock()
+
+        def _arg_value(args, kw, ind, name):
+            return args[ind] if ind < len(args) else kw.get(name)
+
+        @functools.wraps(func)
         def wrapper(*args, **kw):
             if len(restrict_args) > 0:
-                position_args = [ind for ind, arg in enumerate(inspect.getargspec(func)[0])
-                                 if arg in restrict_args]
-                hashed_args = tuple(args[i] for i in position_args)
+                hashed_args = tuple(_arg_value(args, kw, ind, name) for ind, name in key_args)
             else:
                 hashed_args = args
 
-            key = (func, hashed_args, frozenset(kw.items()))
-            try:
-                res = _cache[key]
-            except KeyError:
-                res = _cache[key] = func(*args, **kw)
+            key = (hashed_args, frozenset(kw.items()))
+            file_stats = tuple(_file_stat(_arg_value(args, kw, ind, name)) for ind, name in stat_args)
+
+            with lock:
+                entry = cache.get(key)
+                if entry is not None and (entry[1] != file_stats or (ttl is not None and time.time() - entry[2] > ttl)):
+                    del cache[key]
+                    entry = None
+
+                if entry is not None:
+                    stats['hits'] += 1
+                    cache.move_to_end(key)
+                    return entry[0]
+
+                stats['misses'] += 1
+
+            res = func(*args, **kw)
+
+            with lock:
+                cache[key] = (res, file_stats, time.time())
+                cache.move_to_end(key)
+                while maxsize is not None and len(cache) > maxsize:
+                    cache.popitem(last=False)
             return res
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                stats.update({'hits': 0, 'misses': 0})
+
+        def cache_info():
+            with lock:
+                return CacheInfo(stats['hits'], stats['misses'], maxsize, len(cache))
+
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_info = cache_info
         return wrapper
 
     if len(args) == 1 and callable(args[0]):
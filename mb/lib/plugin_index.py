@@ -0,0 +1,157 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+
+from mb.lib import logger
+from mb.lib import trace
+
+_log = logger.get_logger('[PluginIndex]')
+
+_INDEX_VERSION = 2
+
+
+def _file_hash(filename):
+    with open(filename, 'rb') as plugin_file:
+        return hashlib.sha1(plugin_file.read()).hexdigest()
+
+
+def is_plugin_type(object_attr, plugin_type):
+    try:
+        if object_attr == plugin_type:
+            return False
+
+        return issubclass(object_attr, plugin_type)
+    except Exception:
+        return False
+
+
+def find_plugins(module, plugin_types):
+    """
+    Find the plugin classes defined by a module, the ones it imports belong to the module that defines them
+
+    Returns:
+        a dictionary of plugin class name to the plugin class
+    """
+    plugins = {}
+    for module_attr in (getattr(module, name) for name in dir(module)):
+        if getattr(module_attr, '__module__', None) != module.__name__:
+            continue
+        for plugin_type in plugin_types:
+            if is_plugin_type(module_attr, plugin_type):
+                plugins[module_attr.__name__] = module_attr
+
+    return plugins
+
+
+class PluginIndex(object):
+    """
+    Index of the plugin classes defined by each file in the plugin directory.
+    The index is persisted to disk and a plugin file is only imported when it changed
+    since the index was written or when one of its plugins is actually needed.
+    """
+
+    def __init__(self, plugin_dir, index_file, plugin_types):
+        self.plugin_dir = plugin_dir
+        self.index_file = index_file
+        self.plugin_types = plugin_types
+        self.files = {}
+        self.modules = {}
+
+    def _read(self):
+        if not os.path.isfile(self.index_file):
+            return {}
+
+        try:
+            with open(self.index_file, 'r') as index:
+                data = json.load(index)
+        except ValueError:
+            _log.debug('Plugin index is corrupt, rebuilding it')
+            return {}
+
+        if data.get('version') != _INDEX_VERSION or data.get('plugin_dir') != self.plugin_dir:
+            return {}
+
+        return data.get('files', {})
+
+    def _write(self):
+        if not os.path.isdir(os.path.dirname(self.index_file)):
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+
+        temp_file = '{0}.{1}.tmp'.format(self.index_file, os.getpid())
+        with open(temp_file, 'w') as index:
+            json.dump({'version': _INDEX_VERSION, 'plugin_dir': self.plugin_dir, 'files': self.files}, index)
+        os.replace(temp_file, self.index_file)
+
+    def _index_file(self, file):
+        plugins = find_plugins(self.load_module(file), self.plugin_types)
+        return {name: [plugin_type.__name__ for plugin_type in self.plugin_types if is_plugin_type(plugin, plugin_type)]
+                for name, plugin in plugins.items()}
+
+    @trace.traced('discover plugins', 'plugins')
+    def refresh(self):
+        """
+        Bring the index up to date with the plugin directory, only new or changed files are imported
+        """
+        previous = self._read()
+        self.files = {}
+
+        for path in sorted(glob.glob(os.path.join(self.plugin_dir, '*.py'))):
+            file = os.path.basename(path)
+            stat = os.stat(path)
+            entry = previous.get(file)
+
+            if entry and (entry['mtime'], entry['size']) == (stat.st_mtime_ns, stat.st_size):
+                self.files[file] = entry
+                continue
+
+            file_hash = _file_hash(path)
+            if not entry or entry['hash'] != file_hash:
+                _log.debug('Indexing plugin file: {0}'.format(file))
+                entry = {'hash': file_hash, 'plugins': self._index_file(file)}
+            entry.update({'mtime': stat.st_mtime_ns, 'size': stat.st_size})
+            self.files[file] = entry
+
+        if self.files != previous:
+            self._write()
+
+    @property
+    def plugins(self):
+        """
+        Returns:
+            a dictionary of plugin class name to the file that defines it
+        """
+        return {name: file for file in sorted(self.files) for name in self.files[file]['plugins']}
+
+    def plugins_of_type(self, plugin_type):
+        return [name for file in sorted(self.files) for (name, types) in self.files[file]['plugins'].items()
+                if plugin_type.__name__ in types]
+
+    def load_module(self, file):
+        if file in self.modules:
+            return self.modules[file]
+
+        plugin_module_name_template = "silverbp_mb_plugin_" + os.path.splitext(file)[0] + "_%d"
+        for plugin_name_suffix in range(len(sys.modules)):
+            plugin_module_name = plugin_module_name_template % plugin_name_suffix
+            if plugin_module_name not in sys.modules:
+                break
+
+        path = os.path.join(self.plugin_dir, file)
+        with trace.span('import plugin', 'plugins', file=file):
+            spec = importlib.util.spec_from_file_location(plugin_module_name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[plugin_module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except Exception:
+                del sys.modules[plugin_module_name]
+                raise
+            self.modules[file] = module
+
+        return self.modules[file]
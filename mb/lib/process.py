@@ -1,12 +1,28 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import asyncio
+import os
+import signal
 import subprocess
+import sys
+import threading
+from collections import deque
 
 from mb.lib import logger
+from mb.lib import trace
 
 _log = logger.get_logger('[Process]')
 
+# seconds a timed out command gets to exit after SIGTERM before it is killed
+_KILL_GRACE_PERIOD = 5
+_CHUNK_SIZE = 64 * 1024
+_TAIL_SIZE = 64 * 1024
+
+# limits the commands run through execute_async at the same time, across every thread and event loop
+_slots = threading.Semaphore(os.cpu_count() or 1)
+_output_lock = threading.Lock()
+
 
 class Error(Exception):
     def __init__(self, command, exitCode, output=''):
@@ -18,12 +34,211 @@ class Error(Exception):
         return repr(self.exitCode)
 
 
-def execute(command, cwd, return_output=True, throw_on_failure=True, expected_exit_code=0):
+class Timeout(Error):
+    def __init__(self, command, timeout, output=''):
+        super(Timeout, self).__init__(command, None, output)
+        self.timeout = timeout
+
+    def __str__(self):
+        return 'Command timed out after {0}s: {1}'.format(self.timeout, self.command)
+
+
+def _group_options(own_group):
+    # a process group of its own lets a timeout kill everything the command started,
+    # commands without one keep the terminal (and get its Ctrl-C) like before
+    if own_group and os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    elif own_group:
+        return {'start_new_session': True}
+    return {}
+
+
+def _popen(command, cwd, own_group=True, **kw):
+    kw.update(_group_options(own_group))
+    return subprocess.Popen(command, cwd=cwd, shell=True, **kw)
+
+
+def kill_process_group(process, grace_period=_KILL_GRACE_PERIOD):
+    """
+    Stop a process started by this module and all of its children, politely first
+    """
+    if process.poll() is not None:
+        return
+
+    try:
+        if os.name == 'nt':
+            process.kill()
+            return
+
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(grace_period)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError as err:
+        _log.debug('Unable to kill {0}: {1}'.format(process.pid, err))
+
+
+class _Deadline(object):
+    """
+    Kills the process group of a process when it runs for longer than the timeout
+    """
+
+    def __init__(self, process, timeout):
+        self.expired = False
+        self._timer = None
+        if timeout:
+            self._timer = threading.Timer(timeout, self._expire, [process])
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self, process):
+        self.expired = True
+        kill_process_group(process)
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+class _Tail(object):
+    """
+    Keeps the last size bytes of output
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._pieces = deque()
+        self._length = 0
+
+    def append(self, piece):
+        self._pieces.append(piece)
+        self._length += len(piece)
+        while len(self._pieces) > 1 and self._length - len(self._pieces[0]) >= self.size:
+            self._length -= len(self._pieces.popleft())
+
+    def text(self):
+        return b''.join(self._pieces)[-self.size:].decode('utf-8', 'replace')
+
+
+class StreamedProcess(object):
+    """
+    Runs a command and hands out its combined stdout and stderr while it is produced, instead of once it exited.
+    Only the tail of the output is kept in memory, the complete output can be teed to a log file.
+
+    Iterating yields the output line by line (or in chunks of at most chunk_size bytes with lines=False),
+    exit_code and tail are available once the iteration finished.
+    """
+
+    def __init__(self, command, cwd, log_file=None, timeout=None, lines=True,
+                 chunk_size=_CHUNK_SIZE, tail_size=_TAIL_SIZE):
+        self.command = command
+        self.cwd = cwd
+        self.log_file = log_file
+        self.timeout = timeout
+        self.lines = lines
+        self.chunk_size = chunk_size
+        self.tail_size = tail_size
+        self.exit_code = None
+        self.timed_out = False
+        self._tail = _Tail(tail_size)
+
+    @property
+    def tail(self):
+        """
+        The last tail_size bytes of output, decoded
+        """
+        return self._tail.text()
+
+    def _pieces(self, stdout):
+        if self.lines:
+            # a line longer than chunk_size comes in several pieces so memory stays bounded
+            return iter(lambda: stdout.readline(self.chunk_size), b'')
+        return iter(lambda: stdout.read1(self.chunk_size), b'')
+
+    def __iter__(self):
+        _log.debug(self.command)
+        log = None
+        if self.log_file:
+            if not os.path.isdir(os.path.dirname(os.path.abspath(self.log_file))):
+                os.makedirs(os.path.dirname(os.path.abspath(self.log_file)), exist_ok=True)
+            log = open(self.log_file, 'wb')
+
+        process = _popen(self.command, self.cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        deadline = _Deadline(process, self.timeout)
+        try:
+            for piece in self._pieces(process.stdout):
+                if log is not None:
+                    log.write(piece)
+                self._tail.append(piece)
+                yield piece
+        finally:
+            # stopping the iteration early stops the command too
+            if process.poll() is None and not deadline.expired:
+                kill_process_group(process)
+            process.stdout.close()
+            self.exit_code = process.wait()
+            deadline.cancel()
+            self.timed_out = deadline.expired
+            if log is not None:
+                log.close()
+
+        _log.debug('Exit Code: {0}'.format(self.exit_code))
+
+
+def stream(command, cwd, on_output=None, log_file=None, timeout=None, throw_on_failure=True, expected_exit_code=0,
+           lines=True):
+    """
+    Run a command, handing its output to on_output as it is produced
+
+    Args:
+        command: the shell command to run
+        cwd: the directory to run it in
+        on_output: callable receiving each line (or chunk with lines=False) of output as bytes
+        log_file: file receiving the complete output
+        timeout: number of seconds after which the command and its children are killed
+        throw_on_failure: raise an Error with the tail of the output when the exit code isn't the expected one
+        expected_exit_code: the exit code of a successful run
+        lines: hand the output out line by line rather than as it is read
+
+    Returns:
+        the exit code of the command
+    """
+    process = StreamedProcess(command, cwd, log_file, timeout, lines)
+    pieces = iter(process)
+    try:
+        with trace.span('subprocess', 'process', command=command):
+            for piece in pieces:
+                if on_output is not None:
+                    on_output(piece)
+    finally:
+        # kills the command right away when on_output or a Ctrl-C interrupted the iteration
+        pieces.close()
+
+    if process.timed_out:
+        raise Timeout(command, timeout, process.tail)
+
+    if process.exit_code != expected_exit_code and throw_on_failure:
+        raise Error(command, process.exit_code, process.tail)
+
+    return process.exit_code
+
+
+def execute(command, cwd, return_output=True, throw_on_failure=True, expected_exit_code=0, timeout=None):
+    with trace.span('subprocess', 'process', command=command):
+        return _execute(command, cwd, return_output, throw_on_failure, expected_exit_code, timeout)
+
+
+def _execute(command, cwd, return_output, throw_on_failure, expected_exit_code, timeout):
     _log.debug(command)
     if (return_output):
-        process = subprocess.Popen(command, cwd=cwd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        process = _popen(command, cwd, bool(timeout), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        deadline = _Deadline(process, timeout)
         output, err = process.communicate()
+        deadline.cancel()
         exit_code = process.returncode
+        if deadline.expired:
+            raise Timeout(command, timeout, output)
         if not output.rstrip() and len(output.rstrip()) > 0:
             _log.debug(output)
         if exit_code != expected_exit_code and throw_on_failure:
@@ -36,10 +251,178 @@ def execute(command, cwd, return_output=True, throw_on_failure=True, expected_ex
             else:
                 return (output, exit_code)
     else:
-        process = subprocess.Popen(command, cwd=cwd, shell=True)
+        process = _popen(command, cwd, bool(timeout))
+        deadline = _Deadline(process, timeout)
         process.communicate()
+        deadline.cancel()
         exit_code = process.returncode
+        if deadline.expired:
+            raise Timeout(command, timeout)
         if exit_code != expected_exit_code and throw_on_failure:
             raise Error(command, exit_code)
         else:
             return exit_code
+
+
+def set_concurrency(jobs):
+    """
+    Set how many commands execute_async runs at the same time, to be called before commands are started
+    """
+    global _slots
+    _slots = threading.Semaphore(max(1, jobs))
+
+
+def _write_output(piece):
+    with _output_lock:
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        stdout.write(piece)
+        stdout.flush()
+
+
+async def _acquire(slots):
+    if slots.acquire(False):
+        return
+
+    acquiring = asyncio.get_event_loop().run_in_executor(None, slots.acquire)
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # the slot is still acquired by the executor thread eventually, give it back
+        acquiring.add_done_callback(lambda _: slots.release())
+        raise
+
+
+async def _kill_process_group_async(process, grace_period=_KILL_GRACE_PERIOD):
+    if process.returncode is not None:
+        return
+
+    try:
+        if os.name == 'nt':
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), grace_period)
+            except asyncio.TimeoutError:
+                os.killpg(process.pid, signal.SIGKILL)
+    except OSError as err:
+        _log.debug('Unable to kill {0}: {1}'.format(process.pid, err))
+
+    await process.wait()
+
+
+async def _read_lines(stream, chunk_size, on_line):
+    """
+    Call on_line with every complete line, or chunk_size pieces of a line longer than that
+    """
+    pending = b''
+    while True:
+        chunk = await stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            on_line(line + b'\n')
+        while len(pending) >= chunk_size:
+            on_line(pending[:chunk_size])
+            pending = pending[chunk_size:]
+
+    if pending:
+        on_line(pending)
+
+
+async def execute_async(command, cwd, prefix=None, on_output=None, throw_on_failure=True, expected_exit_code=0,
+                        timeout=None):
+    """
+    Run a command from an event loop, as many of them run at once as set_concurrency allows
+
+    Args:
+        command: the shell command to run
+        cwd: the directory to run it in
+        prefix: text put in front of every line of output, to tell commands running together apart
+        on_output: callable receiving each prefixed line as bytes, the lines go to stdout by default
+        throw_on_failure: raise an Error with the tail of the output when the exit code isn't the expected one
+        expected_exit_code: the exit code of a successful run
+        timeout: number of seconds after which the command and its children are killed
+
+    Returns:
+        the exit code of the command
+
+    Cancelling the task kills the command and everything it started.
+    """
+    on_output = on_output or _write_output
+    prefix = '[{0}] '.format(prefix).encode('utf-8') if prefix else b''
+    tail = _Tail(_TAIL_SIZE)
+
+    slots = _slots
+    await _acquire(slots)
+    try:
+        _log.debug(command)
+        process = await asyncio.create_subprocess_shell(command, cwd=cwd, stdout=subprocess.PIPE,
+                                                        stderr=subprocess.STDOUT, **_group_options(True))
+
+        def output(line):
+            tail.append(line)
+            on_output(prefix + line)
+
+        async def communicate():
+            await _read_lines(process.stdout, _CHUNK_SIZE, output)
+            return await process.wait()
+
+        try:
+            with trace.span('subprocess', 'process', thread_id=process.pid, command=command):
+                exit_code = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            await _kill_process_group_async(process)
+            raise Timeout(command, timeout, tail.text())
+        except BaseException:
+            await _kill_process_group_async(process)
+            raise
+    finally:
+        slots.release()
+
+    _log.debug('Exit Code: {0}'.format(exit_code))
+    if exit_code != expected_exit_code and throw_on_failure:
+        raise Error(command, exit_code, tail.text())
+
+    return exit_code
+
+
+async def execute_all_async(commands, cwd, **kw):
+    """
+    Run commands concurrently, when one of them fails the others are cancelled
+
+    Args:
+        commands: list of (prefix, command) tuples
+        cwd: the directory to run them in
+        kw: the options of execute_async
+
+    Returns:
+        the exit codes of the commands, in order
+    """
+    tasks = [asyncio.ensure_future(execute_async(command, cwd, prefix, **kw)) for (prefix, command) in commands]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def execute_all(commands, cwd, **kw):
+    """
+    Blocking version of execute_all_async, for commands that aren't running in an event loop
+    """
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(execute_all_async(commands, cwd, **kw))
+    try:
+        return loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        # the commands have process groups of their own, they don't get the Ctrl-C
+        task.cancel()
+        loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        raise
+    finally:
+        loop.close()
@@ -0,0 +1,161 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import threading
+
+from mb.artifact_cache import ArtifactError
+from mb.artifact_cache import FileSystemArtifactCache
+from mb.artifact_cache import output_files
+from mb.artifact_cache import pack
+from mb.artifact_cache import unpack
+from mb.lib import fingerprint
+from mb.lib import logger
+from mb.lib import trace
+
+_log = logger.get_logger('[ResultCache]')
+
+_written_variables_lock = threading.Lock()
+
+
+class ResultCache(object):
+    """
+    Content addressed cache of command results.
+    A command opts in with `cache: true` and lists the files it depends on in `inputs`,
+    when none of its inputs changed the recorded output and exit code are replayed instead of running it,
+    and the files matching its `outputs` are restored. Results are stored in the configured ArtifactCache.
+    """
+
+    def __init__(self, config, build_context, artifact_cache=None, fingerprints=None):
+        self.project_dir = config.project_dir
+        self.temp_dir = os.path.join(config.artifact_dir, 'cache', 'tmp')
+        self.written_variables_file = os.path.join(config.artifact_dir, 'cache', 'written_variables.json')
+        self._build_context = build_context
+        self._artifact_cache = artifact_cache or FileSystemArtifactCache(config)
+        self._fingerprints = fingerprints or fingerprint.for_config(config)
+
+    def key(self, name, command, plugin_config, arguments, variables=None):
+        """
+        Compute the cache key of a command
+
+        Args:
+            name: name of the command in the config file
+            command: the loaded command instance
+            plugin_config: the PluginConfig of the command
+            arguments: the arguments the command is run with
+            variables: the build context variables to use instead of the current ones
+
+        Returns:
+            hex digest identifying the command and all of its inputs
+        """
+        key_data = {
+            'name': name,
+            'plugin': plugin_config.name,
+            'config': plugin_config.config,
+            'command': getattr(command, 'command', None),
+            'state': command.cache_state,
+            'arguments': list(arguments),
+            'variables': self._read_variables(name, variables),
+            'inputs': self._fingerprints.hashes(command.inputs),
+            'outputs': list(command.outputs or []),
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _written_variables(self):
+        try:
+            with open(self.written_variables_file, 'r') as written_file:
+                return json.load(written_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _read_variables(self, name, variables=None):
+        # the variables a command writes itself, like the version of _prerun, would change its key on every run
+        written = set(self._written_variables().get(name, []))
+        variables = self._build_context.variables if variables is None else variables
+        return dict((key, value) for (key, value) in variables.items() if key not in written)
+
+    def _record_written_variables(self, name, before):
+        after = self._build_context.variables
+        changed = set(key for (key, value) in after.items() if key not in before or before[key] != value)
+        with _written_variables_lock:
+            written_variables = self._written_variables()
+            if changed <= set(written_variables.get(name, [])):
+                return False
+
+            written_variables[name] = sorted(changed.union(written_variables.get(name, [])))
+            if not os.path.isdir(os.path.dirname(self.written_variables_file)):
+                os.makedirs(os.path.dirname(self.written_variables_file), exist_ok=True)
+            temp_file = '{0}.{1}.tmp'.format(self.written_variables_file, os.getpid())
+            with open(temp_file, 'w') as written_file:
+                json.dump(written_variables, written_file)
+            os.replace(temp_file, self.written_variables_file)
+            return True
+
+    def get(self, key):
+        """
+        Returns:
+            the recorded result of the key with its output files restored, or None when it isn't cached
+        """
+        artifact = self._artifact_cache.get(key)
+        if artifact is None:
+            return None
+
+        try:
+            with trace.span('restore artifact', 'cache'), artifact:
+                return unpack(artifact, self.project_dir)
+        except ArtifactError as err:
+            _log.warn('Ignoring cached result {0}: {1}'.format(key, err))
+            return None
+
+    def put(self, key, record, outputs=()):
+        """
+        Store a result with the output files, paths relative to the project directory
+        """
+        if not os.path.isdir(self.temp_dir):
+            os.makedirs(self.temp_dir, exist_ok=True)
+
+        archive_file = os.path.join(self.temp_dir, '{0}.{1}.tar.gz'.format(key, os.getpid()))
+        try:
+            with trace.span('store artifact', 'cache', outputs=len(outputs)):
+                pack(archive_file, self.project_dir, record, outputs)
+                self._artifact_cache.put(key, archive_file)
+        finally:
+            if os.path.exists(archive_file):
+                os.remove(archive_file)
+
+    def run(self, name, command, plugin_config, arguments):
+        """
+        Run a command, or replay its recorded result if its inputs did not change
+        """
+        if command.cache_state is None:
+            command.log.debug('Not caching the result, the state the command depends on is unknown')
+            return command.run(arguments)
+
+        key = self.key(name, command, plugin_config, arguments)
+        record = self.get(key)
+        if record is not None:
+            command.log.info('Inputs unchanged, replaying cached result')
+            return command.replay(record)
+
+        command.capture_output = True
+        variables = dict(self._build_context.variables)
+        return_value = command.run(arguments)
+        if self._record_written_variables(name, variables):
+            # the key the next run looks up no longer has the variables the command just wrote
+            key = self.key(name, command, plugin_config, arguments, variables)
+
+        record = {
+            'output': command.output,
+            'exit_code': command.exit_code,
+            'return_value': return_value,
+        }
+        try:
+            json.dumps(record)
+        except (TypeError, ValueError) as err:
+            command.log.warn('Not caching the result, the return value of the command can\'t be stored: {0}'.format(err))
+            return return_value
+
+        self.put(key, record, output_files(self.project_dir, command.outputs))
+        return return_value
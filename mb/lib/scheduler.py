@@ -0,0 +1,234 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+from collections import OrderedDict
+from concurrent import futures
+
+from mb.lib import logger
+from mb.lib import trace
+
+_log = logger.get_logger('[Scheduler]')
+
+
+class CycleError(Exception):
+    def __init__(self, cycle):
+        self.cycle = cycle
+
+    def __str__(self):
+        return 'Command dependency cycle detected: {0}'.format(' -> '.join(self.cycle))
+
+
+class Graph(object):
+    """
+    Dependency graph of commands, nodes are kept in the order they were added
+    """
+
+    def __init__(self):
+        self._dependencies = OrderedDict()
+
+    @property
+    def nodes(self):
+        return list(self._dependencies.keys())
+
+    def add(self, name, dependencies):
+        self._dependencies[name] = [dep for dep in dependencies if dep != name]
+
+    def dependencies(self, name):
+        return self._dependencies[name]
+
+    def dependents(self, name):
+        return [node for node, deps in self._dependencies.items() if name in deps]
+
+    def all_dependents(self, names):
+        """
+        Returns:
+            the set of the given commands and every command that depends on them, directly or not
+        """
+        found = set()
+        queue = list(names)
+        while queue:
+            name = queue.pop()
+            if name not in found:
+                found.add(name)
+                queue.extend(self.dependents(name))
+        return found
+
+    def subgraph(self, names):
+        """
+        Returns:
+            a Graph of only the given commands, dependencies outside of it are considered done
+        """
+        graph = Graph()
+        for (name, deps) in self._dependencies.items():
+            if name in names:
+                graph.add(name, [dep for dep in deps if dep in names])
+        return graph
+
+    def find_cycle(self):
+        """
+        Find a dependency cycle in the graph
+
+        Returns:
+            the list of command names forming the cycle (first and last are the same) or None
+        """
+        visiting, visited = set(), set()
+
+        for root in self._dependencies:
+            if root in visited:
+                continue
+
+            path = [root]
+            stack = [iter(self._dependencies.get(root, []))]
+            visiting.add(root)
+            while stack:
+                dep = next(stack[-1], None)
+                if dep is None:
+                    visiting.discard(path[-1])
+                    visited.add(path.pop())
+                    stack.pop()
+                elif dep in visiting:
+                    return path[path.index(dep):] + [dep]
+                elif dep not in visited:
+                    visiting.add(dep)
+                    path.append(dep)
+                    stack.append(iter(self._dependencies.get(dep, [])))
+
+        return None
+
+    def serial_order(self, root=None):
+        """
+        The depth first order commands used to be run in, used to prioritise ready commands
+        so a single worker runs them in exactly that order. Without a root every command is ordered.
+        """
+        order = []
+
+        def visit(name):
+            if name in order:
+                return
+            for dep in self._dependencies[name]:
+                visit(dep)
+            order.append(name)
+
+        for name in ([root] if root is not None else self._dependencies):
+            visit(name)
+        return order
+
+
+def build_graph(root, get_dependencies):
+    """
+    Build the dependency graph reachable from the root command and check it for cycles
+
+    Args:
+        root: name of the command to run
+        get_dependencies: callable returning the dependency names of a command
+
+    Returns:
+        a Graph of all the commands that need to run
+    """
+    graph = Graph()
+    queue = [root]
+    while queue:
+        name = queue.pop(0)
+        if name in graph.nodes:
+            continue
+        graph.add(name, get_dependencies(name))
+        queue.extend(graph.dependencies(name))
+
+    cycle = graph.find_cycle()
+    if cycle:
+        raise CycleError(cycle)
+
+    return graph
+
+
+class Scheduler(object):
+    """
+    Runs the commands of a dependency graph on a bounded pool of workers,
+    a command starts as soon as all of its dependencies have finished.
+    """
+
+    def __init__(self, graph, root, run, jobs=1):
+        # root can be None to run every command of the graph
+        self.graph = graph
+        self.root = root
+        self._run = run
+        self.jobs = max(1, jobs)
+        self.durations = {}
+
+    def _timed_run(self, name):
+        start = time.time()
+        with trace.span(name, 'command'):
+            self._run(name)
+        self.durations[name] = time.time() - start
+
+    def _submit(self, executor, ready, running):
+        while ready and len(running) < self.jobs:
+            name = ready.pop(0)
+            _log.debug('Starting: {0}'.format(name))
+            running[executor.submit(self._timed_run, name)] = name
+
+    def _release(self, name, remaining, ready):
+        # the dependents of a finished command are ready once it was the last dependency they waited for
+        for dependent in self.graph.dependents(name):
+            if dependent in remaining:
+                remaining[dependent].discard(name)
+                if not remaining[dependent] and dependent not in ready:
+                    ready.append(dependent)
+
+    def run(self):
+        order = self.graph.serial_order(self.root)
+        remaining = {name: set(self.graph.dependencies(name)) for name in order}
+        ready = [name for name in order if not remaining[name]]
+        running = {}
+        error = None
+
+        executor = futures.ThreadPoolExecutor(max_workers=self.jobs)
+        try:
+            while ready or running:
+                if error is None:
+                    self._submit(executor, ready, running)
+
+                if not running:
+                    break
+
+                done, _ = futures.wait(list(running.keys()), return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is None:
+                        self._release(name, remaining, ready)
+                    elif error is None:
+                        _log.error('Command failed: {0}, waiting for running commands to finish'.format(name))
+                        error = future.exception()
+                ready.sort(key=order.index)
+        finally:
+            executor.shutdown(wait=True)
+            self._log_critical_path()
+
+        if error is not None:
+            raise error
+
+    def critical_path(self):
+        """
+        The chain of dependent commands that took the longest to run
+
+        Returns:
+            a tuple of the list of command names and the total time they took
+        """
+        longest = {}
+        for name in self.graph.serial_order(self.root):
+            if name not in self.durations:
+                continue
+            previous = max([longest[dep] for dep in self.graph.dependencies(name) if dep in longest] or [([], 0)],
+                           key=lambda path: path[1])
+            longest[name] = (previous[0] + [name], previous[1] + self.durations[name])
+
+        if not longest:
+            return ([], 0)
+
+        return max(longest.values(), key=lambda path: path[1])
+
+    def _log_critical_path(self):
+        path, total = self.critical_path()
+        if path:
+            _log.info('Critical Path: {0} ({1:.3f}s)'.format(' -> '.join(path), total))
@@ -0,0 +1,160 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import functools
+import json
+import os
+import threading
+import time
+
+from mb.lib import logger
+
+_log = logger.get_logger('[Trace]')
+
+# Spans time the phases of a run. They cost nothing until tracing is enabled with --trace or --profile,
+# the run then writes a Chrome trace (chrome://tracing, ui.perfetto.dev) and a summary table to the artifact dir.
+
+_state = {'enabled': False, 'profiler': None}
+_events = []
+_events_lock = threading.Lock()
+_start = time.time()
+
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span(object):
+    def __init__(self, name, category, args, thread_id=None):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread_id = thread_id
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        end = time.time()
+        event = {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': int((self._start - _start) * 1e6),
+            'dur': int((end - self._start) * 1e6),
+            'pid': os.getpid(),
+            'tid': self.thread_id or threading.current_thread().ident,
+        }
+        if self.args or kind is not None:
+            event['args'] = dict(self.args, **({'error': repr(value)} if kind is not None else {}))
+        with _events_lock:
+            _events.append(event)
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def enable():
+    _state['enabled'] = True
+
+
+def span(name, category='mb', thread_id=None, **args):
+    """
+    Time a block of code
+
+        with trace.span('render template', 'template', file=template_file):
+            ...
+
+    Spans overlapping on one thread without nesting, like coroutines, need a thread_id of their own to show up right.
+    """
+    if not _state['enabled']:
+        return _NO_SPAN
+    return _Span(name, category, args, thread_id)
+
+
+def traced(name=None, category='mb'):
+    """
+    Decorator timing every call of a function
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            if not _state['enabled']:
+                return func(*args, **kw)
+            with _Span(span_name, category, {}):
+                return func(*args, **kw)
+        return wrapper
+    return decorator
+
+
+def events():
+    with _events_lock:
+        return list(_events)
+
+
+def start_profile():
+    import cProfile
+
+    enable()
+    _state['profiler'] = cProfile.Profile()
+    _state['profiler'].enable()
+
+
+def summary(trace_events):
+    """
+    Aggregate the spans by name
+
+    Returns:
+        the lines of a table of the count, total, mean and max time of every span, longest total first
+    """
+    totals = {}
+    for event in trace_events:
+        key = (event['cat'], event['name'])
+        count, total, longest = totals.get(key, (0, 0, 0))
+        totals[key] = (count + 1, total + event['dur'], max(longest, event['dur']))
+
+    lines = ['{0:<12} {1:<40} {2:>7} {3:>11} {4:>11} {5:>11}'.format(
+        'category', 'span', 'count', 'total ms', 'mean ms', 'max ms')]
+    for ((category, name), (count, total, longest)) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        lines.append('{0:<12} {1:<40} {2:>7} {3:>11.3f} {4:>11.3f} {5:>11.3f}'.format(
+            category, name[:40], count, total / 1000.0, total / 1000.0 / count, longest / 1000.0))
+    return lines
+
+
+def write(directory):
+    """
+    Write trace.json, summary.txt and with --profile profile.pstats and profile.txt to a directory
+    """
+    profiler = _state['profiler']
+    if profiler is not None:
+        profiler.disable()
+
+    os.makedirs(directory, exist_ok=True)
+
+    trace_events = events()
+    with open(os.path.join(directory, 'trace.json'), 'w') as trace_file:
+        trace_file.write(json.dumps({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}))
+
+    with open(os.path.join(directory, 'summary.txt'), 'w') as summary_file:
+        summary_file.write('\n'.join(summary(trace_events)) + '\n')
+
+    if profiler is not None:
+        import pstats
+
+        profiler.dump_stats(os.path.join(directory, 'profile.pstats'))
+        with open(os.path.join(directory, 'profile.txt'), 'w') as profile_file:
+            stats = pstats.Stats(profiler, stream=profile_file)
+            stats.sort_stats('cumulative').print_stats(50)
+
+    _log.info('Trace written to {0}'.format(directory))
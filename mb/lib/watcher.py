@@ -0,0 +1,240 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+from mb.lib import logger
+
+_log = logger.get_logger('[Watcher]')
+
+# inotify(7)
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_ISDIR = 0x40000000
+_IN_Q_OVERFLOW = 0x00004000
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _is_excluded(path, excludes):
+    return any(path == exclude or path.startswith(exclude + os.sep) for exclude in excludes)
+
+
+class Watcher(object):
+    """
+    Reports the files that changed under a set of watched paths.
+    Directories are watched recursively, a file is watched on its own.
+    """
+
+    def __init__(self, paths, excludes=(), debounce=0.2):
+        self.paths = sorted(set(os.path.abspath(path) for path in paths))
+        self.excludes = [os.path.abspath(exclude) for exclude in excludes]
+        self.debounce = debounce
+
+    def _wait(self, timeout):
+        """
+        Returns:
+            the set of paths that changed before the timeout (None waits forever), possibly empty
+        """
+        raise NotImplementedError()
+
+    def changes(self, timeout=None):
+        """
+        Wait for a change, then keep collecting changes until none happened for the debounce delay
+        so saving many files at once is reported as a single change.
+
+        Returns:
+            the set of paths that changed, empty when nothing changed before the timeout
+        """
+        changed = self._wait(timeout)
+        while changed:
+            more = self._wait(self.debounce)
+            if not more:
+                break
+            changed |= more
+        return changed
+
+    def drain(self):
+        """
+        Forget the changes that happened so far
+        """
+        while self._wait(0):
+            pass
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """
+    Finds changes by comparing the mtime and size of every watched file, works everywhere.
+    """
+
+    def __init__(self, paths, excludes=(), debounce=0.2, interval=0.5):
+        super(PollingWatcher, self).__init__(paths, excludes, debounce)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _files(self, path):
+        if not os.path.isdir(path):
+            yield path
+            return
+
+        for (root, dirs, files) in os.walk(path):
+            dirs[:] = [name for name in dirs if not _is_excluded(os.path.join(root, name), self.excludes)]
+            for name in files:
+                yield os.path.join(root, name)
+
+    def _scan(self):
+        snapshot = {}
+        for path in self.paths:
+            for file in self._files(path):
+                try:
+                    stat = os.stat(file)
+                except OSError:
+                    continue
+                snapshot[file] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _wait(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = set(file for file in set(snapshot) | set(self._snapshot)
+                          if snapshot.get(file) != self._snapshot.get(file))
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+            time.sleep(self.interval if deadline is None else max(0, min(self.interval, deadline - time.time())))
+
+
+class InotifyWatcher(Watcher):
+    """
+    Gets change events from the Linux kernel, no polling involved.
+    """
+
+    def __init__(self, paths, excludes=(), debounce=0.2):
+        super(InotifyWatcher, self).__init__(paths, excludes, debounce)
+        library = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self._fd = self._libc.inotify_init1(_IN_CLOEXEC | _IN_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self._watches = {}
+        self._files = set()
+        for path in self.paths:
+            if os.path.isdir(path):
+                self._add_tree(path)
+            else:
+                # editors often replace files, watching the directory keeps track of the new file
+                self._files.add(path)
+                self._add_watch(os.path.dirname(path))
+
+    def _add_watch(self, path):
+        if path in self._watches.values():
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            _log.debug('Unable to watch {0}: {1}'.format(path, os.strerror(ctypes.get_errno())))
+            return
+        self._watches[wd] = path
+
+    def _add_tree(self, path):
+        for (root, dirs, _) in os.walk(path):
+            dirs[:] = [name for name in dirs if not _is_excluded(os.path.join(root, name), self.excludes)]
+            self._add_watch(root)
+
+    def _is_watched(self, path):
+        if path in self._files:
+            return True
+        return any(path == root or path.startswith(root + os.sep)
+                   for root in self.paths if root not in self._files) and not _is_excluded(path, self.excludes)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError as err:
+            if err.errno == errno.EAGAIN:
+                return set()
+            raise
+
+        changed = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                # events were lost, report every watched path as changed
+                changed.update(self.paths)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & _IN_DELETE_SELF:
+                self._watches.pop(wd, None)
+
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            if not self._is_watched(path):
+                continue
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._add_tree(path)
+            changed.add(path)
+
+        return changed
+
+    def _wait(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            changed = self._read_events() if readable else set()
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def create_watcher(paths, excludes=(), debounce=0.2, polling=False):
+    """
+    Create the best watcher available on this platform, inotify on Linux and polling everywhere else
+
+    Args:
+        paths: directories and files to watch
+        excludes: directories to ignore, like the artifact directory
+        debounce: the number of seconds without changes ending a burst of changes
+        polling: always use the polling watcher
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(paths, excludes, debounce)
+        except (OSError, AttributeError, TypeError) as err:
+            _log.debug('Falling back to polling for changes: {0}'.format(err))
+
+    return PollingWatcher(paths, excludes, debounce)
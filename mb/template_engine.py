@@ -2,10 +2,174 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import abc
+import hashlib
+import json
 import os
+import re
+import threading
+from concurrent import futures
 from string import Template
 
 from mb.lib import logger
+from mb.lib import trace
+
+_MANIFEST_VERSION = 2
+_STREAM_CHUNK_SIZE = 1024 * 1024
+_PARTIAL_PLACEHOLDER = re.compile(r'\{?[_a-z0-9]*', re.IGNORECASE)
+
+
+def _hash(contents):
+    return hashlib.sha1(contents.encode('utf-8')).hexdigest()
+
+
+class TemplateError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+
+    def __str__(self):
+        return 'Failed to generate {0} template(s):\n{1}'.format(
+            len(self.errors), '\n'.join('  {0}: {1}'.format(file, error) for (file, error) in self.errors))
+
+
+class CompiledTemplate(object):
+    """
+    A template split once into literal and placeholder segments.
+    Rendering gives the same result as string.Template.safe_substitute with a single join.
+    """
+
+    def __init__(self, segments):
+        # each segment is [text, name], name is None for literal text
+        self.segments = segments
+        self.placeholders = frozenset(name for (_, name) in segments if name)
+
+    @classmethod
+    def compile(cls, contents):
+        segments = []
+        literal = []
+        position = 0
+        for match in Template.pattern.finditer(contents):
+            literal.append(contents[position:match.start()])
+            position = match.end()
+            name = match.group('named') or match.group('braced')
+            if name:
+                segments.append([''.join(literal), None])
+                segments.append([match.group(), name])
+                literal = []
+            elif match.group('escaped') is not None:
+                literal.append(Template.delimiter)
+            else:
+                literal.append(match.group())
+
+        literal.append(contents[position:])
+        segments.append([''.join(literal), None])
+        return cls([segment for segment in segments if segment[0]])
+
+    def render(self, variables):
+        return ''.join(text if name is None or name not in variables else '%s' % (variables[name],)
+                       for (text, name) in self.segments)
+
+
+def safe_chunks(file, chunk_size=_STREAM_CHUNK_SIZE):
+    """
+    Read a template in chunks that can each be substituted on their own.
+    A placeholder that is cut off by the end of a chunk is carried over to the next one.
+    """
+    carry = ''
+    for chunk in iter(lambda: file.read(chunk_size), ''):
+        buffer = carry + chunk
+        start = buffer.rfind(Template.delimiter)
+        while start > 0 and buffer[start - 1] == Template.delimiter:
+            start -= 1
+
+        # the text after the last run of delimiters could still become part of a placeholder
+        if start >= 0 and _PARTIAL_PLACEHOLDER.match(buffer, buffer.rfind(Template.delimiter) + 1).end() == len(buffer):
+            carry = buffer[start:]
+            buffer = buffer[:start]
+        else:
+            carry = ''
+
+        if buffer:
+            yield buffer
+
+    if carry:
+        yield carry
+
+
+class CompiledTemplateCache(object):
+    """
+    Compiled templates keyed by the hash of their content, persisted between runs
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self._segments = None
+        self._compiled = {}
+        self._used = set()
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._segments = {}
+        if os.path.isfile(self.cache_file):
+            try:
+                with open(self.cache_file, 'r') as cache:
+                    self._segments = json.load(cache)
+            except ValueError:
+                pass
+
+    def get(self, contents):
+        """
+        Returns:
+            a tuple of the content hash and the CompiledTemplate
+        """
+        template_hash = _hash(contents)
+        with self._lock:
+            if self._segments is None:
+                self._load()
+            self._used.add(template_hash)
+            if template_hash in self._compiled:
+                return (template_hash, self._compiled[template_hash])
+            segments = self._segments.get(template_hash)
+
+        compiled = CompiledTemplate(segments) if segments is not None else CompiledTemplate.compile(contents)
+        with self._lock:
+            if segments is None:
+                self._segments[template_hash] = compiled.segments
+                self._changed = True
+            self._compiled[template_hash] = compiled
+        return (template_hash, compiled)
+
+    def preload(self):
+        """
+        Compile every template of the on disk cache ahead of time
+        """
+        with self._lock:
+            if self._segments is None:
+                self._load()
+            for (template_hash, segments) in self._segments.items():
+                if template_hash not in self._compiled:
+                    self._compiled[template_hash] = CompiledTemplate(segments)
+
+    def save(self):
+        """
+        Persist the templates used since the last save, templates that are no longer used are dropped
+        """
+        with self._lock:
+            if self._segments is None:
+                return
+            unused = set(self._segments) - self._used
+            if self._changed or unused:
+                segments = {key: value for (key, value) in self._segments.items() if key in self._used}
+                if not os.path.isdir(os.path.dirname(self.cache_file)):
+                    os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                temp_file = '{0}.{1}.tmp'.format(self.cache_file, os.getpid())
+                with open(temp_file, 'w') as output:
+                    # json.dumps uses the C encoder, json.dump would encode chunk by chunk in python
+                    output.write(json.dumps(segments))
+                os.replace(temp_file, self.cache_file)
+                self._segments = segments
+            self._used = set()
+            self._changed = False
 
 
 class TemplateEngine(object):
@@ -16,7 +180,8 @@ class TemplateEngine(object):
 
     def generate_files(self):
         self.log.info('Generating templated files...')
-        return self._generate_files()
+        with trace.span('generate templates', 'template'):
+            return self._generate_files()
 
     @abc.abstractmethod
     def _generate_files(self):
@@ -28,43 +193,259 @@ class DefaultTemplateEngine(TemplateEngine):
         super(DefaultTemplateEngine, self).__init__()
         self.build_context = build_context
         self.config = config
+        self._incremental = False
+        self._workers = 1
+        self._streaming_threshold = 16 * 1024 * 1024
+        self.manifest_file = os.path.join(config.artifact_dir, 'template_manifest.json')
+        self.compiled_templates = CompiledTemplateCache(os.path.join(config.artifact_dir, 'cache', 'compiled_templates.json'))
+
+    @property
+    def incremental(self):
+        return self._incremental
+
+    @incremental.setter
+    def incremental(self, value):
+        self._incremental = value
 
-    def _generate_file_from_tmpl(self, build_tmpl_dir, template_file, variables):
-        template_file_contents = ""
+    @property
+    def workers(self):
+        return self._workers
 
+    @workers.setter
+    def workers(self, value):
+        self._workers = max(1, int(value))
+
+    @property
+    def streaming_threshold(self):
+        return self._streaming_threshold
+
+    @streaming_threshold.setter
+    def streaming_threshold(self, value):
+        self._streaming_threshold = int(value or 0)
+
+    def _read_template(self, build_tmpl_dir, template_file):
         with open(os.path.join(build_tmpl_dir, template_file), 'r') as file:
-            first_line = file.readline().strip()
+            first_line = file.readline()
+            if '# build-template' not in first_line:
+                return (None, None)
+            return (first_line.strip(), first_line + file.read())
+
+    def _destination(self, template_file, header):
+        split_header = header.split('|')
+        if len(split_header) > 1:
+            dest_file = os.path.join(self.config.project_dir, split_header[1])
+            # several templates can be rendered into the same directory at the same time
+            os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+            return dest_file
 
-        if '# build-template' not in first_line:
+        return os.path.join(self.config.project_dir, template_file)
+
+    def _load_manifest(self):
+        if not os.path.isfile(self.manifest_file):
+            return {}
+
+        try:
+            with open(self.manifest_file, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+        except ValueError:
+            self.log.debug('Template manifest is corrupt, regenerating all templates')
+            return {}
+
+        return manifest if manifest.get('version') == _MANIFEST_VERSION else {}
+
+    def _save_manifest(self, manifest):
+        temp_file = '{0}.{1}.tmp'.format(self.manifest_file, os.getpid())
+        with open(temp_file, 'w') as output:
+            output.write(json.dumps(dict(manifest, version=_MANIFEST_VERSION)))
+        os.replace(temp_file, self.manifest_file)
+
+    def _output_hash(self, dest_file, entry=None):
+        """
+        Hash of the current destination file, the stat recorded in the manifest entry avoids reading it when possible
+        """
+        if not os.path.isfile(dest_file):
+            return None
+
+        stat = os.stat(dest_file)
+        if entry and entry.get('dest') == dest_file and (entry.get('size'), entry.get('mtime')) == (stat.st_size, stat.st_mtime_ns):
+            return entry['output']
+
+        output_hash = hashlib.sha1()
+        with open(dest_file, 'r') as file:
+            for chunk in iter(lambda: file.read(_STREAM_CHUNK_SIZE), ''):
+                output_hash.update(chunk.encode('utf-8'))
+        return output_hash.hexdigest()
+
+    def _generate_file_from_tmpl(self, build_tmpl_dir, template_file, variables, entry=None, incremental=False,
+                                 changed_variables=frozenset()):
+        """
+        Render a single template
+
+        Args:
+            entry: the manifest entry of the template from the previous incremental run
+            changed_variables: names of the variables whose value changed since the previous incremental run
+
+        Returns:
+            the manifest entry of the template when rendering incrementally, otherwise None
+        """
+        template_path = os.path.join(build_tmpl_dir, template_file)
+        if self.streaming_threshold and os.path.getsize(template_path) > self.streaming_threshold:
+            return self._stream_file_from_tmpl(template_path, template_file, variables, entry, incremental, changed_variables)
+
+        header, template_file_contents = self._read_template(build_tmpl_dir, template_file)
+        if header is None:
             self.log.debug('The following file is being ignored: {0}'.format(template_file))
-            return
+            return None
 
-        split_first_line = first_line.split('|')
-        if len(split_first_line) > 1:
-            dest_dir_name = os.path.dirname(split_first_line[1])
-            if not os.path.exists(dest_dir_name):
-                os.makedirs(dest_dir_name)
-            dest_file = os.path.join(self.config.project_dir, split_first_line[1])
-        else:
-            dest_file = os.path.join(self.config.project_dir, template_file)
+        dest_file = self._destination(template_file, header)
+        template_hash, template = self.compiled_templates.get(template_file_contents)
+        if not incremental:
+            with open(dest_file, 'w') as file:
+                file.write(template.render(variables))
+            return None
 
-        with open(os.path.join(build_tmpl_dir, template_file), 'r') as file:
-            template_file_contents = file.read()
+        current_output_hash = self._output_hash(dest_file, entry)
+        if (entry and (entry['template'], entry['output']) == (template_hash, current_output_hash) and
+                template.placeholders.isdisjoint(changed_variables)):
+            self.log.debug('Template is up to date: {0}'.format(template_file))
+            stat = os.stat(dest_file)
+            entry.update({'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+            return entry
+
+        new_file_contents = template.render(variables)
+        output_hash = _hash(new_file_contents)
+        if output_hash != current_output_hash:
+            with open(dest_file, 'w') as file:
+                file.write(new_file_contents)
+
+        stat = os.stat(dest_file)
+        return {
+            'template': template_hash,
+            'placeholders': sorted(template.placeholders),
+            'output': output_hash,
+            'dest': dest_file,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+        }
 
-        template = Template(template_file_contents)
-        new_file_contents = template.safe_substitute(variables)
+    def _scan_template(self, template_path):
+        template_hash = hashlib.sha1()
+        placeholders = set()
+        with open(template_path, 'r') as file:
+            for chunk in safe_chunks(file):
+                template_hash.update(chunk.encode('utf-8'))
+                placeholders.update(CompiledTemplate.compile(chunk).placeholders)
 
-        with open(dest_file, 'w') as file:
-            file.write(new_file_contents)
+        return (template_hash.hexdigest(), placeholders)
+
+    def _stream_file_from_tmpl(self, template_path, template_file, variables, entry=None, incremental=False,
+                               changed_variables=frozenset()):
+        """
+        Render a large template chunk by chunk into a temporary file that replaces the destination once complete,
+        memory use does not depend on the size of the template
+        """
+        with open(template_path, 'r') as file:
+            header = file.readline().strip()
+        if '# build-template' not in header:
+            self.log.debug('The following file is being ignored: {0}'.format(template_file))
+            return None
+
+        dest_file = self._destination(template_file, header)
+        current_output_hash = None
+        if incremental:
+            template_hash, placeholders = self._scan_template(template_path)
+            current_output_hash = self._output_hash(dest_file, entry)
+            if (entry and (entry['template'], entry['output']) == (template_hash, current_output_hash) and
+                    placeholders.isdisjoint(changed_variables)):
+                self.log.debug('Template is up to date: {0}'.format(template_file))
+                stat = os.stat(dest_file)
+                entry.update({'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+                return entry
+
+        self.log.debug('Streaming template: {0}'.format(template_file))
+        output_hash = hashlib.sha1()
+        temp_file = '{0}.{1}.{2}.tmp'.format(dest_file, os.getpid(), threading.current_thread().ident)
+        try:
+            with open(template_path, 'r') as file, open(temp_file, 'w') as output:
+                for chunk in safe_chunks(file):
+                    rendered = CompiledTemplate.compile(chunk).render(variables)
+                    output_hash.update(rendered.encode('utf-8'))
+                    output.write(rendered)
+
+            if output_hash.hexdigest() == current_output_hash:
+                os.remove(temp_file)
+            else:
+                os.replace(temp_file, dest_file)
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+        if not incremental:
+            return None
+
+        stat = os.stat(dest_file)
+        return {
+            'template': template_hash,
+            'placeholders': sorted(placeholders),
+            'output': output_hash.hexdigest(),
+            'dest': dest_file,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+        }
+
+    def affected_templates(self, changed_variables):
+        """
+        Use the placeholder index of the last incremental run to find the templates a change of variables affects
+
+        Returns:
+            the list of template files that reference any of the changed variables
+        """
+        templates = self._load_manifest().get('templates', {})
+        return sorted(file for (file, entry) in templates.items() if not set(entry['placeholders']).isdisjoint(changed_variables))
 
     def _generate_files(self):
         variables = {}
         variables.update(self.config.variables)
         variables.update(self.build_context.variables)
 
-        if not os.path.isdir(self.config.template_dir):
+        template_dir = self.config.template_dir
+        if not os.path.isdir(template_dir):
             self.log.warn('There are no template files to generate!')
             return
 
-        for file in os.listdir(self.config.template_dir):
-            self._generate_file_from_tmpl(self.config.template_dir, file, variables)
+        template_files = sorted(os.listdir(template_dir))
+        manifest = self._load_manifest() if self.incremental else {}
+        previous_entries = manifest.get('templates', {})
+        variable_hashes = {name: _hash(json.dumps(value, sort_keys=True, default=str)) for (name, value) in variables.items()}
+        previous_hashes = manifest.get('variables', {})
+        changed_variables = frozenset(name for name in set(variable_hashes) | set(previous_hashes)
+                                      if variable_hashes.get(name) != previous_hashes.get(name))
+
+        def generate(file):
+            try:
+                with trace.span('render template', 'template', file=file):
+                    return (self._generate_file_from_tmpl(template_dir, file, variables, previous_entries.get(file),
+                                                          self.incremental, changed_variables), None)
+            except Exception as err:
+                return (None, err)
+
+        if self.workers > 1:
+            with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(generate, template_files))
+        else:
+            results = [generate(file) for file in template_files]
+
+        self.compiled_templates.save()
+
+        # errors are reported in template file order no matter which worker hit them
+        errors = [(file, err) for (file, (_, err)) in zip(template_files, results) if err is not None]
+
+        if self.incremental:
+            self._save_manifest({
+                'variables': variable_hashes,
+                'templates': {file: entry for (file, (entry, _)) in zip(template_files, results) if entry},
+            })
+
+        if errors:
+            raise TemplateError(errors)
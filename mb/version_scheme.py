@@ -2,12 +2,27 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import abc
+import fnmatch
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
 
 from enum import Enum
 from git import exc as git_exc
 from git import Repo
 
+from .lib import git_objects
+from .lib import git_refs
 from .lib import logger
+from .lib import trace
+
+_VERSION_CACHE_VERSION = 2
+_VERSION_CACHE_SIZE = 32
+
+# the number of tags git describe considers, it picks the one with the fewest commits since
+_DESCRIBE_CANDIDATES = 10
 
 
 class VersionScheme(object):
@@ -17,10 +32,19 @@ class VersionScheme(object):
 
     def generate(self):
         self.log.info('Generating Version...')
-        generated_version = self._generate()
+        with trace.span('generate version', 'version', scheme=self.__class__.__name__):
+            generated_version = self._generate()
         self.log.info('Version: {0}'.format(generated_version))
         return generated_version
 
+    def cache_key(self):
+        """
+        Returns:
+            hex digest of everything the generated version depends on,
+            or None when the scheme can't tell and the version has to be generated on every run
+        """
+        return None
+
     @abc.abstractmethod
     def _generate(self):
         raise NotImplementedError("'generate' must be reimplemented by %s" % self)
@@ -31,21 +55,148 @@ class Increment(Enum):
     patch = 1
 
 
+def _match_pattern(pattern):
+    # git describe --match accepts [^...] as well as [!...], fnmatch only knows the latter
+    return re.compile(fnmatch.translate(pattern.replace('[^', '[!')))
+
+
+class TagIndex(object):
+    """
+    The annotated tags of a repository (the only ones git describe uses) by the commit they point to,
+    read with a single git for-each-ref. Tags of a commit are kept newest first, like git describe prefers them.
+    """
+
+    def __init__(self, tags):
+        self.by_commit = {}
+        for (name, commit) in tags:
+            self.by_commit.setdefault(commit, []).append(name)
+
+    @classmethod
+    def load(cls, repo):
+        output = repo.git.for_each_ref('refs/tags', sort='-creatordate',
+                                       format='%(objecttype) %(*objectname) %(refname:short)')
+        tags = []
+        for line in output.splitlines():
+            kind, commit, name = line.split(' ', 2)
+            if kind == 'tag':
+                tags.append((name, commit))
+        return cls(tags)
+
+    def matching(self, pattern):
+        """
+        Returns:
+            dict of commit to the preferred tag of the commit matching the pattern
+        """
+        regex = _match_pattern(pattern)
+        matches = {}
+        for (commit, names) in self.by_commit.items():
+            for name in names:
+                if regex.match(name):
+                    matches[commit] = name
+                    break
+        return matches
+
+
 class DefaultVersionScheme(VersionScheme):
     def __init__(self, config):
         super(DefaultVersionScheme, self).__init__()
-        self.repo = Repo(config.project_dir)
+        self._project_dir = config.project_dir
+        self.cache_file = os.path.join(config.artifact_dir, 'cache', 'version.json')
+        self._repo = None
+        self._tag_index = None
         self._version = None
         self._increment = Increment.none
 
+    @property
+    def repo(self):
+        # only created when the version isn't cached, opening it is the slow part of a cached run
+        if self._repo is None:
+            self._repo = Repo(self._project_dir, search_parent_directories=True)
+        return self._repo
+
+    @property
+    def tag_index(self):
+        if self._tag_index is None:
+            self._tag_index = TagIndex.load(self.repo)
+        return self._tag_index
+
     def _describe(self, value):
+        """
+        Find the nearest annotated tag matching a pattern with git describe --match
+
+        Returns:
+            the tag name, followed by '-<distance>-g<short hash>' when it isn't on the current commit,
+            or None when no tag matches
+        """
+        matches = self.tag_index.matching(value)
+        if not matches:
+            return None
+
+        head = str(self.repo.head.commit)
+        if head in matches:
+            return matches[head]
+
+        # in a merged history the nearest tag isn't simply the newest one, git describe works it out
         try:
             return self.repo.git.describe(value, match=True)
         except git_exc.GitCommandError as err:
-            if 'No names found' in str(err):
+            if 'No names found' in str(err) or 'can describe' in str(err):
                 return None
             raise err
 
+    def cache_key(self):
+        git_dir = git_refs.find_git_dir(self._project_dir)
+        head = git_refs.head_sha(git_dir) if git_dir else None
+        if not head:
+            return None
+
+        key_data = [head, git_refs.refs_signature(git_dir), self.version, self.increment.name]
+        return hashlib.sha1(json.dumps(key_data).encode('utf-8')).hexdigest()
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_file, 'r') as cache:
+                entries = json.load(cache, object_pairs_hook=OrderedDict)
+        except (IOError, OSError, ValueError):
+            return OrderedDict()
+
+        if entries.pop('__version__', None) != _VERSION_CACHE_VERSION:
+            return OrderedDict()
+        return entries
+
+    def _write_cache(self, entries):
+        while len(entries) > _VERSION_CACHE_SIZE:
+            entries.popitem(last=False)
+        entries['__version__'] = _VERSION_CACHE_VERSION
+
+        try:
+            if not os.path.isdir(os.path.dirname(self.cache_file)):
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            temp_file = '{0}.{1}.tmp'.format(self.cache_file, os.getpid())
+            with open(temp_file, 'w') as cache:
+                cache.write(json.dumps(entries))
+            os.replace(temp_file, self.cache_file)
+        except (IOError, OSError) as err:
+            self.log.debug('Unable to write the version cache: {0}'.format(err))
+
+    def generate(self):
+        # the version only depends on the current commit, the tags and the settings, it is cached on those
+        with trace.span('read version cache', 'version'):
+            key = self.cache_key()
+            entries = self._read_cache() if key else OrderedDict()
+        if key in entries:
+            cached_version = dict(entries[key])
+            self.log.debug('Version unchanged since the last run')
+            self.log.info('Version: {0}'.format(cached_version))
+            return cached_version
+
+        generated_version = super(DefaultVersionScheme, self).generate()
+        if key:
+            entries.pop(key, None)
+            entries[key] = generated_version
+            self._write_cache(entries)
+        return generated_version
+
     @property
     def version(self):
         return self._version
@@ -87,3 +238,78 @@ class DefaultVersionScheme(VersionScheme):
         patch = int(last_tag_split[-1]) + 1
         calculated_version = '{0}.{1}'.format(prefix, patch)
         return self._return_version(calculated_version)
+
+
+class GitReaderVersionScheme(DefaultVersionScheme):
+    """
+    Generates the same versions as DefaultVersionScheme, reading HEAD, the refs and the commit and tag objects
+    straight from the .git directory instead of running git.
+    Select it with config.version_scheme: GitReaderVersionScheme
+    """
+
+    def __init__(self, config):
+        super(GitReaderVersionScheme, self).__init__(config)
+        self._git_dir = None
+        self._objects = None
+
+    @property
+    def git_dir(self):
+        if self._git_dir is None:
+            self._git_dir = git_refs.find_git_dir(self._project_dir)
+            if self._git_dir is None:
+                raise git_objects.GitObjectError('HEAD', '{0} is not a git repository'.format(self._project_dir))
+        return self._git_dir
+
+    @property
+    def objects(self):
+        if self._objects is None:
+            self._objects = git_objects.ObjectStore(self.git_dir.common_dir)
+        return self._objects
+
+    @property
+    def tag_index(self):
+        if self._tag_index is None:
+            tags = []
+            for (ref, sha) in git_refs.list_refs(self.git_dir).items():
+                tag = self.objects.tag(sha)
+                # lightweight tags point straight to a commit, git describe ignores them
+                if tag is not None:
+                    tags.append((tag.time, ref[len('refs/tags/'):], self.objects.peel(sha)))
+            tags.sort(key=lambda tag: (-tag[0], tag[1]))
+            self._tag_index = TagIndex([(name, commit) for (_, name, commit) in tags])
+        return self._tag_index
+
+    def _head(self):
+        head = git_refs.head_sha(self.git_dir)
+        if head is None:
+            raise git_objects.GitObjectError('HEAD', 'the current branch has no commits')
+        return head
+
+    def _describe(self, value):
+        matches = self.tag_index.matching(value)
+        if not matches:
+            return None
+
+        head = self._head()
+        if head in matches:
+            return matches[head]
+
+        # like git describe, the candidates are the first tagged commits met walking the history newest first,
+        # the nearest one has the fewest commits that aren't in its history, the first one met on a tie
+        candidates = []
+        for commit in self.objects.walk(head):
+            if commit.sha in matches:
+                candidates.append(commit.sha)
+                if len(candidates) == _DESCRIBE_CANDIDATES:
+                    break
+
+        if not candidates:
+            return None
+
+        (distance, _, tagged) = min((self.objects.count_exclusive(head, sha), index, sha)
+                                    for (index, sha) in enumerate(candidates))
+        return '{0}-{1}-g{2}'.format(matches[tagged], distance, head[:7])
+
+    def _return_version(self, version):
+        hash = self._head()
+        return {"hash": hash, "short_hash": hash[:7], "version": version}
@@ -40,7 +40,7 @@ setup(
     tests_require=tests_require,
     entry_points="""
     [console_scripts]
-    mb=mb.cli.main:main
+    mb=mb.cli.client:main
     """,
     classifiers=[
         'Development Status :: 5 - Production/Stable',
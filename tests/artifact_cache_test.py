@@ -0,0 +1,187 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import pytest
+
+from mb.artifact_cache import ArtifactError
+from mb.artifact_cache import FileSystemArtifactCache
+from mb.artifact_cache import HttpArtifactCache
+from mb.artifact_cache import output_files
+from mb.artifact_cache import pack
+from mb.artifact_cache import parse_size
+from mb.artifact_cache import unpack
+from mb.command import ShellCommand
+from mb.config.config import ConfigFile
+from mb.config.config import PluginConfig
+from mb.lib import process
+from mb.lib.result_cache import ResultCache
+from tests.helpers import StaticBuildContext
+
+
+class _ArtifactServer(HTTPServer):
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _ArtifactHandler)
+        self.artifacts = {}
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/cache'.format(self.server_address[1])
+
+
+class _ArtifactHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = self.server.artifacts.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        self.server.artifacts[self.path] = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    artifact_server = _ArtifactServer()
+    thread = threading.Thread(target=artifact_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield artifact_server
+    artifact_server.shutdown()
+    artifact_server.server_close()
+
+
+def _config(tmpdir):
+    return ConfigFile(os.path.join(str(tmpdir), '.mb.yml'), {'name': 'sample_config'})
+
+
+def _artifact(tmpdir, name, size):
+    tmpdir.join('data').write('x' * size)
+    archive_file = str(tmpdir.join(name))
+    pack(archive_file, str(tmpdir), {'exit_code': 0}, ['data'])
+    return archive_file
+
+
+def test_pack_and_unpack_outputs(tmpdir):
+    tmpdir.join('dist', 'app.txt').write('built', ensure=True)
+    os.chmod(str(tmpdir.join('dist', 'app.txt')), 0o755)
+    archive_file = str(tmpdir.join('artifact.tar.gz'))
+    outputs = output_files(str(tmpdir), ['dist/**/*'])
+    pack(archive_file, str(tmpdir), {'output': 'done\n', 'exit_code': 0}, outputs)
+
+    restore_dir = tmpdir.join('restore')
+    with open(archive_file, 'rb') as archive:
+        record = unpack(archive, str(restore_dir))
+
+    assert record == {'output': 'done\n', 'exit_code': 0, 'outputs': ['dist/app.txt']}
+    assert restore_dir.join('dist', 'app.txt').read() == 'built'
+    assert os.stat(str(restore_dir.join('dist', 'app.txt'))).st_mode & 0o777 == 0o755
+
+
+def test_unpack_rejects_paths_outside_of_the_project(tmpdir):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w:gz') as archive:
+        info = tarfile.TarInfo('outputs/../../escaped.txt')
+        info.size = 1
+        archive.addfile(info, io.BytesIO(b'x'))
+    data.seek(0)
+
+    with pytest.raises(ArtifactError):
+        unpack(data, str(tmpdir.join('project')))
+    assert not tmpdir.join('escaped.txt').exists()
+
+
+def test_parse_size():
+    assert parse_size(None) is None
+    assert parse_size(1024) == 1024
+    assert parse_size('512') == 512
+    assert parse_size('10KB') == 10 * 1024
+    assert parse_size('1.5g') == int(1.5 * 1024 ** 3)
+    with pytest.raises(ValueError):
+        parse_size('lots')
+
+
+def test_file_system_cache_evicts_least_recently_used(tmpdir):
+    cache = FileSystemArtifactCache(_config(tmpdir))
+    cache.directory = 'shared'
+    for key in ('aa01', 'bb02', 'cc03'):
+        cache.put(key, _artifact(tmpdir, key, 20000))
+    # make the use order explicit, mtimes can be equal within the same tick
+    for (age, key) in enumerate(('bb02', 'aa01', 'cc03')):
+        os.utime(cache._artifact_file(key), (time.time() - 100 + age, time.time() - 100 + age))
+    cache.get('bb02').close()
+
+    size = os.path.getsize(cache._artifact_file('aa01'))
+    cache.max_size = 2 * size + size // 2
+    cache.put('dd04', _artifact(tmpdir, 'dd04', 20000))
+
+    assert cache.directory == str(tmpdir.join('shared'))
+    assert [key for key in ('aa01', 'bb02', 'cc03', 'dd04') if cache.get(key) is not None] == ['bb02', 'dd04']
+
+
+def test_http_cache(tmpdir, server):
+    cache = HttpArtifactCache()
+    cache.url = server.url + '/'
+    assert cache.get('aa01') is None
+
+    cache.put('aa01', _artifact(tmpdir, 'artifact.tar.gz', 10))
+    assert list(server.artifacts) == ['/cache/aa01.tar.gz']
+    with cache.get('aa01') as artifact:
+        assert unpack(artifact, str(tmpdir.join('restore')))['exit_code'] == 0
+
+
+def test_http_cache_unreachable(tmpdir):
+    cache = HttpArtifactCache()
+    cache.url = 'http://127.0.0.1:9'
+    cache.timeout = 1
+
+    cache.put('aa01', _artifact(tmpdir, 'artifact.tar.gz', 10))
+    assert cache.get('aa01') is None
+
+
+@pytest.mark.parametrize('url', [None, 'cache.example.com'])
+def test_http_cache_without_valid_url(tmpdir, url):
+    cache = HttpArtifactCache()
+    if url:
+        cache.url = url
+
+    cache.put('aa01', _artifact(tmpdir, 'artifact.tar.gz', 10))
+    assert cache.get('aa01') is None
+
+
+def test_result_shared_between_checkouts(tmpdir, server, capsys):
+    cache = HttpArtifactCache()
+    cache.url = server.url
+
+    results = []
+    for checkout in ('first', 'second'):
+        config = ConfigFile(str(tmpdir.join(checkout, '.mb.yml')), {'name': 'sample_config'})
+        tmpdir.join(checkout, 'input.txt').write('same', ensure=True)
+        command = ShellCommand(process, config)
+        command.command = 'echo ran >> ran.txt; mkdir -p dist; echo built > dist/app.txt; echo output'
+        command.inputs = ['input.txt']
+        command.outputs = ['dist/*']
+        plugin_config = PluginConfig('ShellCommand', {'command': command.command}, config.config)
+        results.append(ResultCache(config, StaticBuildContext(), cache).run('build', command, plugin_config, []))
+
+    assert results == [0, 0]
+    assert not tmpdir.join('second', 'ran.txt').exists()
+    assert tmpdir.join('second', 'dist', 'app.txt').read() == 'built\n'
+    assert capsys.readouterr().out == 'output\noutput\n'
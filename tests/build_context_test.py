@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import gc
+import json
+import multiprocessing
+import os
+
+from mb.build_context import _flush_live_contexts
+from mb.build_context import _live_contexts
+from mb.build_context import DefaultBuildContext
+from mb.build_context import SqliteBuildContext
+from mb.config.config import ConfigFile
+
+
+def _build_context(project_dir, build_context_class=DefaultBuildContext):
+    return build_context_class(ConfigFile(os.path.join(project_dir, '.mb.yml'), {'name': 'sample_config'}))
+
+
+def _read(build_context):
+    with open(build_context.build_context_file, 'r') as build_context_file:
+        return json.load(build_context_file)
+
+
+def test_writes_are_buffered_until_flush(tmpdir):
+    build_context = _build_context(str(tmpdir))
+    build_context.add_variables({'version': '1.0.0'})
+    build_context.add_variables({'hash': 'abc'})
+
+    assert build_context.variables == {'version': '1.0.0', 'hash': 'abc'}
+    assert not os.path.exists(build_context.build_context_file)
+
+    build_context.flush()
+    assert _read(build_context) == {'version': '1.0.0', 'hash': 'abc'}
+    assert not [name for name in os.listdir(os.path.dirname(build_context.build_context_file)) if name.endswith('.tmp')]
+
+
+def test_live_contexts_are_flushed_at_exit(tmpdir):
+    build_context = _build_context(str(tmpdir))
+    build_context.add_variables({'version': '1.0.0'})
+
+    _flush_live_contexts()
+    assert _read(build_context) == {'version': '1.0.0'}
+
+    # contexts nobody uses anymore aren't kept alive until the process exits
+    del build_context
+    gc.collect()
+    assert not [context for context in _live_contexts if context.config.project_dir == str(tmpdir)]
+
+
+def test_flush_merges_other_writers(tmpdir):
+    first = _build_context(str(tmpdir))
+    second = _build_context(str(tmpdir))
+    first.add_variables({'first': 1, 'shared': 'first'})
+    second.add_variables({'second': 2})
+    assert second.variables == {'second': 2}
+
+    first.flush()
+    # reads notice the file changed and keep the variables that weren't flushed yet
+    assert second.variables == {'first': 1, 'shared': 'first', 'second': 2}
+
+    second.add_variables({'shared': 'second'})
+    second.flush()
+    assert _read(first) == {'first': 1, 'second': 2, 'shared': 'second'}
+    assert first.variables == _read(first)
+
+
+def _add_variables(project_dir, worker, build_context_class=DefaultBuildContext):
+    build_context = _build_context(project_dir, build_context_class)
+    for index in range(20):
+        build_context.add_variables({'{0}-{1}'.format(worker, index): index})
+        build_context.flush()
+
+
+def test_parallel_processes_dont_lose_updates(tmpdir):
+    workers = [multiprocessing.Process(target=_add_variables, args=(str(tmpdir), worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(_build_context(str(tmpdir)).variables) == 4 * 20
+
+
+def test_sqlite_build_context(tmpdir):
+    build_context = _build_context(str(tmpdir), SqliteBuildContext)
+    build_context.add_variables({'version': '1.0.0', 'digest.api': 'sha256:1', 'digest.web': 'sha256:2'})
+    build_context.add_variables({'digest.api': 'sha256:3', 'shards': [1, 2]})
+
+    other = _build_context(str(tmpdir), SqliteBuildContext)
+    assert other.variables == {'version': '1.0.0', 'digest.api': 'sha256:3', 'digest.web': 'sha256:2', 'shards': [1, 2]}
+    assert other.variables_with_prefix('digest.') == {'digest.api': 'sha256:3', 'digest.web': 'sha256:2'}
+    assert other.variable('shards') == [1, 2]
+    assert other.variable('missing', 'default') == 'default'
+
+
+def test_sqlite_parallel_processes(tmpdir):
+    workers = [multiprocessing.Process(target=_add_variables, args=(str(tmpdir), worker, SqliteBuildContext))
+               for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(_build_context(str(tmpdir), SqliteBuildContext).variables) == 4 * 20
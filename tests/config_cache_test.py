@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import json
+import os
+
+import yaml
+
+from mb.config.cache import ParsedFileCache
+from mb.config.config import get_default_config_file
+
+
+class CountingParser(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return yaml.safe_load(text)
+
+
+def _setup(tmpdir):
+    config_file = tmpdir.join('.mb.yml')
+    config_file.write('name: sample_config\nvariables:\n    home: ${MB_TEST_HOME}\n')
+    return (str(config_file), ParsedFileCache(str(tmpdir.join('cache'))), CountingParser())
+
+
+def test_warm_load_skips_parsing(tmpdir):
+    config_file, cache, parse = _setup(tmpdir)
+    mappings = {'MB_TEST_HOME': '/home/mb'}
+
+    assert cache.load(config_file, parse, mappings)['variables']['home'] == '/home/mb'
+    assert cache.load(config_file, parse, mappings)['variables']['home'] == '/home/mb'
+    assert parse.calls == 1
+
+
+def test_touched_file_with_same_content_is_not_parsed(tmpdir):
+    config_file, cache, parse = _setup(tmpdir)
+
+    cache.load(config_file, parse)
+    os.utime(config_file, (0, 0))
+    cache.load(config_file, parse)
+    assert parse.calls == 1
+
+
+def test_changed_file_is_parsed(tmpdir):
+    config_file, cache, parse = _setup(tmpdir)
+
+    cache.load(config_file, parse)
+    tmpdir.join('.mb.yml').write('name: changed\n')
+    assert cache.load(config_file, parse)['name'] == 'changed'
+    assert parse.calls == 2
+
+
+def test_changed_environment_is_interpolated_again(tmpdir):
+    config_file, cache, parse = _setup(tmpdir)
+
+    cache.load(config_file, parse, {'MB_TEST_HOME': '/home/mb', 'UNRELATED': 'a'})
+    cache.load(config_file, parse, {'MB_TEST_HOME': '/home/mb', 'UNRELATED': 'b'})
+    assert parse.calls == 1
+    assert cache.load(config_file, parse, {'MB_TEST_HOME': '/home/other'})['variables']['home'] == '/home/other'
+    assert parse.calls == 2
+
+
+def test_entries_are_json(tmpdir):
+    config_file, cache, parse = _setup(tmpdir)
+
+    cache.load(config_file, parse)
+    entries = tmpdir.join('cache').listdir()
+    assert [entry.ext for entry in entries] == ['.json']
+    assert json.loads(entries[0].read())['data']['name'] == 'sample_config'
+
+
+def test_content_json_cant_represent_isnt_cached(tmpdir):
+    config_file, cache, parse = _setup(tmpdir)
+    tmpdir.join('.mb.yml').write('released: 2017-01-01\n')
+
+    assert cache.load(config_file, parse)['released'] == datetime.date(2017, 1, 1)
+    assert not tmpdir.join('cache').check()
+
+
+def test_config_with_its_own_artifact_dir_isnt_cached_in_the_default_one(tmpdir):
+    tmpdir.join('.mb.yml').write('name: sample_config\nconfig:\n    artifact_dir: out\n')
+
+    config = get_default_config_file(str(tmpdir), {})
+    assert config.artifact_dir == str(tmpdir.join('out'))
+    assert not tmpdir.join('.build').check()
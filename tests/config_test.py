@@ -1,10 +1,19 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import copy
 import os
+import pickle
 
+import pytest
+from jsonpath_rw import parse
+
+from mb.config.config import _find
+from mb.config.config import _get_values
 from mb.config.config import ConfigFile
 from mb.config.config import get_default_config_file
+from mb.config.config import jsonpath_cache_info
+from mb.config.errors import ConfigurationError
 # import pytest
 # from mb.config.errors import MasterBuilderFileNotFoundError
 
@@ -163,3 +172,76 @@ def test_commands():
 
     assert config.commands['default'].name == 'DemoCommand'
     assert config.commands['default'].config['sample_config'] == 'test'
+
+
+def test_dotted_paths_match_jsonpath():
+    config = {
+        'name': 'sample_config',
+        'config': {'commands': {'default': {'name': 'DemoCommand'}, 'empty': None}, 'list': [1, 2]},
+    }
+    for path in ['name', 'config.commands.default.name', 'config.commands.empty', 'config.list',
+                 'config.missing', 'name.missing', 'config.commands.default.name.missing']:
+        assert _find(config, path) == [match.value for match in parse(path).find(config)]
+
+
+def test_jsonpath_expressions_are_cached():
+    before = jsonpath_cache_info()
+    assert sorted(_get_values({'variables': {'a': 1, 'b': 2}}, 'variables.*')) == [1, 2]
+    assert sorted(_get_values({'variables': {'a': 3, 'b': 4}}, 'variables.*')) == [3, 4]
+    after = jsonpath_cache_info()
+    assert after.hits >= before.hits + 1
+    assert after.currsize <= after.maxsize
+
+
+def test_resolved_config():
+    config = ConfigFile(".gitignore", {
+        'name': 'sample_config',
+        'variables': {
+            'version': '1.0.@{{variables.patch}}',
+            'patch': '@{{config.patch}}',
+            'versions': ['@{{variables.version}}']
+        },
+        'config': {
+            'patch': 3
+        }
+    })
+
+    assert config.resolved['variables']['versions'] == ['1.0.3']
+    assert isinstance(config.resolved['variables']['versions'], list)
+    assert config.variables['version'] == '1.0.3'
+    with pytest.raises(TypeError):
+        config.variables['version'] = '2.0.0'
+    with pytest.raises(TypeError):
+        config.resolved['variables']['versions'].append('2.0.0')
+
+
+def test_resolved_config_copies():
+    config = ConfigFile(".gitignore", {'variables': {'versions': ['1.0.@{{variables.patch}}'], 'patch': '3'}})
+
+    for copied in (copy.deepcopy(config.variables), pickle.loads(pickle.dumps(config.variables))):
+        assert copied == {'versions': ['1.0.3'], 'patch': '3'}
+        assert type(copied) is dict and type(copied['versions']) is list
+        copied['versions'].append('2.0.0')
+    assert config.variables['versions'] == ['1.0.3']
+
+
+def test_resolver_lives_on_the_config():
+    config = ConfigFile(".gitignore", {'variables': {'version': '@{{variables.patch}}', 'patch': '3'}})
+
+    assert config.variables is config.variables
+    assert copy.deepcopy(config.config).resolver is None
+
+
+def test_reference_cycle():
+    config = ConfigFile(".gitignore", {
+        'name': 'sample_config',
+        'variables': {
+            'a': '@{{variables.b}}',
+            'b': '@{{variables.c}}',
+            'c': '@{{variables.a}}'
+        }
+    })
+
+    with pytest.raises(ConfigurationError) as err:
+        config.variables
+    assert '@{{variables.b}} -> @{{variables.c}} -> @{{variables.a}} -> @{{variables.b}}' in str(err.value)
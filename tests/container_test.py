@@ -0,0 +1,158 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import pytest
+
+from mb.config.config import PluginConfig
+from mb.lib.container import COMMAND
+from mb.lib.container import Container
+from mb.lib.container import DependencyCycleError
+from mb.lib.container import DependencyError
+from mb.lib.container import WiringPlan
+
+
+class Settings(object):
+    created = 0
+
+    def __init__(self, config):
+        Settings.created += 1
+        time.sleep(0.01)
+        self.config = config
+        self._level = 'info'
+
+    @property
+    def level(self):
+        return self._level
+
+    @level.setter
+    def level(self, value):
+        self._level = value
+
+    @property
+    def name(self):
+        return 'settings'
+
+
+class Workspace(object):
+    scope = COMMAND
+
+    def __init__(self, settings):
+        self.settings = settings
+
+
+class Task(object):
+    def __init__(self, workspace, settings, retries=3):
+        self.workspace = workspace
+        self.settings = settings
+        self.retries = retries
+
+
+class SubTask(Task):
+    pass
+
+
+class Chicken(object):
+    def __init__(self, egg):
+        pass
+
+
+class Egg(object):
+    def __init__(self, chicken):
+        pass
+
+
+_CLASSES = dict((klass.__name__, klass) for klass in (Settings, Workspace, Task, SubTask, Chicken, Egg))
+
+
+def _container():
+    container = Container(_CLASSES.__getitem__)
+    container.register_instance('config', {'name': 'sample_config'})
+    for name in ('settings', 'workspace', 'chicken', 'egg'):
+        container.register(name, lambda name=name: PluginConfig(name.capitalize(), {}, {}))
+    return container
+
+
+def test_wiring_plan():
+    plan = WiringPlan(SubTask)
+    assert plan.arguments == ['workspace', 'settings', 'retries']
+    assert plan.defaults == {'retries': 3}
+    assert plan.scope == 'singleton'
+
+    settings_plan = WiringPlan(Settings)
+    assert settings_plan.properties == set(['level'])
+    assert settings_plan.read_only_properties == set(['name'])
+    assert WiringPlan(Workspace).scope == COMMAND
+
+
+def test_singletons_are_shared():
+    container = _container()
+    settings = container.resolve('settings')
+
+    assert settings is container.resolve('settings')
+    assert settings.config == {'name': 'sample_config'}
+
+
+def test_command_scope():
+    container = _container()
+    build = container.command('build', PluginConfig('SubTask', {'retries': 5}, {}))
+    test = container.command('test', PluginConfig('Task', {}, {}))
+
+    assert build is container.command('build', PluginConfig('SubTask', {}, {}))
+    assert build.retries == 3
+    # one workspace per command, sharing the settings singleton
+    assert build.workspace is not test.workspace
+    assert build.workspace.settings is test.workspace.settings is build.settings
+
+
+def test_plugin_config_sets_properties():
+    container = _container()
+    container.register('settings', lambda: PluginConfig('Settings', {'level': 'debug', 'name': 'other'}, {}))
+
+    settings = container.resolve('settings')
+    assert settings.level == 'debug'
+    assert settings.name == 'settings'
+
+
+def test_provider_called_once():
+    calls = []
+    container = _container()
+    container.register('settings', lambda: calls.append(1) or PluginConfig('Settings', {}, {}))
+
+    container.resolve('settings')
+    container.resolve('settings')
+    assert calls == [1]
+
+
+def test_cycle_detection():
+    container = _container()
+    with pytest.raises(DependencyCycleError) as err:
+        container.resolve('chicken')
+    assert err.value.cycle == ['chicken', 'egg', 'chicken']
+
+    # the failed resolution doesn't leave anything behind
+    with pytest.raises(DependencyCycleError):
+        container.resolve('egg')
+
+
+def test_missing_dependency():
+    container = Container(_CLASSES.__getitem__)
+    with pytest.raises(DependencyError) as err:
+        container.resolve('settings')
+    assert err.value.name == 'settings'
+
+
+def test_concurrent_resolution_creates_one_singleton():
+    container = _container()
+    created = Settings.created
+    resolved = []
+    threads = [threading.Thread(target=lambda: resolved.append(container.resolve('settings'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert Settings.created == created + 1
+    assert len(set(id(settings) for settings in resolved)) == 1
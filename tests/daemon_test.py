@@ -0,0 +1,132 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import os
+import socket
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+from mb.cli.client import connect
+from mb.cli.client import send_message
+from mb.cli.client import socket_path
+from mb.cli.daemon import _receive
+from mb.cli.daemon import Daemon
+
+_package_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../'))
+_config = """
+name: sample_config
+config:
+    commands:
+        hello:
+            name: ShellCommand
+            config:
+                command: echo hello
+"""
+
+
+@pytest.fixture
+def project_dir(tmpdir):
+    tmpdir.join('.mb.yml').write(_config)
+    env = dict(os.environ, GIT_AUTHOR_NAME='mb', GIT_AUTHOR_EMAIL='mb@example.com',
+               GIT_COMMITTER_NAME='mb', GIT_COMMITTER_EMAIL='mb@example.com')
+    subprocess.check_call(['git', 'init', '-q'], cwd=str(tmpdir), env=env)
+    subprocess.check_call(['git', 'commit', '-q', '--allow-empty', '-m', 'first'], cwd=str(tmpdir), env=env)
+    return str(tmpdir)
+
+
+def _env():
+    env = dict(os.environ, PYTHONPATH=_package_dir)
+    env.pop('MB_NO_DAEMON', None)
+    return env
+
+
+def _mb(project_dir, *arguments):
+    return subprocess.run([sys.executable, '-m', 'mb.cli.client'] + list(arguments), cwd=project_dir, env=_env(),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+
+
+def _status(project_dir):
+    result = _mb(project_dir, 'daemon', 'status')
+    return json.loads(result.stdout) if result.returncode == 0 else None
+
+
+def _wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(0.1)
+    raise AssertionError('Timed out')
+
+
+def test_socket_path(tmpdir):
+    tmpdir.join('.mb.yml').write('name: sample_config\n')
+    subdir = tmpdir.mkdir('src').mkdir('module')
+
+    assert socket_path(str(subdir)) == os.path.join(str(tmpdir), '.build', 'mb.sock')
+
+
+def test_request_carries_file_descriptors(tmpdir):
+    output = tmpdir.join('output.txt')
+    client, server = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with open(str(output), 'w') as output_file:
+        send_message(client, {'argv': ['build'], 'env': {'A': 'x' * 100000}}, [output_file.fileno()])
+
+    request, fds = _receive(server)
+    assert request['argv'] == ['build']
+    assert len(request['env']['A']) == 100000
+    assert len(fds) == 1
+
+    os.write(fds[0], b'from the daemon')
+    os.close(fds[0])
+    assert output.read() == 'from the daemon'
+    client.close()
+    server.close()
+
+
+def test_bind_error(tmpdir):
+    daemon = Daemon.__new__(Daemon)
+    daemon.socket_path = os.path.join(str(tmpdir), 'a' * 200, 'mb.sock')
+    daemon._listener = None
+
+    with pytest.raises(RuntimeError) as err:
+        daemon._bind()
+    assert 'Unable to listen on' in str(err.value)
+
+
+def test_daemon(project_dir):
+    path = socket_path(project_dir)
+    daemon = subprocess.Popen([sys.executable, '-m', 'mb.cli.daemon', 'start'], cwd=project_dir, env=_env(),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        status = _wait_for(lambda: connect(path) and _status(project_dir))
+        assert status['pid'] == daemon.pid
+        assert status['requests'] == 0
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+        result = _mb(project_dir, 'hello')
+        assert result.returncode == 0
+        assert 'hello' in result.stdout
+        assert _status(project_dir)['requests'] == 1
+
+        # the daemon restarts itself with the changed config
+        with open(os.path.join(project_dir, '.mb.yml'), 'a') as config_file:
+            config_file.write('        bye:\n            name: ShellCommand\n            config:\n                command: echo bye\n')
+        _wait_for(lambda: (_status(project_dir) or {}).get('requests') == 0)
+        result = _mb(project_dir, 'bye')
+        assert 'bye' in result.stdout
+        assert _status(project_dir)['pid'] == daemon.pid
+
+        assert _mb(project_dir, 'daemon', 'stop').returncode == 0
+        assert daemon.wait(timeout=30) == 0
+        assert not os.path.exists(path)
+    finally:
+        if daemon.poll() is None:
+            daemon.kill()
+            daemon.wait()
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import re
+
+from mb.lib import fingerprint
+from mb.lib.fingerprint import Fingerprinter
+from mb.lib.fingerprint import glob_to_regex
+from mb.lib.fingerprint import IgnoreRules
+
+
+def _age(tmpdir):
+    # files written just now aren't trusted from the stat cache
+    past = 1500000000
+    for (root, _, files) in os.walk(str(tmpdir)):
+        for name in files:
+            os.utime(os.path.join(root, name), (past, past))
+
+
+def _project(tmpdir):
+    tmpdir.join('src', 'app.py').write('app', ensure=True)
+    tmpdir.join('src', 'pkg', 'util.py').write('util', ensure=True)
+    tmpdir.join('src', 'pkg', 'notes.txt').write('notes', ensure=True)
+    tmpdir.join('README.md').write('readme')
+    tmpdir.join('.git', 'HEAD').write('ref: refs/heads/master', ensure=True)
+    _age(tmpdir)
+    return _fingerprinter(tmpdir)
+
+
+def _fingerprinter(tmpdir):
+    return Fingerprinter(str(tmpdir), str(tmpdir.join('.build', 'cache', 'fingerprints')), [str(tmpdir.join('.build'))])
+
+
+def test_glob_to_regex():
+    def matches(pattern, path):
+        return re.match('^' + glob_to_regex(pattern) + '$', path) is not None
+
+    assert matches('src/**/*.py', 'src/app.py')
+    assert matches('src/**/*.py', 'src/pkg/util.py')
+    assert not matches('src/*.py', 'src/pkg/util.py')
+    assert matches('file?.[ch]', 'file1.c')
+    assert not matches('file?.[!ch]', 'file1.c')
+    assert matches('logs/**', 'logs/a/b.log')
+
+
+def test_ignore_rules():
+    rules = IgnoreRules()
+    rules.add('', ['# comment', '*.log', '!keep.log', 'build/', '/root-only.txt'])
+    rules.add('docs', ['*.html'])
+
+    assert rules.is_ignored('debug.log')
+    assert rules.is_ignored('src/debug.log')
+    assert not rules.is_ignored('src/keep.log')
+    assert rules.is_ignored('build', is_dir=True)
+    assert not rules.is_ignored('build')
+    assert rules.is_ignored('root-only.txt')
+    assert not rules.is_ignored('src/root-only.txt')
+    assert rules.is_ignored('docs/index.html')
+    assert not rules.is_ignored('index.html')
+
+
+def test_hashes_match_globs(tmpdir):
+    fingerprints = _project(tmpdir)
+
+    hashes = fingerprints.hashes(['src/**/*.py', 'README.md', 'missing.txt'])
+    assert sorted(hashes) == ['README.md', 'src/app.py', 'src/pkg/util.py']
+    assert hashes['src/app.py'] == fingerprint.hash_file(str(tmpdir.join('src', 'app.py')))
+
+
+def test_unchanged_files_are_not_read_again(tmpdir, monkeypatch):
+    fingerprints = _project(tmpdir)
+    first = fingerprints.hashes(['src/**/*'])
+
+    read = []
+    original = fingerprint.hash_file
+    monkeypatch.setattr(fingerprint, 'hash_file', lambda path: read.append(path) or original(path))
+    tmpdir.join('src', 'app.py').write('changed')
+    _age(tmpdir.join('src'))
+
+    # a new process reads the persisted stat cache
+    fingerprints = _fingerprinter(tmpdir)
+    second = fingerprints.hashes(['src/**/*'])
+    assert read == [str(tmpdir.join('src', 'app.py'))]
+    assert second['src/app.py'] != first['src/app.py']
+    assert second['src/pkg/util.py'] == first['src/pkg/util.py']
+
+
+def test_recently_modified_files_are_hashed_again(tmpdir, monkeypatch):
+    fingerprints = _project(tmpdir)
+    tmpdir.join('README.md').write('fresh')
+    fingerprints.hashes(['README.md'])
+
+    read = []
+    monkeypatch.setattr(fingerprint, 'hash_file', lambda path: read.append(path) or 'hash')
+    fingerprints.hashes(['README.md'])
+    assert read == [str(tmpdir.join('README.md'))]
+
+
+def test_scan_respects_ignore_files(tmpdir):
+    fingerprints = _project(tmpdir)
+    tmpdir.join('.gitignore').write('*.txt\n')
+    tmpdir.join('src', '.mbignore').write('pkg/\n')
+    tmpdir.join('.build', 'output.bin').write('artifact', ensure=True)
+
+    assert sorted(fingerprints.scan()) == ['.gitignore', 'README.md', 'src/.mbignore', 'src/app.py']
+
+
+def test_changes_since_last_run(tmpdir):
+    fingerprints = _project(tmpdir)
+
+    first = fingerprints.changes('build', ['src/**/*.py', 'README.md'])
+    assert first.added == ['README.md', 'src/app.py', 'src/pkg/util.py']
+    assert not fingerprints.changes('build', ['src/**/*.py', 'README.md'])
+
+    tmpdir.join('src', 'app.py').write('changed')
+    tmpdir.join('src', 'pkg', 'util.py').remove()
+    tmpdir.join('src', 'new.py').write('new')
+    changes = fingerprints.changes('build', ['src/**/*.py', 'README.md'])
+    assert (changes.added, changes.modified, changes.removed) == (['src/new.py'], ['src/app.py'], ['src/pkg/util.py'])
+    assert changes.paths == ['src/app.py', 'src/new.py', 'src/pkg/util.py']
+    # every caller has its own snapshot
+    assert len(fingerprints.changes('test', ['README.md']).added) == 1
@@ -0,0 +1,155 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import subprocess
+
+import pytest
+
+from mb.config.config import get_default_config_file
+from mb.lib import git_refs
+from mb.lib.git_objects import ObjectStore
+from mb.version_scheme import DefaultVersionScheme
+from mb.version_scheme import GitReaderVersionScheme
+
+_PATTERN = '*[^a-z].*[^a-z].*[^a-z]'
+
+
+def _git(repo_dir, *arguments):
+    env = dict(os.environ, GIT_AUTHOR_NAME='mb', GIT_AUTHOR_EMAIL='mb@example.com',
+               GIT_COMMITTER_NAME='mb', GIT_COMMITTER_EMAIL='mb@example.com')
+    return subprocess.check_output(('git',) + arguments, cwd=repo_dir, env=env).decode('utf-8').strip()
+
+
+def _commit(repo_dir, message, content=None, date=None):
+    if content is not None:
+        with open(os.path.join(repo_dir, 'file.txt'), 'w') as fh:
+            fh.write(content)
+        _git(repo_dir, 'add', 'file.txt')
+    arguments = ['commit', '-q', '--allow-empty', '-m', message]
+    if date is not None:
+        arguments += ['--date', date]
+    os.environ['GIT_COMMITTER_DATE'] = date or ''
+    try:
+        _git(repo_dir, *arguments)
+    finally:
+        del os.environ['GIT_COMMITTER_DATE']
+
+
+@pytest.fixture
+def repo_dir(tmpdir):
+    repo_dir = str(tmpdir.join('repo'))
+    os.makedirs(repo_dir)
+    _git(repo_dir, 'init', '-q')
+    with open(os.path.join(repo_dir, '.mb.yml'), 'w') as config_file:
+        config_file.write('variables: {}\n')
+    _git(repo_dir, 'add', '.mb.yml')
+
+    # a file growing over many commits gives the packs some deltas to resolve
+    lines = []
+    for index in range(30):
+        lines.append('line {0} '.format(index) * 20)
+        _commit(repo_dir, 'commit {0}'.format(index), '\n'.join(lines), '2020-01-01T00:{0:02d}:00'.format(index))
+        if index in (5, 12):
+            _git(repo_dir, 'tag', '-a', '1.0.{0}'.format(index), '-m', 'release')
+    _git(repo_dir, 'tag', 'lightweight-9.9.9')
+    return repo_dir
+
+
+def _raw_objects(repo_dir):
+    listing = _git(repo_dir, 'cat-file', '--batch-all-objects', '--batch-check')
+    for line in listing.splitlines():
+        sha, kind, _ = line.split()
+        content = subprocess.check_output(['git', 'cat-file', kind, sha], cwd=repo_dir)
+        yield sha, kind, content
+
+
+@pytest.mark.parametrize('pack', [False, True])
+def test_reads_every_object(repo_dir, pack):
+    if pack:
+        _git(repo_dir, 'gc', '-q', '--aggressive', '--prune=now')
+        assert not os.path.isdir(os.path.join(repo_dir, '.git', 'objects', '0a'))
+
+    store = ObjectStore(os.path.join(repo_dir, '.git'))
+    try:
+        for (sha, kind, content) in _raw_objects(repo_dir):
+            assert store.read(sha) == (kind, content)
+    finally:
+        store.close()
+
+
+def _versions(repo_dir):
+    config = get_default_config_file(repo_dir, os.environ)
+    results = []
+    for scheme_class in (DefaultVersionScheme, GitReaderVersionScheme):
+        version_scheme = scheme_class(config)
+        version_scheme.increment = 'patch'
+        results.append((version_scheme._describe(_PATTERN), version_scheme._generate()))
+    return results
+
+
+@pytest.mark.parametrize('pack', [False, True])
+def test_same_version_as_git(repo_dir, pack):
+    if pack:
+        _git(repo_dir, 'gc', '-q', '--prune=now')
+
+    default, reader = _versions(repo_dir)
+    assert reader == default
+    assert reader[0] == _git(repo_dir, 'describe', '--match', _PATTERN)
+    assert reader[1]['version'] == '1.0.13'
+
+    # a tag on HEAD itself, the newest one wins
+    _git(repo_dir, 'tag', '-a', '2.0.0', '-m', 'release')
+    _git(repo_dir, 'tag', '-a', '2.0.1', '-m', 'release')
+    default, reader = _versions(repo_dir)
+    assert reader == default
+    assert reader[0] == _git(repo_dir, 'describe', '--match', _PATTERN)
+
+
+def test_merge_history(repo_dir):
+    _git(repo_dir, 'checkout', '-q', '-b', 'feature', 'HEAD~3')
+    _commit(repo_dir, 'feature work', date='2020-01-02T00:00:00')
+    _git(repo_dir, 'tag', '-a', '1.1.0', '-m', 'release')
+    _git(repo_dir, 'checkout', '-q', 'master')
+    _git(repo_dir, 'merge', '-q', '--no-ff', '-m', 'merge', 'feature')
+
+    default, reader = _versions(repo_dir)
+    assert reader == default
+    assert reader[0] == _git(repo_dir, 'describe', '--match', _PATTERN)
+
+
+def test_worktree(repo_dir, tmpdir):
+    worktree = str(tmpdir.join('worktree'))
+    _git(repo_dir, 'worktree', 'add', '-q', worktree, 'HEAD~20')
+    git_dir = git_refs.find_git_dir(worktree)
+    assert git_dir.common_dir == os.path.join(repo_dir, '.git')
+    assert git_refs.head_sha(git_dir) == _git(repo_dir, 'rev-parse', 'HEAD~20')
+
+    version_scheme = GitReaderVersionScheme(get_default_config_file(worktree, os.environ))
+    assert version_scheme._describe(_PATTERN) == _git(worktree, 'describe', '--match', _PATTERN)
+
+
+def test_nearest_tag_in_merged_history(tmpdir):
+    repo_dir = str(tmpdir)
+    _git(repo_dir, 'init', '-q')
+    with open(os.path.join(repo_dir, '.mb.yml'), 'w') as config_file:
+        config_file.write('variables: {}\n')
+    _git(repo_dir, 'add', '.mb.yml')
+    _commit(repo_dir, 'root', date='2020-01-01T00:00:00')
+    _git(repo_dir, 'branch', 'side')
+    for index in range(6):
+        _commit(repo_dir, 'main {0}'.format(index), date='2020-01-01T01:0{0}:00'.format(index))
+    _git(repo_dir, 'tag', '-a', '1.0.2', '-m', 'release')
+
+    # the tag of the side branch is met first walking newest first, but it is further from HEAD
+    _git(repo_dir, 'checkout', '-q', 'side')
+    _commit(repo_dir, 'side', date='2020-02-01T00:00:00')
+    _git(repo_dir, 'tag', '-a', '1.0.1', '-m', 'release')
+    _git(repo_dir, 'checkout', '-q', '-')
+    _git(repo_dir, 'merge', '-q', '--no-ff', '-m', 'merge', 'side')
+
+    default, reader = _versions(repo_dir)
+    assert reader == default
+    assert reader[0] == _git(repo_dir, 'describe', '--match', _PATTERN)
+    assert reader[0].startswith('1.0.2-2-g')
+    assert reader[1]['version'] == '1.0.3'
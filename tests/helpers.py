@@ -0,0 +1,17 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+
+class StaticBuildContext(object):
+    """
+    A build context keeping its variables in memory, shared by the tests
+    """
+
+    def __init__(self, variables=None):
+        self.variables = {'version': '1.0.0'} if variables is None else variables
+
+    def add_variables(self, variables):
+        self.variables.update(variables)
+
+    def flush(self):
+        pass
@@ -0,0 +1,20 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from mb.cli.main import _parse_global_arguments
+
+
+def test_parse_global_arguments():
+    (global_args, arguments) = _parse_global_arguments(['--jobs', '4', '--trace', 'build', '--verbose'])
+    assert global_args.jobs == 4
+    assert global_args.trace
+    assert not global_args.profile
+    assert arguments == ['build', '--verbose']
+
+
+def test_parse_global_arguments_after_subcommand():
+    # options after the subcommand are the subcommand's own
+    (global_args, arguments) = _parse_global_arguments(['--verbose', 'build', '--jobs', '2', '--trace'])
+    assert global_args.jobs == 1
+    assert not global_args.trace
+    assert arguments == ['--verbose', 'build', '--jobs', '2', '--trace']
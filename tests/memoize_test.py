@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import time
+
+from mb.lib.memoize import CacheInfo
 from mb.lib.memoize import memoize
 
 
@@ -33,3 +36,60 @@ def test_ArgumentsPassedToUseForCache_UsesArgumentsForCache():
     someClass = SomeClass()
     assert someClass.TestCache2(5, number2=10) == 10
     assert someClass.TestCache2(5, number2=10) == 10
+
+
+def test_MaxSize_EvictsLeastRecentlyUsed():
+    calls = []
+
+    @memoize(maxsize=2)
+    def square(number):
+        calls.append(number)
+        return number * number
+
+    square(1)
+    square(2)
+    square(1)
+    square(3)
+    square(1)
+    square(2)
+    assert calls == [1, 2, 3, 2]
+    assert square.cache_info() == CacheInfo(hits=2, misses=4, maxsize=2, currsize=2)
+
+
+def test_Ttl_ExpiresResults():
+    calls = []
+
+    @memoize(ttl=0.05)
+    def square(number):
+        calls.append(number)
+        return number * number
+
+    square(2)
+    square(2)
+    time.sleep(0.1)
+    square(2)
+    assert calls == [2, 2]
+
+
+def test_FileArgs_InvalidateWhenFileChanges(tmpdir):
+    data_file = tmpdir.join('data.txt')
+    data_file.write('first')
+
+    @memoize("filename", file_args=("filename",))
+    def load(filename, mappings=None):
+        with open(filename) as fh:
+            return fh.read()
+
+    assert load(str(data_file)) == 'first'
+    data_file.write('second!')
+    assert load(str(data_file)) == 'second!'
+    assert load(filename=str(data_file)) == 'second!'
+
+
+def test_CacheClear():
+    SomeClass.TestCache1.cache_clear()
+    someClass = SomeClass()
+    someClass.TestCache1(5)
+    assert SomeClass.TestCache1.cache_info().currsize == 1
+    SomeClass.TestCache1.cache_clear()
+    assert SomeClass.TestCache1.cache_info() == CacheInfo(hits=0, misses=0, maxsize=None, currsize=0)
@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+
+from mb import build_context
+from mb import command
+from mb.lib.plugin_index import PluginIndex
+
+_plugin_types = [build_context.BuildContext, command.Command]
+_plugin_source = """
+from mb.command import Command
+
+
+class {0}(Command):
+    def _run(self, parsed_args, unknown_args, original_arguments):
+        pass
+"""
+
+
+def _index(tmpdir):
+    return PluginIndex(str(tmpdir.join('plugins')), str(tmpdir.join('index.json')), _plugin_types)
+
+
+def test_index_plugins(tmpdir):
+    tmpdir.mkdir('plugins').join('lint.py').write(_plugin_source.format('LintCommand'))
+    index = _index(tmpdir)
+    index.refresh()
+
+    assert index.plugins == {'LintCommand': 'lint.py'}
+    assert index.plugins_of_type(command.Command) == ['LintCommand']
+    assert index.plugins_of_type(build_context.BuildContext) == []
+    assert os.path.isfile(str(tmpdir.join('index.json')))
+
+
+def test_unchanged_files_are_not_imported(tmpdir):
+    tmpdir.mkdir('plugins').join('lint.py').write(_plugin_source.format('LintCommand'))
+    _index(tmpdir).refresh()
+
+    index = _index(tmpdir)
+    index.refresh()
+    assert index.modules == {}
+    assert index.plugins == {'LintCommand': 'lint.py'}
+    assert index.load_module('lint.py').LintCommand.__name__ == 'LintCommand'
+
+
+def test_changed_files_are_reindexed(tmpdir):
+    plugin_file = tmpdir.mkdir('plugins').join('lint.py')
+    plugin_file.write(_plugin_source.format('LintCommand'))
+    _index(tmpdir).refresh()
+
+    plugin_file.write(_plugin_source.format('StyleCommand') + '\n')
+    index = _index(tmpdir)
+    index.refresh()
+    assert index.plugins == {'StyleCommand': 'lint.py'}
+
+
+def test_imported_plugins_are_not_indexed(tmpdir):
+    tmpdir.mkdir('plugins').join('lint.py').write('from mb.command import ShellCommand  # NOQA\n' +
+                                                  _plugin_source.format('LintCommand'))
+    index = _index(tmpdir)
+    index.refresh()
+
+    assert index.plugins == {'LintCommand': 'lint.py'}
@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import time
+
+import pytest
+
+from mb.lib import process
+
+
+def test_stream_lines_and_log_file(tmpdir):
+    log_file = os.path.join(str(tmpdir), 'logs', 'echo.log')
+    lines = []
+    exit_code = process.stream('echo one; echo two 1>&2; echo three', str(tmpdir), lines.append, log_file)
+
+    assert exit_code == 0
+    assert lines == [b'one\n', b'two\n', b'three\n']
+    with open(log_file, 'rb') as log:
+        assert log.read() == b'one\ntwo\nthree\n'
+
+
+def test_stream_failure_keeps_tail(tmpdir):
+    streamed = process.StreamedProcess('for i in $(seq 1 1000); do echo line $i; done; exit 3', str(tmpdir),
+                                       tail_size=100)
+    assert len(list(streamed)) == 1000
+    assert streamed.exit_code == 3
+    assert streamed.tail.endswith('line 1000\n')
+    assert len(streamed.tail) == 100
+
+    with pytest.raises(process.Error) as err:
+        process.stream('echo failed; exit 3', str(tmpdir))
+    assert err.value.exitCode == 3
+    assert err.value.message == 'failed\n'
+
+    assert process.stream('exit 3', str(tmpdir), throw_on_failure=False) == 3
+
+
+def test_timeout_kills_process_group(tmpdir):
+    start = time.time()
+    with pytest.raises(process.Timeout) as err:
+        process.stream('echo started; sleep 30 & sleep 30', str(tmpdir), timeout=0.5)
+    assert err.value.message == 'started\n'
+
+    with pytest.raises(process.Timeout):
+        process.execute('sleep 30', str(tmpdir), True, timeout=0.5)
+
+    assert time.time() - start < 10
+
+
+def test_execute_all_prefixes_output(tmpdir):
+    lines = []
+    exit_codes = process.execute_all([('a', 'echo one'), ('b', 'echo two; exit 2')], str(tmpdir),
+                                     on_output=lines.append, throw_on_failure=False)
+
+    assert exit_codes == [0, 2]
+    assert sorted(lines) == [b'[a] one\n', b'[b] two\n']
+
+
+@pytest.fixture
+def concurrency():
+    def set_concurrency(jobs):
+        process.set_concurrency(jobs)
+    yield set_concurrency
+    process.set_concurrency(os.cpu_count() or 1)
+
+
+def test_execute_all_cancels_on_failure(tmpdir, concurrency):
+    concurrency(2)
+    start = time.time()
+    with pytest.raises(process.Error) as err:
+        process.execute_all([('slow', 'sleep 30'), ('fails', 'sleep 0.2; echo broken; exit 4')], str(tmpdir),
+                            on_output=lambda line: None)
+
+    assert err.value.exitCode == 4
+    assert err.value.message == 'broken\n'
+    assert time.time() - start < 10
+
+
+def test_execute_all_concurrency_limit(tmpdir, concurrency):
+    concurrency(2)
+    events = []
+    process.execute_all([(str(index), 'echo start; sleep 0.3; echo end') for index in range(4)], str(tmpdir),
+                        on_output=events.append)
+
+    running = []
+    for event in events:
+        running.append((running[-1] if running else 0) + (1 if event.endswith(b'start\n') else -1))
+    assert len(events) == 8
+    assert max(running) == 2
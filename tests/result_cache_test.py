@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import subprocess
+
+from mb.command import Command
+from mb.command import MBPreRunCommand
+from mb.command import ShellCommand
+from mb.config.config import ConfigFile
+from mb.config.config import PluginConfig
+from mb.lib import process
+from mb.lib.result_cache import ResultCache
+from mb.version_scheme import DefaultVersionScheme
+from tests.helpers import StaticBuildContext
+
+
+class VersionCommand(Command):
+    def __init__(self, build_context, return_value=None):
+        super(VersionCommand, self).__init__(add_arg_help=False)
+        self._build_context = build_context
+        self.return_value = return_value
+        self.runs = 0
+
+    def _run(self, parsed_args, unknown_args, original_arguments):
+        self.runs += 1
+        self._build_context.add_variables({'version': '1.0.{0}'.format(self.runs), 'build': 'x'})
+        return self.return_value
+
+
+class StatelessCommand(VersionCommand):
+    @property
+    def cache_state(self):
+        return None
+
+
+class NoTemplates(object):
+    def generate_files(self):
+        pass
+
+
+def _commit(repo_dir, message):
+    env = dict(os.environ, GIT_AUTHOR_NAME='mb', GIT_AUTHOR_EMAIL='mb@example.com',
+               GIT_COMMITTER_NAME='mb', GIT_COMMITTER_EMAIL='mb@example.com')
+    subprocess.check_output(('git', 'commit', '-q', '--allow-empty', '-m', message), cwd=repo_dir, env=env)
+    return subprocess.check_output(('git', 'rev-parse', 'HEAD'), cwd=repo_dir).decode('utf-8').strip()
+
+
+def _setup(tmpdir):
+    config = ConfigFile(os.path.join(str(tmpdir), '.mb.yml'), {'name': 'sample_config'})
+    tmpdir.join('input.txt').write('first')
+    command = ShellCommand(process, config)
+    command.command = 'echo ran >> ran.txt; echo output'
+    command.cache = True
+    command.inputs = ['input*']
+    plugin_config = PluginConfig('ShellCommand', {'command': command.command}, config.config)
+    return ResultCache(config, StaticBuildContext()), command, plugin_config
+
+
+def test_unchanged_inputs_replay_result(tmpdir, capsys):
+    cache, command, plugin_config = _setup(tmpdir)
+
+    assert cache.run('build', command, plugin_config, []) == 0
+    assert cache.run('build', command, plugin_config, []) == 0
+    assert tmpdir.join('ran.txt').read() == 'ran\n'
+    assert capsys.readouterr().out == 'output\noutput\n'
+
+
+def test_changed_inputs_rerun_command(tmpdir):
+    cache, command, plugin_config = _setup(tmpdir)
+
+    cache.run('build', command, plugin_config, [])
+    tmpdir.join('input.txt').write('second')
+    cache.run('build', command, plugin_config, [])
+    assert tmpdir.join('ran.txt').read() == 'ran\nran\n'
+
+
+def test_key_includes_variables(tmpdir):
+    cache, command, plugin_config = _setup(tmpdir)
+
+    key = cache.key('build', command, plugin_config, [])
+    cache._build_context.variables['version'] = '1.0.1'
+    assert cache.key('build', command, plugin_config, []) != key
+
+
+def test_key_excludes_variables_written_by_the_command(tmpdir):
+    cache, _, plugin_config = _setup(tmpdir)
+    command = VersionCommand(cache._build_context)
+
+    cache.run('_prerun', command, plugin_config, [])
+    cache._build_context.variables['version'] = '1.0.5'
+    cache.run('_prerun', command, plugin_config, [])
+    assert command.runs == 1
+
+
+def test_unserializable_return_value_isnt_cached(tmpdir):
+    cache, _, plugin_config = _setup(tmpdir)
+    command = VersionCommand(cache._build_context, object())
+
+    cache.run('_prerun', command, plugin_config, [])
+    cache.run('_prerun', command, plugin_config, [])
+    assert command.runs == 2
+
+
+def test_prerun_reruns_when_head_moves(tmpdir):
+    cache, _, _ = _setup(tmpdir)
+    subprocess.check_output(('git', 'init', '-q'), cwd=str(tmpdir))
+    config = ConfigFile(os.path.join(str(tmpdir), '.mb.yml'), {'name': 'sample_config'})
+    plugin_config = PluginConfig('MBPreRunCommand', {'cache': True}, config.config)
+    version_scheme = DefaultVersionScheme(config)
+    version_scheme.version = '1.0'
+
+    for message in ('a', 'b', 'c'):
+        head = _commit(str(tmpdir), message)
+        command = MBPreRunCommand(NoTemplates(), version_scheme, cache._build_context)
+        assert cache.run('_prerun', command, plugin_config, [])['hash'] == head
+        assert cache._build_context.variables['hash'] == head
+
+    command = MBPreRunCommand(NoTemplates(), version_scheme, cache._build_context)
+    cache._build_context.variables.clear()
+    assert cache.run('_prerun', command, plugin_config, [])['hash'] == head
+    assert cache._build_context.variables['short_hash'] == head[:7]
+
+
+def test_unknown_state_isnt_cached(tmpdir):
+    cache, _, plugin_config = _setup(tmpdir)
+    command = StatelessCommand(cache._build_context)
+
+    cache.run('_prerun', command, plugin_config, [])
+    cache.run('_prerun', command, plugin_config, [])
+    assert command.runs == 2
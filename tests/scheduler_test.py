@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import pytest
+
+from mb.lib.scheduler import build_graph
+from mb.lib.scheduler import CycleError
+from mb.lib.scheduler import Scheduler
+
+_dependencies = {
+    'default': ['_prerun', 'package'],
+    'package': ['_prerun', 'lint', 'test'],
+    'lint': ['_prerun'],
+    'test': ['_prerun'],
+    '_prerun': ['_prerun'],
+}
+
+
+def test_build_graph():
+    graph = build_graph('default', lambda name: _dependencies[name])
+    assert set(graph.nodes) == set(_dependencies.keys())
+    assert graph.dependencies('_prerun') == []
+    assert graph.serial_order('default') == ['_prerun', 'lint', 'test', 'package', 'default']
+
+
+def test_build_graph_cycle():
+    dependencies = {'a': ['b'], 'b': ['c'], 'c': ['a']}
+    with pytest.raises(CycleError) as err:
+        build_graph('a', lambda name: dependencies[name])
+    assert err.value.cycle == ['a', 'b', 'c', 'a']
+
+
+def test_serial_run_keeps_order():
+    ran = []
+    graph = build_graph('default', lambda name: _dependencies[name])
+    Scheduler(graph, 'default', ran.append).run()
+    assert ran == ['_prerun', 'lint', 'test', 'package', 'default']
+
+
+def test_parallel_run_overlaps_independent_commands():
+    barrier = threading.Barrier(2, timeout=5)
+    ran = []
+
+    def run(name):
+        if name in ('lint', 'test'):
+            barrier.wait()
+        ran.append(name)
+
+    graph = build_graph('default', lambda name: _dependencies[name])
+    Scheduler(graph, 'default', run, jobs=2).run()
+    assert ran[0] == '_prerun'
+    assert ran[-2:] == ['package', 'default']
+
+
+def test_fail_fast():
+    ran = []
+
+    def run(name):
+        if name == 'lint':
+            raise ValueError('lint failed')
+        time.sleep(0.05)
+        ran.append(name)
+
+    graph = build_graph('default', lambda name: _dependencies[name])
+    with pytest.raises(ValueError):
+        Scheduler(graph, 'default', run, jobs=2).run()
+    assert 'package' not in ran
+    assert 'default' not in ran
+
+
+def test_critical_path():
+    durations = {'_prerun': 0.01, 'lint': 0.01, 'test': 0.1, 'package': 0.01, 'default': 0.01}
+    graph = build_graph('default', lambda name: _dependencies[name])
+    scheduler = Scheduler(graph, 'default', lambda name: time.sleep(durations[name]), jobs=2)
+    scheduler.run()
+    path, total = scheduler.critical_path()
+    assert path == ['_prerun', 'test', 'package', 'default']
+    assert total >= 0.13
+
+
+def test_subgraph_of_dependents():
+    graph = build_graph('default', lambda name: _dependencies[name])
+    affected = graph.all_dependents(['lint'])
+    assert affected == {'lint', 'package', 'default'}
+
+    subgraph = graph.subgraph(affected)
+    assert subgraph.dependencies('package') == ['lint']
+    assert subgraph.serial_order() == ['lint', 'package', 'default']
+
+    ran = []
+    Scheduler(subgraph, None, ran.append).run()
+    assert ran == ['lint', 'package', 'default']
@@ -0,0 +1,151 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+from string import Template
+
+import pytest
+
+from mb.config.config import ConfigFile
+from mb.template_engine import CompiledTemplate
+from mb.template_engine import DefaultTemplateEngine
+from mb.template_engine import safe_chunks
+from mb.template_engine import TemplateError
+from tests.helpers import StaticBuildContext
+
+
+def _engine(tmpdir, variables, incremental=True):
+    config = ConfigFile(os.path.join(str(tmpdir), '.mb.yml'), {'name': 'sample_config'})
+    engine = DefaultTemplateEngine(StaticBuildContext(variables), config)
+    engine.incremental = incremental
+    return engine
+
+
+def _write_templates(tmpdir):
+    templates = tmpdir.mkdir('build_templates')
+    templates.join('version.txt').write('# build-template|out/version.txt\nversion=${version}\n')
+    templates.join('README').write('not a template\n')
+
+
+def test_generate_files(tmpdir):
+    _write_templates(tmpdir)
+    _engine(tmpdir, {'version': '1.0.0'}, incremental=False).generate_files()
+
+    assert tmpdir.join('out', 'version.txt').read() == '# build-template|out/version.txt\nversion=1.0.0\n'
+    assert not tmpdir.join('README').exists()
+
+
+def test_incremental_skips_unchanged_templates(tmpdir):
+    _write_templates(tmpdir)
+    _engine(tmpdir, {'version': '1.0.0'}).generate_files()
+    output = tmpdir.join('out', 'version.txt')
+    os.utime(str(output), (0, 0))
+
+    _engine(tmpdir, {'version': '1.0.0', 'unused': 'changed'}).generate_files()
+    assert output.mtime() == 0
+
+
+def test_incremental_rerenders_changed_variables(tmpdir):
+    _write_templates(tmpdir)
+    _engine(tmpdir, {'version': '1.0.0'}).generate_files()
+    _engine(tmpdir, {'version': '1.0.1'}).generate_files()
+
+    assert tmpdir.join('out', 'version.txt').read() == '# build-template|out/version.txt\nversion=1.0.1\n'
+
+
+def test_incremental_restores_modified_output(tmpdir):
+    _write_templates(tmpdir)
+    _engine(tmpdir, {'version': '1.0.0'}).generate_files()
+    tmpdir.join('out', 'version.txt').write('edited')
+    _engine(tmpdir, {'version': '1.0.0'}).generate_files()
+
+    assert tmpdir.join('out', 'version.txt').read() == '# build-template|out/version.txt\nversion=1.0.0\n'
+
+
+def test_parallel_generate_files(tmpdir):
+    templates = tmpdir.mkdir('build_templates')
+    for index in range(50):
+        templates.join('file{0}.txt'.format(index)).write(
+            '# build-template|out/{0}/file{1}.txt\n${{version}}\n'.format(index % 5, index))
+    engine = _engine(tmpdir, {'version': '1.0.0'})
+    engine.workers = 8
+    engine.generate_files()
+
+    for index in range(50):
+        assert tmpdir.join('out', str(index % 5), 'file{0}.txt'.format(index)).read().endswith('\n1.0.0\n')
+
+
+def test_parallel_errors_are_aggregated_in_order(tmpdir):
+    templates = tmpdir.mkdir('build_templates')
+    templates.join('b.txt').write('# build-template\n${version}\n')
+    templates.join('c').mkdir()
+    templates.join('a').mkdir()
+    engine = _engine(tmpdir, {'version': '1.0.0'})
+    engine.workers = 4
+
+    with pytest.raises(TemplateError) as err:
+        engine.generate_files()
+    assert [file for (file, _) in err.value.errors] == ['a', 'c']
+    assert tmpdir.join('b.txt').read() == '# build-template\n1.0.0\n'
+
+
+def test_compiled_template_matches_safe_substitute():
+    contents = '# build-template\n$version ${name}-$$escaped $missing ${missing} $ 100$ $1 ${ bad }\n$version'
+    variables = {'version': 1.5, 'name': 'mb'}
+    template = CompiledTemplate.compile(contents)
+
+    assert template.render(variables) == Template(contents).safe_substitute(variables)
+    assert template.placeholders == frozenset(['version', 'name', 'missing'])
+
+
+def test_affected_templates(tmpdir):
+    templates = tmpdir.mkdir('build_templates')
+    templates.join('version.txt').write('# build-template\n${version}\n')
+    templates.join('name.txt').write('# build-template\n${name}\n')
+    engine = _engine(tmpdir, {'version': '1.0.0', 'name': 'mb'})
+    engine.generate_files()
+
+    assert engine.affected_templates(['version']) == ['version.txt']
+    assert engine.affected_templates(['name', 'version']) == ['name.txt', 'version.txt']
+    assert engine.affected_templates(['other']) == []
+
+
+def test_compiled_templates_are_cached_between_runs(tmpdir):
+    _write_templates(tmpdir)
+    _engine(tmpdir, {'version': '1.0.0'}).generate_files()
+
+    engine = _engine(tmpdir, {'version': '1.0.1'})
+    engine.compiled_templates._load()
+    assert len(engine.compiled_templates._segments) == 1
+    engine.generate_files()
+    assert tmpdir.join('out', 'version.txt').read() == '# build-template|out/version.txt\nversion=1.0.1\n'
+
+
+def test_safe_chunks_keep_placeholders_whole():
+    contents = 'a$$b ${version}$version-$name$$$version ${ver'
+    variables = {'version': '1.0.0', 'name': 'mb'}
+    chunks = list(safe_chunks(io.StringIO(contents), 3))
+
+    assert ''.join(chunks) == contents
+    assert ''.join(CompiledTemplate.compile(chunk).render(variables) for chunk in chunks) == \
+        Template(contents).safe_substitute(variables)
+
+
+def test_streaming_generate_files(tmpdir):
+    body = ''.join('line ${{version}} {0} $name\n'.format(index) for index in range(1000))
+    templates = tmpdir.mkdir('build_templates')
+    templates.join('large.txt').write('# build-template|out/large.txt\n' + body)
+    engine = _engine(tmpdir, {'version': '1.0.0', 'name': 'mb'})
+    engine.streaming_threshold = 1024
+    engine.generate_files()
+
+    expected = Template('# build-template|out/large.txt\n' + body).safe_substitute({'version': '1.0.0', 'name': 'mb'})
+    assert tmpdir.join('out', 'large.txt').read() == expected
+    assert engine.affected_templates(['name']) == ['large.txt']
+    assert tmpdir.join('out').listdir() == [tmpdir.join('out', 'large.txt')]
+
+    output = tmpdir.join('out', 'large.txt')
+    os.utime(str(output), (0, 0))
+    _engine(tmpdir, {'version': '1.0.0', 'name': 'mb'}).generate_files()
+    assert output.mtime() == 0
@@ -0,0 +1,53 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import os
+
+import pytest
+
+from mb.lib import trace
+
+
+@pytest.fixture
+def tracing():
+    del trace._events[:]
+    trace.enable()
+    yield
+    trace._state['enabled'] = False
+    del trace._events[:]
+
+
+def test_disabled_spans_record_nothing():
+    del trace._events[:]
+    with trace.span('nothing', 'test'):
+        pass
+    assert trace.events() == []
+
+
+def test_spans_and_summary(tracing, tmpdir):
+    @trace.traced('outer', 'test')
+    def outer():
+        for file in ('a', 'b'):
+            with trace.span('inner', 'test', file=file):
+                pass
+
+    outer()
+    with pytest.raises(ValueError):
+        with trace.span('failing', 'test'):
+            raise ValueError('boom')
+
+    events = trace.events()
+    assert [event['name'] for event in events] == ['inner', 'inner', 'outer', 'failing']
+    assert events[0]['args'] == {'file': 'a'}
+    assert events[3]['args'] == {'error': "ValueError('boom')"}
+    assert events[2]['ts'] <= events[0]['ts'] and events[2]['dur'] >= events[0]['dur']
+
+    summary = trace.summary(events)
+    assert summary[0].split() == ['category', 'span', 'count', 'total', 'ms', 'mean', 'ms', 'max', 'ms']
+    assert [line.split()[:3] for line in summary[1:] if 'inner' in line] == [['test', 'inner', '2']]
+
+    trace.write(str(tmpdir))
+    with open(os.path.join(str(tmpdir), 'trace.json'), 'r') as trace_file:
+        assert len(json.load(trace_file)['traceEvents']) == 4
+    assert os.path.isfile(os.path.join(str(tmpdir), 'summary.txt'))
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import subprocess
+
+import pytest
+
+from mb.config.config import get_default_config_file
+from mb.lib import git_refs
+from mb.version_scheme import DefaultVersionScheme
+
+
+def _git(repo_dir, *arguments, **kw):
+    env = dict(os.environ, GIT_AUTHOR_NAME='mb', GIT_AUTHOR_EMAIL='mb@example.com',
+               GIT_COMMITTER_NAME='mb', GIT_COMMITTER_EMAIL='mb@example.com')
+    if kw.get('date'):
+        env.update(GIT_AUTHOR_DATE=kw['date'], GIT_COMMITTER_DATE=kw['date'])
+    return subprocess.check_output(('git',) + arguments, cwd=repo_dir, env=env).decode('utf-8').strip()
+
+
+@pytest.fixture
+def repo_dir(tmpdir):
+    repo_dir = str(tmpdir)
+    _git(repo_dir, 'init', '-q')
+    with open(os.path.join(repo_dir, '.mb.yml'), 'w') as config_file:
+        config_file.write('variables: {}\n')
+    _git(repo_dir, 'add', '.mb.yml')
+    _git(repo_dir, 'commit', '-q', '-m', 'first')
+    _git(repo_dir, 'tag', '-a', '1.0.0', '-m', '1.0.0')
+    _git(repo_dir, 'tag', 'lightweight-9.9.9')
+    _git(repo_dir, 'commit', '-q', '--allow-empty', '-m', 'second')
+    _git(repo_dir, 'commit', '-q', '--allow-empty', '-m', 'third')
+    return repo_dir
+
+
+def _version_scheme(repo_dir, increment='patch'):
+    version_scheme = DefaultVersionScheme(get_default_config_file(repo_dir, os.environ))
+    version_scheme.increment = increment
+    return version_scheme
+
+
+def test_git_refs(repo_dir):
+    git_dir = git_refs.find_git_dir(repo_dir)
+    assert git_refs.head_sha(git_dir) == _git(repo_dir, 'rev-parse', 'HEAD')
+
+    signature = git_refs.refs_signature(git_dir)
+    _git(repo_dir, 'pack-refs', '--all')
+    assert git_refs.refs_signature(git_dir) != signature
+    assert git_refs.read_packed_refs(git_dir.common_dir)['refs/tags/1.0.0'][1] == _git(repo_dir, 'rev-parse', 'HEAD~2')
+    assert git_refs.head_sha(git_dir) == _git(repo_dir, 'rev-parse', 'HEAD')
+
+
+def test_describe_matches_git(repo_dir):
+    version_scheme = _version_scheme(repo_dir)
+    pattern = '*[^a-z].*[^a-z].*[^a-z]'
+    assert version_scheme._describe(pattern) == _git(repo_dir, 'describe', '--match', pattern)
+    assert version_scheme._describe('2.*') is None
+
+    _git(repo_dir, 'tag', '-a', '1.0.1', '-m', '1.0.1')
+    assert _version_scheme(repo_dir)._describe(pattern) == '1.0.1'
+
+
+def test_version_is_cached(repo_dir):
+    head = _git(repo_dir, 'rev-parse', 'HEAD')
+    expected = {'hash': head, 'short_hash': head[:7], 'version': '1.0.1'}
+    assert _version_scheme(repo_dir).generate() == expected
+
+    # a cached run doesn't even open the repository
+    version_scheme = _version_scheme(repo_dir)
+    assert version_scheme.generate() == expected
+    assert version_scheme._repo is None
+
+    _git(repo_dir, 'tag', '-a', '1.0.5', '-m', '1.0.5')
+    assert _version_scheme(repo_dir).generate()['version'] == '1.0.5'
+    assert _version_scheme(repo_dir, 'none').generate()['version'] is None
+
+
+def test_nearest_tag_in_merged_history(tmpdir):
+    repo_dir = str(tmpdir)
+    _git(repo_dir, 'init', '-q')
+    with open(os.path.join(repo_dir, '.mb.yml'), 'w') as config_file:
+        config_file.write('variables: {}\n')
+    _git(repo_dir, 'add', '.mb.yml')
+    _git(repo_dir, 'commit', '-q', '-m', 'root', date='2020-01-01T00:00:00')
+    _git(repo_dir, 'branch', 'side')
+    for index in range(6):
+        _git(repo_dir, 'commit', '-q', '--allow-empty', '-m', 'main {0}'.format(index),
+             date='2020-01-01T01:0{0}:00'.format(index))
+    _git(repo_dir, 'tag', '-a', '1.0.2', '-m', '1.0.2')
+
+    # the tag of the side branch is newer, but further from HEAD once merged
+    _git(repo_dir, 'checkout', '-q', 'side')
+    _git(repo_dir, 'commit', '-q', '--allow-empty', '-m', 'side', date='2020-02-01T00:00:00')
+    _git(repo_dir, 'tag', '-a', '1.0.1', '-m', '1.0.1')
+    _git(repo_dir, 'checkout', '-q', '-')
+    _git(repo_dir, 'merge', '-q', '--no-ff', '-m', 'merge', 'side', date='2020-03-01T00:00:00')
+
+    pattern = '*[^a-z].*[^a-z].*[^a-z]'
+    assert _git(repo_dir, 'describe', '--match', pattern).startswith('1.0.2-2-g')
+    assert _version_scheme(repo_dir)._describe(pattern) == _git(repo_dir, 'describe', '--match', pattern)
+    assert _version_scheme(repo_dir).generate()['version'] == '1.0.3'
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import subprocess
+
+import pytest
+
+from mb.cli.watch import input_root
+from mb.cli.watch import matches_input
+from mb.cli.watch import WatchSession
+from mb.config.config import get_default_config_file
+from mb.lib import ioc
+from mb.lib.watcher import InotifyWatcher
+from mb.lib.watcher import PollingWatcher
+
+
+def test_input_root():
+    assert input_root('src/**/*.py') == 'src'
+    assert input_root('*.yml') == ''
+    assert input_root('docs/index.md') == 'docs'
+
+
+def test_matches_input():
+    assert matches_input('src/**/*.py', os.path.join('src', 'a.py'))
+    assert matches_input('src/**/*.py', os.path.join('src', 'pkg', 'a.py'))
+    assert not matches_input('src/**/*.py', os.path.join('src', 'a.txt'))
+    assert not matches_input('*.yml', os.path.join('src', 'a.py'))
+    # '*' doesn't cross directories, like for the inputs the result cache hashes
+    assert not matches_input('*.yml', os.path.join('src', 'a.yml'))
+    assert not matches_input('src/*.py', os.path.join('src', 'pkg', 'a.py'))
+    assert matches_input('src/../setup.cfg', 'setup.cfg')
+
+
+def _write(path, text):
+    with open(path, 'w') as fh:
+        fh.write(text)
+
+
+@pytest.mark.parametrize('watcher_class', [PollingWatcher, InotifyWatcher])
+def test_watcher_reports_changes(tmpdir, watcher_class):
+    root = str(tmpdir)
+    os.makedirs(os.path.join(root, 'src', 'pkg'))
+    os.makedirs(os.path.join(root, 'ignored'))
+    _write(os.path.join(root, 'src', 'pkg', 'a.py'), 'a')
+
+    try:
+        watcher = watcher_class([root], [os.path.join(root, 'ignored')], debounce=0.1)
+    except OSError:
+        pytest.skip('inotify is not available')
+
+    try:
+        assert watcher.changes(timeout=0.1) == set()
+
+        _write(os.path.join(root, 'ignored', 'b.py'), 'b')
+        _write(os.path.join(root, 'src', 'pkg', 'a.py'), 'changed')
+        _write(os.path.join(root, 'src', 'c.py'), 'c')
+        changed = watcher.changes(timeout=2)
+        assert os.path.join(root, 'src', 'pkg', 'a.py') in changed
+        assert os.path.join(root, 'src', 'c.py') in changed
+        assert not any(path.startswith(os.path.join(root, 'ignored')) for path in changed)
+
+        watcher.drain()
+        assert watcher.changes(timeout=0.1) == set()
+    finally:
+        watcher.close()
+
+
+_config = """
+name: sample_config
+config:
+    commands:
+        generate:
+            name: ShellCommand
+            config:
+                command: echo generate >> {runs}
+                inputs: ['src/**/*.txt']
+                outputs: ['build/**/*.txt']
+        package:
+            name: ShellCommand
+            config:
+                command: echo package >> {runs}
+                inputs: ['*.cfg']
+                dependencies: [generate]
+        lint:
+            name: ShellCommand
+            config:
+                command: echo lint >> {runs}
+                inputs: ['src/**/*.py']
+"""
+
+
+def test_watch_session(tmpdir):
+    root = str(tmpdir)
+    runs = tmpdir.join('runs.txt')
+    tmpdir.join('.mb.yml').write(_config.format(runs=runs))
+    env = dict(os.environ, GIT_AUTHOR_NAME='mb', GIT_AUTHOR_EMAIL='mb@example.com',
+               GIT_COMMITTER_NAME='mb', GIT_COMMITTER_EMAIL='mb@example.com')
+    subprocess.check_call(['git', 'init', '-q'], cwd=root, env=env)
+    subprocess.check_call(['git', 'commit', '-q', '--allow-empty', '-m', 'first'], cwd=root, env=env)
+
+    session = WatchSession('package', polling=True, project=ioc.Project(get_default_config_file(root)))
+    try:
+        session.run()
+        assert runs.read() == 'generate\npackage\n'
+
+        # lint isn't part of what is watched
+        assert session.affected_commands({os.path.join(root, 'src', 'a.py')}) == set()
+        assert session.affected_commands({os.path.join(root, 'setup.cfg')}) == {'package'}
+        affected = session.affected_commands({os.path.join(root, 'src', 'pkg', 'a.txt')})
+        assert affected == {'generate', 'package'}
+        assert session.affected_commands({os.path.join(session.config.template_dir, 'a.txt')}) == \
+            {'_prerun', 'generate', 'package'}
+
+        session.run(affected)
+        assert runs.read() == 'generate\npackage\ngenerate\npackage\n'
+
+        # the outputs of the commands are dropped, the edits made during a run are kept
+        edit = os.path.join(root, 'src', 'a.txt')
+        outputs = {os.path.join(root, 'build', 'a.txt'), os.path.join(session.config.artifact_dir, 'cache', 'a.json')}
+        assert session.user_changes(outputs | {edit}) == {edit}
+    finally:
+        session.watcher.close()
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import subprocess
+
+import pytest
+
+from mb.cli.workspace import Workspace
+from mb.config.discovery import find_projects
+from mb.config.errors import ConfigurationError
+from mb.lib import git_refs
+from mb.lib.scheduler import CycleError
+
+
+def _git(repo_dir, *arguments):
+    env = dict(os.environ, GIT_AUTHOR_NAME='mb', GIT_AUTHOR_EMAIL='mb@example.com',
+               GIT_COMMITTER_NAME='mb', GIT_COMMITTER_EMAIL='mb@example.com')
+    return subprocess.check_output(('git',) + arguments, cwd=repo_dir, env=env).decode('utf-8').strip()
+
+
+def _project(root, path, name, dependencies=(), command=None):
+    lines = ['name: {0}'.format(name), 'config:',
+             '    plugin_dir: {0}'.format(os.path.relpath(str(root.join('plugins')), str(root.join(path)))),
+             '    project_dependencies: [{0}]'.format(', '.join(dependencies)),
+             '    commands:']
+    if command:
+        lines += ['        build:', '            name: ShellCommand', '            config:',
+                  '                command: "{0}"'.format(command)]
+    else:
+        lines += ['        lint:', '            name: ShellCommand']
+    root.join(path, '.mb.yml').write('\n'.join(lines) + '\n', ensure=True)
+
+
+@pytest.fixture
+def monorepo(tmpdir):
+    root = tmpdir.join('monorepo')
+    log = str(tmpdir.join('build.log'))
+    _project(root, 'libs/core', 'core', command='echo core >> {0}'.format(log))
+    _project(root, 'apps/api', 'api', ['core'], command='echo api >> {0}'.format(log))
+    _project(root, 'apps/web', 'web', ['api', 'core'], command='echo web >> {0}'.format(log))
+    _project(root, 'docs', 'docs')
+    root.join('node_modules', 'dep', '.mb.yml').write('name: dep\n', ensure=True)
+    root.join('.hidden', '.mb.yml').write('name: hidden\n', ensure=True)
+    root.join('plugins').ensure(dir=True)
+
+    _git(str(root), 'init', '-q')
+    _git(str(root), 'add', '.')
+    _git(str(root), 'commit', '-q', '-m', 'first')
+    _git(str(root), 'tag', '-a', '1.0.0', '-m', '1.0.0')
+    return root
+
+
+def test_find_projects(monorepo):
+    assert find_projects(str(monorepo)) == [str(monorepo.join(path, '.mb.yml'))
+                                            for path in ('apps/api', 'apps/web', 'docs', 'libs/core')]
+
+
+def test_git_dir_found_from_a_subproject(monorepo):
+    assert git_refs.find_git_dir(str(monorepo.join('apps', 'api'))).git_dir == str(monorepo.join('.git'))
+
+
+def test_run_in_dependency_order(monorepo, tmpdir):
+    workspace = Workspace(str(monorepo))
+    assert list(workspace.configs) == ['api', 'web', 'docs', 'core']
+
+    workspace.run('build', jobs=4)
+    assert tmpdir.join('build.log').read() == 'core\napi\nweb\n'
+    # the projects share their plugin dir
+    assert workspace.project('api').plugins is workspace.project('web').plugins
+
+
+def test_selected_projects_run_with_their_dependencies(monorepo, tmpdir):
+    workspace = Workspace(str(monorepo))
+    assert sorted(workspace.selection(['api']).nodes) == ['api', 'core']
+
+    workspace.run('build', names=['api'])
+    assert tmpdir.join('build.log').read() == 'core\napi\n'
+
+    with pytest.raises(ConfigurationError):
+        workspace.selection(['mobile'])
+
+
+def test_invalid_workspaces(monorepo):
+    _project(monorepo, 'libs/core', 'core', ['web'])
+    with pytest.raises(CycleError):
+        Workspace(str(monorepo))
+
+    _project(monorepo, 'libs/core', 'core', ['mobile'])
+    with pytest.raises(ConfigurationError):
+        Workspace(str(monorepo))
+
+    _project(monorepo, 'libs/core', 'api')
+    with pytest.raises(ConfigurationError):
+        Workspace(str(monorepo))
+
+
+def test_unknown_command(monorepo):
+    project = Workspace(str(monorepo)).project('docs')
+
+    with pytest.raises(ConfigurationError) as err:
+        project.load_command('build')
+    assert 'The following command: build is not available' in str(err.value)